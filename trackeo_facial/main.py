@@ -1,22 +1,247 @@
 # main.py (modificado para Flask en lugar de menú en terminal)
 
-from flask import Flask, render_template, send_from_directory, request, redirect, url_for
+from flask import Flask, render_template, send_from_directory, request, redirect, url_for, jsonify, Response, g
 import os
-import cv2
-import pandas as pd
-from datetime import datetime
-from scripts.helpers import distancia, detectar_microexpresiones, mostrar_imagen_ajustada
-import mediapipe as mp
+import gzip
+import hashlib
+import json
+import atexit
+import time
+import zipfile
+import numpy as np
+from scripts.helpers import detectar_microexpresiones_lote
+from scripts.face_mesh_pool import obtener_pool, cerrar_pool
+from scripts.batch import analizar_lote, filas_resultados, guardar_landmarks, iterar_zip, LimiteLote, LoteExcedido
+from scripts.results_store import obtener_store, fila_imagen
+from scripts.result_cache import obtener_cache, hash_imagen
+from scripts.features import landmarks_a_array
+from scripts.jobs import obtener_cola, cerrar_cola, ColaLlena
+from scripts.uploads import decodificar_imagen, max_lado_configurado, obtener_almacen, cerrar_almacen
+from scripts.landmark_store import obtener_landmark_store, cerrar_landmark_store, metadatos_imagen
+from scripts import metrics
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('data', exist_ok=True)
 
+# Recursos propios de cada proceso (instancias de FaceMesh, hilos, archivos abiertos).
+# Se crean al importar; con scripts.serve (TRACKEO_PREFORK=1) se crean en cada
+# worker después del fork, porque ni los grafos de MediaPipe ni los hilos sobreviven a un fork.
+pool_facemesh = None
+results_store = None
+result_cache = None
+almacen_uploads = None
+landmark_store = None
+cola_trabajos = None
+
+def iniciar_recursos():
+    """Crea los recursos del proceso y registra sus gauges"""
+    global pool_facemesh, results_store, result_cache, almacen_uploads, landmark_store, cola_trabajos
+
+    # Pool de FaceMesh compartido: se crea y calienta una sola vez al arrancar
+    pool_facemesh = obtener_pool(max_num_faces=int(os.environ.get('FACEMESH_MAX_FACES', 4)))
+    pool_facemesh.calentar()
+
+    results_store = obtener_store()
+    result_cache = obtener_cache()
+
+    # Los originales se guardan en segundo plano por hash (UPLOADS_PERSIST=0 lo desactiva)
+    almacen_uploads = obtener_almacen()
+
+    # Landmarks crudos de cada rostro guardado, para recalcular sin FaceMesh (LANDMARKS_PERSIST=0 lo desactiva)
+    landmark_store = obtener_landmark_store()
+
+    # Análisis asíncrono: las subidas a /api/jobs se procesan en un pool acotado
+    cola_trabajos = obtener_cola()
+
+    # Gauges que se leen en cada scrape de /metrics
+    # (los valores que solo crecen se exportan como counters <nombre>_total)
+    metrics.REGISTRO.medidor('trackeo_cache', "Estado del cache de resultados", result_cache.metricas, 'metrica',
+                             monotonos=('aciertos_memoria', 'aciertos_disco', 'fallos', 'desalojos_disco'))
+    metrics.REGISTRO.medidor('trackeo_pool_facemesh', "Estado del pool de FaceMesh", pool_facemesh.metricas, 'metrica',
+                             monotonos=('prestamos', 'esperas'))
+    metrics.REGISTRO.medidor('trackeo_trabajos', "Estado de la cola de trabajos", cola_trabajos.metricas, 'metrica',
+                             monotonos=('enviados', 'completados', 'fallidos', 'rechazados'))
+    if landmark_store is not None:
+        metrics.REGISTRO.medidor('trackeo_landmarks', "Registros del archivo de landmarks",
+                                 landmark_store.metricas, 'metrica', monotonos=('registros', 'shards'))
+
+    atexit.register(cerrar_recursos)
+
+def cerrar_recursos():
+    """Termina la cola, vacía los almacenes y libera el pool (se puede llamar más de una vez)"""
+    cerrar_cola()
+    cerrar_landmark_store()
+    cerrar_almacen()
+    cerrar_pool()
+
+if os.environ.get('TRACKEO_PREFORK') != '1':
+    iniciar_recursos()
+
+# Perfilado por petición con ?perfil=1 o la cabecera X-Perfil: 1 (PERFILADO=0 lo desactiva)
+PERFILADO_PERMITIDO = os.environ.get('PERFILADO', '1') != '0'
+
+@app.before_request
+def iniciar_instrumentacion():
+    metrics.iniciar_traza()
+    g.perfilador = None
+    if PERFILADO_PERMITIDO and (request.args.get('perfil') == '1' or request.headers.get('X-Perfil') == '1'):
+        perfilador = metrics.Perfilador()
+        if perfilador.iniciar():
+            g.perfilador = perfilador
+
+@app.after_request
+def terminar_instrumentacion(respuesta):
+    traza = metrics.terminar_traza()
+    if traza:
+        respuesta.headers['Server-Timing'] = metrics.server_timing(traza)
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None:
+        respuesta.headers['X-Perfil'] = guardar_perfil(perfilador)
+    return respuesta
+
+@app.teardown_request
+def liberar_perfilador(error=None):
+    # after_request no corre si la vista lanza una excepción: el perfil se detiene
+    # aquí igual, si no el candado del perfilador quedaría tomado para siempre
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None:
+        guardar_perfil(perfilador)
+
+def guardar_perfil(perfilador):
+    """Detiene el perfil de la petición y lo escribe en data/perfiles/; devuelve la ruta"""
+    reporte = perfilador.terminar()
+    os.makedirs('data/perfiles', exist_ok=True)
+    ruta = os.path.join('data/perfiles', f"{time.strftime('%Y%m%d_%H%M%S')}_{request.endpoint}.txt")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write(reporte)
+    return ruta
+
+@app.route('/metrics')
+def metricas_prometheus():
+    return Response(metrics.REGISTRO.exponer(), content_type=metrics.TIPO_CONTENIDO)
+
 @app.route('/get_csv')
 def get_csv():
     return send_from_directory('data', 'emociones_imagen.csv')
 
+@app.route('/api/history')
+def api_history():
+    cursor = request.args.get('cursor', type=int)
+    limite = min(max(request.args.get('limite', 50, type=int), 1), 500)
+    filtros = {clave: request.args.get(clave) or None for clave in ('desde', 'hasta', 'emocion', 'imagen')}
+
+    # El ETag depende de la versión del store y de la consulta, así no se relee nada si no cambió
+    consulta = f"{cursor}|{limite}|{sorted(filtros.items())}"
+    etag = hashlib.sha1(f"{results_store.version()}|{consulta}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+
+    filas, siguiente = results_store.consultar(cursor=cursor, limite=limite, **filtros)
+    cuerpo = json.dumps({'filas': filas, 'siguiente': siguiente}, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json; charset=utf-8', 'ETag': f'"{etag}"',
+               'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and len(cuerpo) > 1024:
+        cuerpo = gzip.compress(cuerpo, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+    return cuerpo, 200, headers
+
+@app.route('/api/pool')
+def pool_metricas():
+    return jsonify(pool_facemesh.metricas())
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # Tope de imágenes y bytes sin comprimir (BATCH_MAX_IMAGENES, BATCH_MAX_MB), sueltas y dentro de zips
+    limite = LimiteLote()
+    if request.content_length is not None and request.content_length > limite.max_bytes:
+        return jsonify({'error': f"La petición supera el máximo de {limite.max_bytes // (1024 * 1024)} MB"}), 413
+
+    items = []
+    try:
+        for f in request.files.getlist('images'):
+            if f.filename:
+                datos = f.read()
+                limite.agregar(len(datos))
+                items.append((f.filename, datos))
+        for archivo_zip in request.files.getlist('zip'):
+            items.extend(iterar_zip(archivo_zip.read(), limite))
+    except LoteExcedido as e:
+        return jsonify({'error': str(e)}), 413
+    except zipfile.BadZipFile as e:
+        return jsonify({'error': f"Zip inválido: {e}"}), 400
+    if not items:
+        return jsonify({'error': "No se enviaron imágenes"}), 400
+
+    resultados, resumen = analizar_lote(items)
+    hora = time.strftime('%Y-%m-%d %H:%M:%S')
+    resumen['guardadas'] = results_store.agregar(filas_resultados(resultados, hora))
+    if landmark_store is not None:
+        guardar_landmarks(landmark_store, resultados, hora)
+    for resultado in resultados:
+        # Los landmarks crudos no viajan en la respuesta
+        resultado.pop('landmarks', None)
+        resultado.pop('shape', None)
+    return jsonify({'resumen': resumen, 'resultados': resultados})
+
+@app.route('/api/cache')
+def cache_metricas():
+    return jsonify(result_cache.metricas())
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def api_jobs():
+    if request.method == 'GET':
+        return jsonify(cola_trabajos.metricas())
+
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify({'error': "No se envió archivo"}), 400
+
+    try:
+        trabajo = cola_trabajos.enviar(trabajo_imagen, file.read(), file.filename)
+    except ColaLlena as e:
+        respuesta = jsonify({'error': str(e)})
+        respuesta.headers['Retry-After'] = '1'
+        return respuesta, 503
+
+    datos = trabajo.a_dict()
+    datos['url'] = url_for('api_job', id_trabajo=trabajo.id)
+    return jsonify(datos), 202
+
+@app.route('/api/jobs/<id_trabajo>')
+def api_job(id_trabajo):
+    trabajo = cola_trabajos.obtener(id_trabajo)
+    if trabajo is None:
+        return jsonify({'error': "Trabajo no encontrado"}), 404
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(eventos_trabajo(trabajo), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    # Long polling opcional: ?esperar=segundos (máximo 30)
+    esperar = min(max(request.args.get('esperar', 0, type=float), 0), 30)
+    if esperar:
+        trabajo.esperar(esperar)
+    return jsonify(trabajo.a_dict())
+
+def eventos_trabajo(trabajo, intervalo=0.5, maximo=60):
+    """Eventos SSE con cada cambio de estado hasta que el trabajo termina"""
+    limite = time.monotonic() + maximo
+    estado = None
+    while True:
+        # El primer evento sale sin esperar, con el estado actual
+        terminado = trabajo.esperar(intervalo if estado else 0)
+        if trabajo.estado != estado:
+            estado = trabajo.estado
+            yield f"data: {json.dumps(trabajo.a_dict())}\n\n"
+        if terminado or time.monotonic() > limite:
+            return
+
+def trabajo_imagen(datos, nombre):
+    emociones, detalles = procesar_imagen(datos, nombre)
+    return {'imagen': nombre, 'emociones': emociones, 'detalles': detalles}
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     emociones_detectadas = None
@@ -31,53 +256,72 @@ def index():
         if file.filename == '':
             return "Ningún archivo seleccionado"
 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(filepath)
-        emociones_detectadas, detalles = procesar_imagen(filepath)
+        emociones_detectadas, detalles = procesar_imagen(file.read(), file.filename)
         imagen_filename = file.filename
 
     return render_template('index.html', emociones=emociones_detectadas, detalles=detalles, imagen=imagen_filename)
 
-def procesar_imagen(ruta_imagen):
-    imagen = cv2.imread(ruta_imagen)
-    mp_face_mesh = mp.solutions.face_mesh
-    face_mesh = mp_face_mesh.FaceMesh(refine_landmarks=True)
-    results = face_mesh.process(cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB))
+def procesar_imagen(datos, nombre):
+    """Analiza una imagen subida directamente desde memoria"""
+    import cv2
 
-    emociones_detectadas = []
-    valores_medidos = {}
-    confianza = {}
+    nombre = os.path.basename(nombre)
+    digest = hash_imagen(datos)
+    if almacen_uploads is not None:
+        almacen_uploads.guardar(datos, nombre, digest)
 
-    if results.multi_face_landmarks:
-        for face_landmarks in results.multi_face_landmarks:
-            ih, iw, _ = imagen.shape
-            resultado = detectar_microexpresiones(face_landmarks.landmark, (ih, iw), mostrar_detalles=True)
+    # Una imagen ya analizada con el mismo detector se resuelve sin inferencia
+    clave = result_cache.clave(datos, digest)
+    with metrics.span('cache_lectura'):
+        entrada = result_cache.obtener(clave)
+    if entrada is not None:
+        resultados_rostros = entrada['resultados']
+        landmarks_rostros = entrada['landmarks']
+        shape = entrada['shape']
+    else:
+        with metrics.span('decodificar'):
+            imagen, shape = decodificar_imagen(datos, max_lado_configurado())
+        if imagen is None:
+            metrics.IMAGENES.incrementar(resultado='ilegible')
+            return "No se pudo leer la imagen", {}
+        with metrics.span('mesh'):
+            results = pool_facemesh.procesar(cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB))
+
+        resultados_rostros = []
+        landmarks_rostros = np.empty((0, 478, 3), dtype=np.float32)
+        if results.multi_face_landmarks:
+            # Todos los rostros de la imagen se evalúan en una sola pasada de reglas
+            with metrics.span('microexpresiones'):
+                landmarks_rostros = np.stack([landmarks_a_array(f.landmark) for f in results.multi_face_landmarks])
+                resultados_rostros = detectar_microexpresiones_lote(landmarks_rostros, shape, imagen=imagen)
+        with metrics.span('cache_escritura'):
+            result_cache.guardar(clave, resultados_rostros, landmarks_rostros, shape)
+
+    if resultados_rostros:
+        # Una fila por rostro, todas agregadas al historial en una sola escritura
+        hora = time.strftime('%Y-%m-%d %H:%M:%S')
+        textos = []
+        filas = []
+        for id_rostro, resultado in enumerate(resultados_rostros, start=1):
             emociones_detectadas = resultado.get('emociones', [])
-            valores_medidos = resultado.get('valores', {})
-            confianza = resultado.get('confianza', {})
-
-        # Guardar resultados
-        texto_emocion = ", ".join(emociones_detectadas) if emociones_detectadas else "Neutral"
-        datos_guardar = {
-            'Hora': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-            'Imagen': [os.path.basename(ruta_imagen)],
-            'Emociones': [texto_emocion],
-            'Apertura_Boca': [valores_medidos.get('apertura_boca', 0)],
-            'Anchura_Boca': [valores_medidos.get('anchura_boca', 0)],
-            'Elevacion_Cejas': [valores_medidos.get('elevacion_cejas', 0)]
-        }
-
-        archivo_csv = "data/emociones_imagen.csv"
-        if os.path.exists(archivo_csv):
-            df_existente = pd.read_csv(archivo_csv)
-            df_nuevo = pd.DataFrame(datos_guardar)
-            df_total = pd.concat([df_existente, df_nuevo], ignore_index=True)
-        else:
-            df_total = pd.DataFrame(datos_guardar)
-        df_total.to_csv(archivo_csv, index=False)
+            texto = ", ".join(emociones_detectadas) if emociones_detectadas else "Neutral"
+            textos.append(texto)
+            filas.append(fila_imagen(nombre, texto, resultado.get('valores', {}), hora, rostro=id_rostro))
+            metrics.registrar_emociones(emociones_detectadas or ["Neutral"])
+        with metrics.span('escritura'):
+            results_store.agregar(filas)
+            if landmark_store is not None and len(landmarks_rostros) == len(filas):
+                landmark_store.agregar(landmarks_rostros, metadatos_imagen(nombre, shape, len(filas), hora, digest))
+        metrics.IMAGENES.incrementar(resultado='con_rostro')
+        metrics.ROSTROS.incrementar(len(resultados_rostros), ruta='imagen')
 
-        return texto_emocion, valores_medidos
+        if len(textos) == 1:
+            texto_emocion = textos[0]
+        else:
+            texto_emocion = " | ".join(f"Rostro {i}: {texto}" for i, texto in enumerate(textos, start=1))
+        return texto_emocion, resultados_rostros[0].get('valores', {})
 
+    metrics.IMAGENES.incrementar(resultado='sin_rostro')
     return "No se detectó rostro", {}
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+import argparse
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from scripts.face_mesh_pool import obtener_pool
+from scripts.features import landmarks_a_array
+from scripts.helpers import detectar_microexpresiones_lote
+from scripts.landmark_store import LandmarkStore, metadatos_imagen, DIRECTORIO_LANDMARKS
+from scripts.results_store import crear_store, fila_imagen, ARCHIVO_HISTORIAL
+from scripts.result_cache import obtener_cache, hash_imagen
+from scripts.uploads import decodificar_imagen, max_lado_configurado
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+class LoteExcedido(Exception):
+    """Se rechaza un lote porque supera el límite de imágenes o de bytes sin comprimir"""
+
+
+class LimiteLote:
+    """Cuenta las imágenes y los bytes sin comprimir de un lote y lo corta al pasar los límites"""
+
+    def __init__(self, max_imagenes=None, max_bytes=None):
+        self.max_imagenes = max_imagenes or int(os.environ.get('BATCH_MAX_IMAGENES', 500))
+        self.max_bytes = max_bytes or int(os.environ.get('BATCH_MAX_MB', 256)) * 1024 * 1024
+        self.imagenes = 0
+        self.bytes = 0
+
+    def agregar(self, tamano):
+        """Suma una imagen de `tamano` bytes; lanza LoteExcedido si el lote pasa de algún límite"""
+        self.imagenes += 1
+        self.bytes += tamano
+        if self.imagenes > self.max_imagenes:
+            raise LoteExcedido(f"El lote supera el máximo de {self.max_imagenes} imágenes")
+        if self.bytes > self.max_bytes:
+            raise LoteExcedido(f"El lote supera el máximo de {self.max_bytes // (1024 * 1024)} MB sin comprimir")
+
+
+def _iniciar_worker():
+    """Crea y calienta el FaceMesh propio de cada proceso del pool"""
+    obtener_pool(tamano=1, max_num_faces=int(os.environ.get('FACEMESH_MAX_FACES', 4))).calentar()
+
+
+def analizar_imagen(nombre, origen, digest=None):
+    """
+    Decodifica una imagen, ejecuta FaceMesh y detecta microexpresiones
+
+    Args:
+        nombre: Nombre con el que se registra la imagen
+        origen: Ruta del archivo o bytes de la imagen codificada
+        digest: Hash del contenido si quien llama ya lo calculó
+
+    Returns:
+        dict: Imagen, emociones, valores, landmarks (F, N, 3), shape y tiempos por etapa en milisegundos
+    """
+    import cv2
+
+    t0 = time.perf_counter()
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        datos = bytes(origen)
+    else:
+        with open(origen, 'rb') as f:
+            datos = f.read()
+
+    digest = digest or hash_imagen(datos)
+    resultado = {'imagen': nombre, 'hash': digest, 'rostro': False, 'emociones': None, 'valores': {}, 'cache': False}
+    cache = obtener_cache()
+    clave = cache.clave(datos, digest)
+    entrada = cache.obtener(clave)
+    if entrada is not None:
+        resultado['cache'] = True
+        _asignar_analisis(resultado, entrada['resultados'])
+        resultado['landmarks'] = entrada['landmarks']
+        resultado['shape'] = entrada['shape']
+        resultado['tiempos_ms'] = {'total': (time.perf_counter() - t0) * 1000}
+        return resultado
+
+    imagen, shape = decodificar_imagen(datos, max_lado_configurado())
+    t1 = time.perf_counter()
+
+    if imagen is None:
+        resultado['error'] = "No se pudo decodificar la imagen"
+        resultado['tiempos_ms'] = {'decodificar': (t1 - t0) * 1000}
+        return resultado
+
+    results = obtener_pool(tamano=1).procesar(cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB))
+    t2 = time.perf_counter()
+
+    analisis_rostros = []
+    landmarks_rostros = np.empty((0, 478, 3), dtype=np.float32)
+    if results.multi_face_landmarks:
+        landmarks_rostros = np.stack([landmarks_a_array(f.landmark) for f in results.multi_face_landmarks])
+        analisis_rostros = detectar_microexpresiones_lote(landmarks_rostros, shape, imagen=imagen)
+    _asignar_analisis(resultado, analisis_rostros)
+    resultado['landmarks'] = landmarks_rostros
+    resultado['shape'] = shape
+    t3 = time.perf_counter()
+    cache.guardar(clave, analisis_rostros, landmarks_rostros, shape)
+
+    resultado['tiempos_ms'] = {
+        'decodificar': (t1 - t0) * 1000,
+        'mesh': (t2 - t1) * 1000,
+        'analisis': (t3 - t2) * 1000,
+        'total': (t3 - t0) * 1000
+    }
+    return resultado
+
+
+def _asignar_analisis(resultado, analisis_rostros):
+    """Copia al resultado las emociones y valores de cada rostro (el primero queda como principal)"""
+    if not analisis_rostros:
+        return
+    resultado['rostro'] = True
+    resultado['rostros'] = []
+    for analisis in analisis_rostros:
+        emociones = analisis.get('emociones', [])
+        resultado['rostros'].append({
+            'emociones': ", ".join(emociones) if emociones else "Neutral",
+            'valores': analisis.get('valores', {})
+        })
+    resultado['emociones'] = resultado['rostros'][0]['emociones']
+    resultado['valores'] = resultado['rostros'][0]['valores']
+
+
+def _analizar_item(item):
+    """Analiza un elemento del lote; un archivo ilegible o un fallo de FaceMesh no tumba el lote entero"""
+    nombre, origen = item
+    try:
+        return analizar_imagen(nombre, origen)
+    except Exception as e:
+        digest = hash_imagen(bytes(origen)) if isinstance(origen, (bytes, bytearray, memoryview)) else None
+        return {'imagen': nombre, 'hash': digest, 'rostro': False, 'emociones': None, 'valores': {},
+                'cache': False, 'error': f"{type(e).__name__}: {e}", 'tiempos_ms': {}}
+
+
+_executor = None
+
+
+def obtener_executor(procesos=None):
+    """Devuelve el pool de procesos compartido, cada uno con su propio FaceMesh"""
+    global _executor
+    if _executor is None:
+        # spawn evita heredar los hilos de MediaPipe del proceso padre
+        contexto = multiprocessing.get_context('spawn')
+        _executor = ProcessPoolExecutor(max_workers=procesos or os.cpu_count(),
+                                        mp_context=contexto,
+                                        initializer=_iniciar_worker)
+    return _executor
+
+
+def analizar_lote(items, procesos=None):
+    """
+    Analiza muchas imágenes en paralelo
+
+    Args:
+        items: Iterable de tuplas (nombre, ruta_o_bytes)
+        procesos: Número de procesos del pool (por defecto, CPUs disponibles)
+
+    Returns:
+        tuple: (lista de resultados por imagen, resumen de rendimiento)
+    """
+    items = list(items)
+    inicio = time.perf_counter()
+    executor = obtener_executor(procesos)
+    resultados = list(executor.map(_analizar_item, items, chunksize=max(1, len(items) // 32)))
+    segundos = time.perf_counter() - inicio
+
+    tiempos = [r['tiempos_ms'].get('total', 0.0) for r in resultados]
+    resumen = {
+        'imagenes': len(resultados),
+        'con_rostro': sum(1 for r in resultados if r['rostro']),
+        'errores': sum(1 for r in resultados if 'error' in r),
+        'aciertos_cache': sum(1 for r in resultados if r.get('cache')),
+        'segundos': round(segundos, 3),
+        'imagenes_por_segundo': round(len(resultados) / segundos, 2) if segundos > 0 else 0.0,
+        'ms_por_imagen_promedio': round(float(np.mean(tiempos)), 2) if tiempos else 0.0
+    }
+    return resultados, resumen
+
+
+def filas_resultados(resultados, hora=None):
+    """Convierte los resultados con rostro en filas del historial"""
+    hora = hora or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [fila_imagen(r['imagen'], rostro['emociones'], rostro['valores'], hora, rostro=i)
+            for r in resultados if r['rostro']
+            for i, rostro in enumerate(r['rostros'], start=1)]
+
+
+def guardar_landmarks(landmark_store, resultados, hora):
+    """Agrega al archivo los landmarks de los resultados con rostro (mismo orden y hora que sus filas)"""
+    agregados = 0
+    for r in resultados:
+        landmarks = r.get('landmarks')
+        if r['rostro'] and landmarks is not None and len(landmarks) == len(r['rostros']):
+            agregados += landmark_store.agregar(
+                landmarks, metadatos_imagen(r['imagen'], r.get('shape'), len(landmarks), hora, r.get('hash')))
+    return agregados
+
+
+def iterar_directorio(directorio):
+    """Genera (nombre, ruta) para cada imagen dentro del directorio"""
+    for raiz, _, archivos in os.walk(directorio):
+        for archivo in sorted(archivos):
+            if archivo.lower().endswith(EXTENSIONES_IMAGEN):
+                yield archivo, os.path.join(raiz, archivo)
+
+
+def iterar_zip(datos, limite=None):
+    """
+    Genera (nombre, bytes) para cada imagen dentro de un zip
+
+    Args:
+        datos: Bytes del zip
+        limite: LimiteLote opcional; cada miembro se cuenta por su tamaño declarado antes de
+            descomprimirlo (zipfile no lee más de ese tamaño), así un zip bomba se corta sin inflarse
+    """
+    with zipfile.ZipFile(io.BytesIO(datos)) as archivo_zip:
+        for info in archivo_zip.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(EXTENSIONES_IMAGEN):
+                if limite is not None:
+                    limite.agregar(info.file_size)
+                yield os.path.basename(info.filename), archivo_zip.read(info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analiza todas las imágenes de una carpeta")
+    parser.add_argument('directorio', nargs='?', default='uploads', help="Carpeta con imágenes")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo")
+    parser.add_argument('--store', default=os.environ.get('RESULTS_STORE', f"csv:{ARCHIVO_HISTORIAL}"),
+                        help="Destino de resultados: csv:<ruta> o sqlite:<ruta>")
+    parser.add_argument('--no-guardar', action='store_true', help="Solo analizar, sin escribir resultados")
+    parser.add_argument('--landmarks', default=DIRECTORIO_LANDMARKS,
+                        help="Archivo de landmarks crudos ('' para no guardarlos)")
+    args = parser.parse_args()
+
+    resultados, resumen = analizar_lote(iterar_directorio(args.directorio), args.procesos)
+
+    for r in resultados:
+        estado = r['emociones'] if r['rostro'] else r.get('error', "No se detectó rostro")
+        print(f"{r['imagen']}: {estado} ({r['tiempos_ms'].get('total', 0):.1f} ms)")
+
+    if not args.no_guardar:
+        hora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        guardadas = crear_store(args.store).agregar(filas_resultados(resultados, hora))
+        print(f"\n✅ {guardadas} filas agregadas a {args.store}")
+        if args.landmarks:
+            landmark_store = LandmarkStore(args.landmarks)
+            print(f"✅ {guardar_landmarks(landmark_store, resultados, hora)} rostros agregados a {args.landmarks}")
+            landmark_store.cerrar()
+
+    print(f"📈 {resumen['imagenes']} imágenes en {resumen['segundos']} s "
+          f"({resumen['imagenes_por_segundo']} img/s, {resumen['ms_por_imagen_promedio']} ms/img)")
+
+
+if __name__ == '__main__':
+    main()
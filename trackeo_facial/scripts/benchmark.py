@@ -0,0 +1,412 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from scripts.features import (extraer_caracteristicas, matriz_caracteristicas, INDICE_CARACTERISTICA,
+                               OJO_IZQ_EXTERIOR, OJO_DER_EXTERIOR)
+from scripts.helpers import detectar_microexpresiones, detectar_microexpresiones_lote, distancia, huella_detector
+from scripts.quality import obtener_filtro, FiltroCalidad, BORDE_IZQ, BORDE_DER, FRENTE, MENTON
+from scripts.results_store import CSVResultsStore, COLUMNAS_IMAGEN, fila_imagen
+from scripts.result_cache import ResultCache
+from scripts.uploads import decodificar_imagen, max_lado_configurado
+
+# Tamaño de frame con el que se escalan los landmarks de las fixtures
+SHAPE_FIXTURE = (720, 1280)
+TAMANO_LOTE = 32
+
+ETAPAS = ('decodificar', 'mesh', 'caracteristicas', 'caracteristicas_lote', 'calidad', 'reglas', 'reglas_lote',
+          'reglas_video', 'distancia', 'persistencia', 'imagen_completa')
+
+
+def landmarks_sinteticos(cantidad=256, semilla=0):
+    """
+    Rostros sintéticos (cantidad, 478, 3) en coordenadas normalizadas
+
+    Los puntos que usa el filtro de calidad (bordes, frente, mentón y
+    esquinas de los ojos) forman un rostro frontal; si no, el filtro
+    descartaría todas las fixtures y las etapas de reglas no evaluarían reglas.
+    """
+    rng = np.random.default_rng(semilla)
+    base = rng.uniform(0.3, 0.7, size=(478, 3)).astype(np.float32)
+    base[[BORDE_IZQ, BORDE_DER, FRENTE, MENTON, OJO_IZQ_EXTERIOR, OJO_DER_EXTERIOR]] = [
+        (0.3, 0.5, 0.5), (0.7, 0.5, 0.5), (0.5, 0.2, 0.5), (0.5, 0.8, 0.5), (0.38, 0.42, 0.5), (0.62, 0.42, 0.5)]
+    ruido = rng.normal(0.0, 0.01, size=(cantidad, 478, 3)).astype(np.float32)
+    return base[None] + ruido
+
+
+def landmarks_grabados(ruta):
+    """
+    Carga landmarks reales de un .npy (F, N, 3), de un .npz con 'landmarks'
+    (como las entradas de data/cache) o de un directorio con esos archivos
+    """
+    archivos = [ruta] if os.path.isfile(ruta) else sorted(glob.glob(os.path.join(ruta, '*.np[yz]')))
+    bloques = []
+    for archivo in archivos:
+        if archivo.endswith('.npz'):
+            with np.load(archivo) as datos:
+                if 'landmarks' not in datos:
+                    continue
+                bloque = datos['landmarks']
+        else:
+            bloque = np.load(archivo)
+        if bloque.size and bloque.shape[-2:] == (478, 3):
+            bloques.append(np.asarray(bloque, dtype=np.float32).reshape(-1, 478, 3))
+    return np.concatenate(bloques) if bloques else np.empty((0, 478, 3), dtype=np.float32)
+
+
+def cargar_imagenes(directorio):
+    """Devuelve [(nombre, bytes)] de las imágenes del directorio"""
+    imagenes = []
+    for ruta in sorted(glob.glob(os.path.join(directorio, '*'))):
+        if ruta.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp')):
+            with open(ruta, 'rb') as f:
+                imagenes.append((os.path.basename(ruta), f.read()))
+    return imagenes
+
+
+def medir(funcion, entradas, repeticiones=1, calentamiento=3):
+    """
+    Ejecuta funcion sobre cada entrada y mide la latencia de cada llamada
+
+    Returns:
+        tuple: (array de latencias en segundos, segundos totales)
+    """
+    for entrada in entradas[:calentamiento]:
+        funcion(entrada)
+
+    latencias = []
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for entrada in entradas:
+            t0 = time.perf_counter()
+            funcion(entrada)
+            latencias.append(time.perf_counter() - t0)
+    return np.array(latencias), time.perf_counter() - inicio
+
+
+def resumir(latencias, segundos):
+    ms = latencias * 1000
+    return {
+        'n': int(len(ms)),
+        'media_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'max_ms': round(float(ms.max()), 4),
+        'ops_por_segundo': round(len(ms) / segundos, 2) if segundos > 0 else 0.0
+    }
+
+
+def memoria_pico_kb(funcion, entradas, muestras=16):
+    """Memoria Python máxima (tracemalloc) al ejecutar unas pocas entradas"""
+    tracemalloc.start()
+    try:
+        for entrada in entradas[:muestras]:
+            funcion(entrada)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(pico / 1024, 1)
+
+
+def preparar_etapas(config, temporal):
+    """
+    Construye (funcion, entradas) de cada etapa pedida
+
+    Una etapa que no se puede preparar (p. ej. FaceMesh no disponible) queda
+    como el texto del error para reportarla como omitida.
+    """
+    imagenes = cargar_imagenes(config['imagenes'])
+    if config.get('landmarks'):
+        rostros = landmarks_grabados(config['landmarks'])
+    else:
+        rostros = landmarks_sinteticos(config['rostros'], config['semilla'])
+    max_lado = config['max_lado']
+    shape = SHAPE_FIXTURE
+    preparadas = {}
+
+    def pool_mesh():
+        from scripts.face_mesh_pool import FaceMeshPool
+        if 'pool' not in preparadas:
+            preparadas['pool'] = FaceMeshPool(tamano=1, max_num_faces=4)
+        return preparadas['pool']
+
+    def imagenes_rgb():
+        decodificadas = [decodificar_imagen(datos, max_lado)[0] for _, datos in imagenes]
+        return [cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB) for imagen in decodificadas if imagen is not None]
+
+    def decodificar():
+        return (lambda datos: decodificar_imagen(datos, max_lado)), [datos for _, datos in imagenes]
+
+    def mesh():
+        return pool_mesh().procesar, imagenes_rgb()
+
+    def caracteristicas():
+        return (lambda puntos: extraer_caracteristicas(puntos, shape)), list(rostros)
+
+    def caracteristicas_lote():
+        lotes = [rostros[i:i + TAMANO_LOTE] for i in range(0, len(rostros), TAMANO_LOTE)]
+        return (lambda lote: matriz_caracteristicas(lote, shape)), lotes
+
+    def calidad():
+        # Filtro de calidad a propósito (pose, tamaño y nitidez), aunque FILTRO_CALIDAD=0 lo desactive
+        filtro = obtener_filtro() or FiltroCalidad()
+        anchos = matriz_caracteristicas(rostros, shape)[:, INDICE_CARACTERISTICA['ancho_rostro']] if len(rostros) else []
+        imagen = np.random.default_rng(config['semilla']).integers(0, 256, size=(*shape, 3), dtype=np.uint8)
+        return (lambda i: filtro.evaluar(rostros[i:i + 1], shape, anchos[i:i + 1], imagen)), list(range(len(rostros)))
+
+    def reglas():
+        return (lambda puntos: detectar_microexpresiones(puntos, shape)), list(rostros)
+
+    def reglas_lote():
+        lotes = [rostros[i:i + TAMANO_LOTE] for i in range(0, len(rostros), TAMANO_LOTE)]
+        return (lambda lote: detectar_microexpresiones_lote(lote, shape)), lotes
+
+    def reglas_video():
+        from scripts.detector_expresiones import EmotionDetector
+        from scripts.tracking import EstadoRostro
+        detector = EmotionDetector()
+        estado = EstadoRostro()
+        # Estado ya calibrado: se mide la evaluación de reglas, no la calibración
+        estado.calibration_frames = detector.max_calibration_frames
+        estado.face_width_baseline = float(extraer_caracteristicas(rostros[0], shape)['ancho_rostro'])
+        return (lambda puntos: detector.detectar_emociones(puntos, shape, estado=estado)), list(rostros)
+
+    def distancias():
+        pares = [(puntos[33, :2] * shape[::-1], puntos[263, :2] * shape[::-1]) for puntos in rostros]
+        return (lambda par: distancia(*par)), pares
+
+    def persistencia():
+        store = CSVResultsStore(os.path.join(temporal, "historial.csv"), COLUMNAS_IMAGEN)
+        valores = {'apertura_boca': 10.0, 'anchura_boca': 50.0, 'elevacion_cejas': 20.0}
+        filas = [[fila_imagen(f"img_{i}.jpg", "Neutral", valores)] for i in range(len(rostros))]
+        return store.agregar, filas
+
+    def imagen_completa():
+        # La misma ruta que una subida (main.procesar_imagen), con historial, originales
+        # y landmarks en el directorio temporal en lugar de data/ y uploads/
+        os.environ.update({
+            'TRACKEO_PREFORK': '1',
+            'RESULTS_STORE': f"csv:{os.path.join(temporal, 'historial.csv')}",
+            'RESULT_CACHE_DIR': os.path.join(temporal, 'cache'),
+            'UPLOADS_DIR': os.path.join(temporal, 'uploads'),
+            'LANDMARKS_DIR': os.path.join(temporal, 'landmarks'),
+        })
+        import main
+        main.iniciar_recursos()
+        # Un cache sin capacidad nunca acierta: cada repetición paga decodificación, FaceMesh y reglas
+        main.result_cache = ResultCache(os.environ['RESULT_CACHE_DIR'], max_memoria=0, max_bytes_disco=0)
+        return (lambda datos: main.procesar_imagen(datos, "benchmark.jpg")), [datos for _, datos in imagenes]
+
+    constructores = {
+        'decodificar': decodificar, 'mesh': mesh, 'caracteristicas': caracteristicas,
+        'caracteristicas_lote': caracteristicas_lote, 'calidad': calidad, 'reglas': reglas, 'reglas_lote': reglas_lote,
+        'reglas_video': reglas_video,
+        'distancia': distancias, 'persistencia': persistencia, 'imagen_completa': imagen_completa
+    }
+    etapas = {}
+    for nombre in config['etapas']:
+        try:
+            funcion, entradas = constructores[nombre]()
+            etapas[nombre] = (funcion, entradas) if entradas else "Sin entradas"
+        except Exception as e:
+            etapas[nombre] = f"{type(e).__name__}: {e}"
+
+    fixtures = {'imagenes': len(imagenes), 'rostros': int(len(rostros)),
+                'origen_rostros': config.get('landmarks') or 'sinteticos'}
+    return etapas, fixtures
+
+
+def ejecutar_etapas(config, con_memoria=True):
+    """Mide todas las etapas de config en el proceso actual"""
+    temporal = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        etapas, fixtures = preparar_etapas(config, temporal)
+        resultados = {}
+        for nombre, etapa in etapas.items():
+            if isinstance(etapa, str):
+                resultados[nombre] = {'omitida': etapa}
+                continue
+            funcion, entradas = etapa
+            latencias, segundos = medir(funcion, entradas, config['repeticiones'])
+            resultados[nombre] = resumir(latencias, segundos)
+            resultados[nombre]['latencias'] = latencias
+            if con_memoria:
+                resultados[nombre]['memoria_pico_kb'] = memoria_pico_kb(funcion, entradas)
+        return resultados, fixtures
+    finally:
+        # imagen_completa deja abiertos los almacenes de main sobre el directorio temporal
+        aplicacion = sys.modules.get('main')
+        if aplicacion is not None and aplicacion.results_store is not None:
+            aplicacion.cerrar_recursos()
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def _ejecutar_worker(config):
+    resultados, _ = ejecutar_etapas(config, con_memoria=False)
+    return resultados
+
+
+def ejecutar_paralelo(config, procesos):
+    """
+    Mide las mismas etapas en varios procesos a la vez
+
+    El rendimiento es la suma de operaciones por segundo de los procesos y los
+    percentiles salen de todas sus latencias juntas.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as executor:
+        por_proceso = list(executor.map(_ejecutar_worker, [config] * procesos))
+
+    paralelo = {}
+    for nombre in config['etapas']:
+        medidas = [resultados[nombre] for resultados in por_proceso]
+        if any('omitida' in medida for medida in medidas):
+            paralelo[nombre] = {'omitida': next(m['omitida'] for m in medidas if 'omitida' in m)}
+            continue
+        latencias = np.concatenate([medida['latencias'] for medida in medidas])
+        resumen = resumir(latencias, 1.0)
+        resumen['ops_por_segundo'] = round(sum(medida['ops_por_segundo'] for medida in medidas), 2)
+        paralelo[nombre] = resumen
+    return paralelo
+
+
+def comparar(actual, base, tolerancia=0.2, minimo_ms=0.01):
+    """
+    Compara un reporte contra una línea base
+
+    Returns:
+        list: Descripción de cada regresión (latencia p50/p95 o rendimiento
+        peor que la base en más de `tolerancia`)
+    """
+    regresiones = []
+    for seccion in ('etapas', 'paralelo'):
+        for nombre, previa in base.get(seccion, {}).items():
+            nueva = actual.get(seccion, {}).get(nombre)
+            if not nueva or 'omitida' in nueva or 'omitida' in previa:
+                continue
+            for clave in ('p50_ms', 'p95_ms'):
+                if nueva[clave] > previa[clave] * (1 + tolerancia) and nueva[clave] - previa[clave] > minimo_ms:
+                    regresiones.append(f"{seccion}.{nombre}.{clave}: {previa[clave]} -> {nueva[clave]}")
+            if nueva['ops_por_segundo'] < previa['ops_por_segundo'] * (1 - tolerancia):
+                regresiones.append(f"{seccion}.{nombre}.ops_por_segundo: "
+                                   f"{previa['ops_por_segundo']} -> {nueva['ops_por_segundo']}")
+    return regresiones
+
+
+def memoria_maxima_kb():
+    """Pico de memoria residente del proceso (None donde no hay módulo resource)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reporta bytes, Linux kilobytes
+    return maximo // 1024 if sys.platform == 'darwin' else maximo
+
+
+def imprimir_reporte(reporte):
+    print(f"\n📊 Benchmark ({reporte['fixtures']['imagenes']} imágenes, "
+          f"{reporte['fixtures']['rostros']} rostros {reporte['fixtures']['origen_rostros']})")
+    for seccion in ('etapas', 'paralelo'):
+        if seccion not in reporte:
+            continue
+        if seccion == 'paralelo':
+            print(f"\n🔀 {reporte['procesos']} procesos")
+        for nombre, medida in reporte[seccion].items():
+            if 'omitida' in medida:
+                print(f"  {nombre:<22} omitida ({medida['omitida']})")
+                continue
+            memoria = f"  {medida['memoria_pico_kb']:>8} KB" if 'memoria_pico_kb' in medida else ""
+            print(f"  {nombre:<22} p50 {medida['p50_ms']:>9.3f} ms  p95 {medida['p95_ms']:>9.3f} ms  "
+                  f"p99 {medida['p99_ms']:>9.3f} ms  {medida['ops_por_segundo']:>10.1f} op/s{memoria}")
+    if reporte.get('memoria_max_rss_kb'):
+        print(f"\n💾 Memoria residente máxima: {reporte['memoria_max_rss_kb'] / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las rutas críticas de detección")
+    parser.add_argument('--etapas', default=",".join(ETAPAS), help="Etapas separadas por comas")
+    parser.add_argument('--imagenes', default='assets', help="Carpeta con imágenes de prueba")
+    parser.add_argument('--landmarks', default=None,
+                        help="Landmarks grabados (.npy, .npz o carpeta, p. ej. data/cache); por defecto sintéticos")
+    parser.add_argument('--rostros', type=int, default=256, help="Rostros sintéticos a generar")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--repeticiones', type=int, default=3, help="Pasadas sobre las entradas de cada etapa")
+    parser.add_argument('--procesos', type=int, default=1, help="Además, medir en N procesos a la vez")
+    parser.add_argument('--salida', default=None, help="Guardar el reporte JSON en esta ruta")
+    parser.add_argument('--comparar', default=None, help="Reporte JSON base contra el que comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="Empeoramiento relativo permitido")
+    args = parser.parse_args()
+
+    etapas = [nombre.strip() for nombre in args.etapas.split(",") if nombre.strip()]
+    desconocidas = [nombre for nombre in etapas if nombre not in ETAPAS]
+    if desconocidas:
+        parser.error(f"Etapas desconocidas: {', '.join(desconocidas)}")
+
+    config = {
+        'etapas': etapas,
+        'imagenes': args.imagenes,
+        'landmarks': args.landmarks,
+        'rostros': args.rostros,
+        'semilla': args.semilla,
+        'repeticiones': args.repeticiones,
+        'max_lado': max_lado_configurado()
+    }
+
+    etapas_medidas, fixtures = ejecutar_etapas(config)
+    for medida in etapas_medidas.values():
+        medida.pop('latencias', None)
+
+    reporte = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'detector': huella_detector(),
+        'entorno': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'fixtures': fixtures,
+        'etapas': etapas_medidas
+    }
+    if args.procesos > 1:
+        reporte['procesos'] = args.procesos
+        reporte['paralelo'] = ejecutar_paralelo(config, args.procesos)
+    reporte['memoria_max_rss_kb'] = memoria_maxima_kb()
+
+    imprimir_reporte(reporte)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Reporte guardado en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(reporte, base, args.tolerancia)
+        if regresiones:
+            print(f"\n❌ {len(regresiones)} regresiones respecto a {args.comparar}:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto a {args.comparar} (tolerancia {args.tolerancia:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import math
+from collections import deque
+
+import numpy as np
+
+# Seis puntos por ojo para la razón de aspecto (EAR): extremos, dos superiores y dos inferiores
+OJO_IZQ_EAR = (33, 160, 158, 133, 153, 144)
+OJO_DER_EAR = (362, 385, 387, 263, 373, 380)
+_IDX_EAR = np.array([OJO_IZQ_EAR, OJO_DER_EAR], dtype=np.intp)
+
+
+def razon_aspecto_ojos(puntos, shape):
+    """
+    Razón de aspecto de los ojos (promedio de ambos) de un lote de rostros
+
+    EAR = (|p2 - p6| + |p3 - p5|) / (2 |p1 - p4|). No depende del tamaño del
+    rostro en la imagen: con el ojo abierto ronda 0.25-0.35 y cae hacia 0.1
+    al cerrarse.
+
+    Args:
+        puntos: Array (F, N, 3) de landmarks normalizados
+        shape: Tupla (altura, ancho) de la imagen
+
+    Returns:
+        np.ndarray: (F,) float32
+    """
+    puntos = np.asarray(puntos, dtype=np.float32)
+    if puntos.ndim == 2:
+        puntos = puntos[np.newaxis]
+    # (F, 2 ojos, 6 puntos, 2) en píxeles, para no deformar la razón con imágenes no cuadradas
+    ojos = puntos[:, _IDX_EAR, :2] * np.array(shape[:2][::-1], dtype=np.float32)
+    p1, p2, p3, p4, p5, p6 = (ojos[:, :, i] for i in range(6))
+    verticales = np.linalg.norm(p2 - p6, axis=-1) + np.linalg.norm(p3 - p5, axis=-1)
+    horizontal = np.maximum(np.linalg.norm(p1 - p4, axis=-1), 1e-6)
+    return (verticales / (2 * horizontal)).mean(axis=1)
+
+
+class EstadoParpadeo:
+    """Estado del detector de parpadeos de un rostro"""
+
+    __slots__ = ('linea_base', 'muestras', 'inicio_calibracion', 'cerrado', 'inicio_cierre',
+                 'ultimo_cerrado', 'ultimo_frame', 'ultimo_parpadeo', 'cierres_largos')
+
+    def __init__(self):
+        self.linea_base = None  # EAR con el ojo abierto de este rostro
+        self.muestras = 0
+        self.inicio_calibracion = None
+        self.cerrado = False
+        self.inicio_cierre = None
+        self.ultimo_cerrado = None
+        self.ultimo_frame = None
+        self.ultimo_parpadeo = -math.inf
+        self.cierres_largos = 0
+
+    def calibrado(self):
+        return self.inicio_calibracion is None and self.linea_base is not None
+
+
+class DetectorParpadeos:
+    """
+    Máquina de estados abierto/cerrado sobre el EAR, guiada por las marcas de tiempo de los frames
+
+    - Calibración por rostro: durante `calibracion` segundos (y al menos
+      `muestras_min` frames) se promedia el EAR con el ojo abierto; después
+      la línea base se sigue adaptando con el ojo abierto, con una constante
+      de tiempo `adaptacion` en segundos.
+    - Histéresis: el ojo se cierra por debajo de `umbral_cierre` × línea base
+      y solo se vuelve a abrir por encima de `umbral_apertura` × línea base,
+      así el ruido alrededor de un umbral no cuenta parpadeos de más.
+    - Un cierre cuenta como parpadeo al reabrirse si duró a lo sumo
+      `duracion_max` segundos (entre el primer y el último frame cerrado);
+      los más largos son ojos cerrados, no parpadeos.
+    - Periodo refractario: durante `refractario` segundos después de un
+      parpadeo no empieza otro cierre.
+    - Si pasan más de `max_hueco` segundos sin ver el rostro, un cierre en
+      curso se descarta. El límite se amplía a `factor_hueco` veces la
+      mediana del intervalo entre frames analizados, así una fuente de pocos
+      FPS o un --salto grande no descartan todos los cierres.
+
+    Todo se mide en segundos, así que el conteo no depende de los FPS ni de
+    los frames que se salteen.
+    """
+
+    def __init__(self, umbral_cierre=0.7, umbral_apertura=0.85, duracion_max=0.5, refractario=0.15,
+                 calibracion=1.5, muestras_min=5, adaptacion=5.0, max_hueco=0.5, factor_hueco=4.0):
+        self.umbral_cierre = umbral_cierre
+        self.umbral_apertura = umbral_apertura
+        self.duracion_max = duracion_max
+        self.refractario = refractario
+        self.calibracion = calibracion
+        self.muestras_min = muestras_min
+        self.adaptacion = adaptacion
+        self.max_hueco = max_hueco
+        self.factor_hueco = factor_hueco
+        self._intervalos = deque(maxlen=32)
+        self._ultimo_timestamp = None
+
+    def limite_hueco(self):
+        """Segundos sin ver un rostro a partir de los cuales se descarta un cierre en curso"""
+        if not self._intervalos:
+            return self.max_hueco
+        intervalos = sorted(self._intervalos)
+        return max(self.max_hueco, self.factor_hueco * intervalos[len(intervalos) // 2])
+
+    def actualizar(self, estados, ear, timestamp):
+        """
+        Actualiza los rostros de un frame
+
+        Args:
+            estados: EstadoParpadeo de cada rostro
+            ear: Array (F,) de razones de aspecto (ver razon_aspecto_ojos)
+            timestamp: Tiempo del frame en segundos
+
+        Returns:
+            list: Por rostro, True si en este frame terminó un parpadeo
+        """
+        if self._ultimo_timestamp is not None and timestamp > self._ultimo_timestamp:
+            self._intervalos.append(timestamp - self._ultimo_timestamp)
+        self._ultimo_timestamp = timestamp
+        limite = self.limite_hueco()
+        return [self.actualizar_rostro(estado, valor, timestamp, limite)
+                for estado, valor in zip(estados, np.asarray(ear, dtype=np.float64).tolist())]
+
+    def actualizar_rostro(self, estado, ear, timestamp, max_hueco=None):
+        max_hueco = max_hueco or self.limite_hueco()
+        hueco = None if estado.ultimo_frame is None else timestamp - estado.ultimo_frame
+        estado.ultimo_frame = timestamp
+        if hueco is not None and hueco > max_hueco:
+            estado.cerrado = False
+        if not math.isfinite(ear):
+            return False
+
+        if not estado.calibrado():
+            self._calibrar(estado, ear, timestamp)
+            return False
+
+        if not estado.cerrado:
+            if ear < estado.linea_base * self.umbral_cierre:
+                if timestamp - estado.ultimo_parpadeo >= self.refractario:
+                    estado.cerrado = True
+                    estado.inicio_cierre = estado.ultimo_cerrado = timestamp
+            elif ear > estado.linea_base * self.umbral_apertura and hueco:
+                # La línea base sigue al rostro (distancia, giro) solo con el ojo abierto
+                alfa = 1.0 - math.exp(-min(hueco, max_hueco) / self.adaptacion)
+                estado.linea_base += alfa * (ear - estado.linea_base)
+            return False
+
+        if ear <= estado.linea_base * self.umbral_apertura:
+            estado.ultimo_cerrado = timestamp
+            return False
+        estado.cerrado = False
+        if estado.ultimo_cerrado - estado.inicio_cierre > self.duracion_max:
+            estado.cierres_largos += 1
+            return False
+        estado.ultimo_parpadeo = timestamp
+        return True
+
+    def _calibrar(self, estado, ear, timestamp):
+        if estado.inicio_calibracion is None and estado.linea_base is None:
+            estado.inicio_calibracion = timestamp
+        # Un parpadeo durante la calibración no baja la línea base
+        if estado.linea_base is not None and ear < estado.linea_base * self.umbral_cierre:
+            return
+        estado.muestras += 1
+        estado.linea_base = ear if estado.linea_base is None else \
+            estado.linea_base + (ear - estado.linea_base) / estado.muestras
+        if estado.muestras >= self.muestras_min and timestamp - estado.inicio_calibracion >= self.calibracion:
+            estado.inicio_calibracion = None
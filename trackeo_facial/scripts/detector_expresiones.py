@@ -1,9 +1,23 @@
+import argparse
 import numpy as np
 import cv2
-import mediapipe as mp
-import pandas as pd
+import os
 import time
 from datetime import datetime
+from scripts.features import extraer_caracteristicas, caracteristicas_por_rostro, landmarks_a_array
+from scripts.tracking import EstadoRostro, RastreadorRostros
+from scripts.results_store import crear_store, fila_sesion, COLUMNAS_SESION
+from scripts.pipeline import PipelineVideo
+from scripts.landmark_store import LandmarkStore
+from scripts.scheduler import PlanificadorInferencia
+from scripts.session_stats import EstadisticasSesion
+from scripts.blinks import DetectorParpadeos, razon_aspecto_ojos
+from scripts.quality import obtener_filtro
+from scripts import metrics
+from scripts.rules import obtener_motor
+
+# Parpadeos por segundo a partir de los cuales la ventana se evalúa como nerviosa (30 por minuto)
+FRECUENCIA_NERVIOSA = 0.5
 
 def distancia(p1, p2):
     return np.linalg.norm(np.array(p1) - np.array(p2))
@@ -47,278 +61,349 @@ class FacialLandmarks:
     RIGHT_CHEEK = 345
 
 class EmotionDetector:
-    def __init__(self):
+    def __init__(self, max_num_faces=1):
+        # MediaPipe se importa al crear el detector, no al importar el módulo
+        import mediapipe as mp
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
+        self.max_num_faces = max_num_faces
+        self.face_mesh = self._crear_face_mesh()
+        # Los recortes van a una instancia aparte para no mezclar su seguimiento con el del frame completo
+        self._face_mesh_roi = None
+        self.mp_drawing = mp.solutions.drawing_utils
+        
+        # Calibración inicial para normalizar medidas; con varios rostros cada
+        # uno trae su propio EstadoRostro y este queda para el caso de uno solo
+        self.estado = EstadoRostro()
+        self.max_calibration_frames = 30
+    
+    def _crear_face_mesh(self):
+        return self.mp_face_mesh.FaceMesh(
             static_image_mode=False,
-            max_num_faces=1,
+            max_num_faces=self.max_num_faces,
             refine_landmarks=True,
             min_detection_confidence=0.7,
             min_tracking_confidence=0.7
         )
-        self.mp_drawing = mp.solutions.drawing_utils
-        
-        # Calibración inicial para normalizar medidas
-        self.face_width_baseline = None
-        self.calibration_frames = 0
-        self.max_calibration_frames = 30
-        
-    def calibrar_rostro(self, landmarks, shape):
+    
+    def landmarks(self, frame, recorte=False):
+        """FaceMesh sobre un frame BGR (o un recorte); devuelve un array (F, N, 3), vacío si no hay rostros"""
+        if recorte:
+            if self._face_mesh_roi is None:
+                self._face_mesh_roi = self._crear_face_mesh()
+            face_mesh = self._face_mesh_roi
+        else:
+            face_mesh = self.face_mesh
+        results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks:
+            return np.empty((0, 478, 3), dtype=np.float32)
+        return np.stack([landmarks_a_array(f.landmark) for f in results.multi_face_landmarks])
+    
+    @property
+    def face_width_baseline(self):
+        return self.estado.face_width_baseline
+    
+    @property
+    def calibration_frames(self):
+        return self.estado.calibration_frames
+    
+    def calibrar_rostro(self, landmarks, shape, caracteristicas=None, estado=None):
         """Calibra las medidas base del rostro para normalización"""
-        ih, iw = shape
+        if caracteristicas is None:
+            caracteristicas = extraer_caracteristicas(landmarks, shape)
+        estado = estado or self.estado
         
         # Usar la distancia entre las esquinas externas de los ojos como referencia
-        left_eye_corner = landmarks[FacialLandmarks.LEFT_EYE_LEFT]
-        right_eye_corner = landmarks[FacialLandmarks.RIGHT_EYE_RIGHT]
-        
-        face_width = distancia(
-            (left_eye_corner.x * iw, left_eye_corner.y * ih),
-            (right_eye_corner.x * iw, right_eye_corner.y * ih)
-        )
+        face_width = caracteristicas['ancho_rostro']
         
-        if self.face_width_baseline is None:
-            self.face_width_baseline = face_width
+        if estado.face_width_baseline is None:
+            estado.face_width_baseline = face_width
         else:
             # Promedio móvil para estabilizar
-            self.face_width_baseline = (self.face_width_baseline * 0.9 + face_width * 0.1)
+            estado.face_width_baseline = (estado.face_width_baseline * 0.9 + face_width * 0.1)
         
-        self.calibration_frames += 1
-        return self.calibration_frames >= self.max_calibration_frames
+        estado.calibration_frames += 1
+        return estado.calibration_frames >= self.max_calibration_frames
     
-    def detectar_emociones(self, landmarks, shape):
-        """Detecta múltiples emociones con mayor precisión"""
-        if not self.calibrar_rostro(landmarks, shape):
+    def detectar_emociones(self, landmarks, shape, caracteristicas=None, estado=None):
+        """Detecta múltiples emociones con las reglas del conjunto "video" (models/reglas_emociones.json)"""
+        if caracteristicas is None:
+            caracteristicas = extraer_caracteristicas(landmarks, shape)
+        estado = estado or self.estado
+        if not self.calibrar_rostro(landmarks, shape, caracteristicas, estado):
             return ["Calibrando..."]
         
-        ih, iw = shape
-        emociones = []
-        confianza = {}
-        
         # Factor de normalización basado en el ancho del rostro
-        norm_factor = self.face_width_baseline / 100.0 if self.face_width_baseline else 1.0
-        
-        # 1. SORPRESA - Apertura de boca y elevación de cejas
-        mouth_top = landmarks[FacialLandmarks.MOUTH_TOP]
-        mouth_bottom = landmarks[FacialLandmarks.MOUTH_BOTTOM]
-        apertura_boca = distancia(
-            (mouth_top.x * iw, mouth_top.y * ih),
-            (mouth_bottom.x * iw, mouth_bottom.y * ih)
-        ) / norm_factor
-        
-        # Elevación de cejas
-        left_brow = landmarks[FacialLandmarks.LEFT_EYEBROW_TOP]
-        right_brow = landmarks[FacialLandmarks.RIGHT_EYEBROW_TOP]
-        left_eye_top = landmarks[FacialLandmarks.LEFT_EYE_TOP]
-        right_eye_top = landmarks[FacialLandmarks.RIGHT_EYE_TOP]
-        
-        elevacion_cejas = (
-            distancia((left_brow.x * iw, left_brow.y * ih), (left_eye_top.x * iw, left_eye_top.y * ih)) +
-            distancia((right_brow.x * iw, right_brow.y * ih), (right_eye_top.x * iw, right_eye_top.y * ih))
-        ) / (2 * norm_factor)
-        
-        if apertura_boca > 15 and elevacion_cejas > 18:
-            emociones.append("Sorpresa")
-            confianza["Sorpresa"] = min(95, (apertura_boca + elevacion_cejas) * 2)
-        
-        # 2. FELICIDAD - Sonrisa genuina vs forzada
-        mouth_left = landmarks[FacialLandmarks.MOUTH_LEFT]
-        mouth_right = landmarks[FacialLandmarks.MOUTH_RIGHT]
-        ancho_sonrisa = distancia(
-            (mouth_left.x * iw, mouth_left.y * ih),
-            (mouth_right.x * iw, mouth_right.y * ih)
-        ) / norm_factor
-        
-        # Curvatura de la boca (esquinas hacia arriba)
-        mouth_top_lip = landmarks[FacialLandmarks.MOUTH_TOP_LIP]
-        curvatura_boca = (mouth_top_lip.y - (mouth_left.y + mouth_right.y) / 2) * ih / norm_factor
-        
-        # Activación de músculos alrededor de los ojos (sonrisa genuina)
-        left_eye_height = distancia(
-            (landmarks[FacialLandmarks.LEFT_EYE_TOP].x * iw, landmarks[FacialLandmarks.LEFT_EYE_TOP].y * ih),
-            (landmarks[FacialLandmarks.LEFT_EYE_BOTTOM].x * iw, landmarks[FacialLandmarks.LEFT_EYE_BOTTOM].y * ih)
-        ) / norm_factor
-        
-        if ancho_sonrisa > 45 and curvatura_boca < -2:
-            if left_eye_height < 8:  # Ojos entrecerrados por sonrisa genuina
-                emociones.append("Felicidad genuina")
-                confianza["Felicidad genuina"] = min(90, ancho_sonrisa + abs(curvatura_boca) * 10)
+        norm_factor = estado.face_width_baseline / 100.0 if estado.face_width_baseline else 1.0
+        evaluacion = obtener_motor().conjunto('video').evaluar(caracteristicas, escala=norm_factor)
+        return evaluacion.emociones, evaluacion.confianza
+    
+    def detectar_emociones_lote(self, lista_caracteristicas, estados, shape):
+        """
+        Calibra cada rostro y evalúa las reglas de todos los calibrados en una sola pasada
+        
+        Returns:
+            list: Por rostro, (emociones, confianza) o ["Calibrando..."]
+        """
+        resultados = [None] * len(estados)
+        calibrados = []
+        for i, (caracteristicas, estado) in enumerate(zip(lista_caracteristicas, estados)):
+            if self.calibrar_rostro(None, shape, caracteristicas, estado):
+                calibrados.append(i)
             else:
-                emociones.append("Sonrisa forzada")
-                confianza["Sonrisa forzada"] = min(85, ancho_sonrisa)
-        
-        # 3. TENSIÓN/ESTRÉS - Múltiples indicadores
-        tension_score = 0
-        
-        # Fruncimiento de cejas
-        distancia_cejas = distancia(
-            (landmarks[FacialLandmarks.LEFT_EYEBROW_INNER].x * iw, landmarks[FacialLandmarks.LEFT_EYEBROW_INNER].y * ih),
-            (landmarks[FacialLandmarks.RIGHT_EYEBROW_INNER].x * iw, landmarks[FacialLandmarks.RIGHT_EYEBROW_INNER].y * ih)
-        ) / norm_factor
-        
-        if distancia_cejas < 35:
-            tension_score += 30
-        
-        # Tensión en la mandíbula (boca apretada)
-        if apertura_boca < 3 and ancho_sonrisa < 35:
-            tension_score += 25
-        
-        # Elevación excesiva de cejas (ansiedad)
-        if elevacion_cejas > 25:
-            tension_score += 20
-        
-        # Asimetría facial (indicador de tensión)
-        left_cheek = landmarks[FacialLandmarks.LEFT_CHEEK]
-        right_cheek = landmarks[FacialLandmarks.RIGHT_CHEEK]
-        nose_tip = landmarks[FacialLandmarks.NOSE_TIP]
-        
-        asimetria = abs(
-            distancia((left_cheek.x * iw, left_cheek.y * ih), (nose_tip.x * iw, nose_tip.y * ih)) -
-            distancia((right_cheek.x * iw, right_cheek.y * ih), (nose_tip.x * iw, nose_tip.y * ih))
-        ) / norm_factor
-        
-        if asimetria > 3:
-            tension_score += 15
-        
-        if tension_score > 40:
-            emociones.append("Tensión/Estrés")
-            confianza["Tensión/Estrés"] = min(95, tension_score)
-        
-        # 4. ENOJO - Cejas bajas y fruncidas
-        if elevacion_cejas < 10 and distancia_cejas < 30 and apertura_boca < 5:
-            emociones.append("Enojo")
-            confianza["Enojo"] = min(90, (40 - distancia_cejas) * 2)
-        
-        # 5. TRISTEZA - Esquinas de la boca hacia abajo
-        if curvatura_boca > 2 and ancho_sonrisa < 40:
-            emociones.append("Tristeza")
-            confianza["Tristeza"] = min(85, curvatura_boca * 15)
-        
-        # 6. CONCENTRACIÓN - Cejas ligeramente fruncidas, boca neutra
-        if 30 < distancia_cejas < 38 and 3 < apertura_boca < 8 and 35 < ancho_sonrisa < 45:
-            emociones.append("Concentración")
-            confianza["Concentración"] = 70
-        
-        return emociones, confianza
+                resultados[i] = ["Calibrando..."]
+        if not calibrados:
+            return resultados
+        
+        conjunto = obtener_motor().conjunto('video')
+        escalas = [estados[i].face_width_baseline / 100.0 if estados[i].face_width_baseline else 1.0
+                   for i in calibrados]
+        if len(calibrados) == 1:
+            # Un solo rostro: la evaluación escalar evita el costo fijo de NumPy
+            evaluaciones = [conjunto.evaluar(lista_caracteristicas[calibrados[0]], escala=escalas[0])]
+        else:
+            columnas = {nombre: np.array([lista_caracteristicas[i][nombre] for i in calibrados])
+                        for nombre in lista_caracteristicas[0]}
+            evaluaciones = conjunto.evaluar_lote(columnas, escala=np.array(escalas))
+        for i, evaluacion in zip(calibrados, evaluaciones):
+            resultados[i] = (evaluacion.emociones, evaluacion.confianza)
+        return resultados
+    
+    def emociones_sin_calibrar(self, lista_caracteristicas, estados):
+        """Emociones crudas con la calibración actual de cada rostro, sin actualizarla (auditorías)"""
+        conjunto = obtener_motor().conjunto('video')
+        return [conjunto.evaluar(caracteristicas, escala=estado.face_width_baseline / 100.0
+                                 if estado.face_width_baseline else 1.0).emociones
+                for caracteristicas, estado in zip(lista_caracteristicas, estados)]
 
-def main():
-    detector = EmotionDetector()
-    cap = cv2.VideoCapture(0)
+class SesionEmociones:
+    """
+    Estado del análisis en vivo: parpadeos, suavizado de emociones y ventanas
+    de 10 segundos. procesar() corre en el hilo de inferencia y devuelve todo
+    lo que la etapa de salida necesita para dibujar el frame.
     
-    # Configurar ventana
-    cv2.namedWindow("Detector de Expresiones Avanzado", cv2.WINDOW_NORMAL)
-    cv2.resizeWindow("Detector de Expresiones Avanzado", 1000, 700)
+    Con varios rostros, el rastreador les asigna IDs estables y cada uno lleva
+    su propia calibración, historial y contador de parpadeos (EstadoRostro).
     
-    parpadeos = 0
-    tiempo_inicio = time.time()
-    resultados = []
-    frame_count = 0
+    Con landmark_store, los landmarks de cada rostro en cada frame analizado
+    se agregan al archivo de landmarks con la sesión, el frame y el ID del rostro.
     
-    # Variables para suavizado de detección
-    historial_emociones = []
-    max_historial = 5
+    Con planificador (PlanificadorInferencia), FaceMesh corre sobre un recorte
+    alrededor de los rostros anteriores o se salta cuando la expresión está
+    estable; sin él, cada frame se analiza completo.
     
-    print("🎯 Detector de Expresiones Avanzado iniciado")
-    print("📍 Mantén tu rostro centrado para calibrar...")
-    print("🔧 Presiona ESC para salir")
+    Las ventanas no se acumulan en memoria: cada una se escribe en el store
+    al cerrarse y estadisticas (EstadisticasSesion) mantiene los agregados
+    de la sesión (parpadeos, tiempo por emoción y por estado, percentiles).
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame = cv2.flip(frame, 1)  # Espejo para mejor UX
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = detector.face_mesh.process(frame_rgb)
-        
-        frame_count += 1
-        
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                ih, iw, _ = frame.shape
-                landmarks = face_landmarks.landmark
-                
-                # Detectar parpadeos
-                l_eye_h = distancia(
-                    (landmarks[FacialLandmarks.LEFT_EYE_TOP].x * iw, landmarks[FacialLandmarks.LEFT_EYE_TOP].y * ih),
-                    (landmarks[FacialLandmarks.LEFT_EYE_BOTTOM].x * iw, landmarks[FacialLandmarks.LEFT_EYE_BOTTOM].y * ih)
-                )
-                r_eye_h = distancia(
-                    (landmarks[FacialLandmarks.RIGHT_EYE_TOP].x * iw, landmarks[FacialLandmarks.RIGHT_EYE_TOP].y * ih),
-                    (landmarks[FacialLandmarks.RIGHT_EYE_BOTTOM].x * iw, landmarks[FacialLandmarks.RIGHT_EYE_BOTTOM].y * ih)
-                )
-                
-                eye_avg = (l_eye_h + r_eye_h) / 2
-                if eye_avg < 4:
-                    parpadeos += 1
-                    time.sleep(0.1)
-                
-                # Detectar emociones
-                resultado_emociones = detector.detectar_emociones(landmarks, (ih, iw))
-                
+    Los parpadeos salen de la máquina de estados de scripts.blinks sobre la
+    razón de aspecto de los ojos, guiada por el timestamp de cada frame.
+    
+    Con filtro (por defecto el de scripts.quality), un rostro girado, pequeño
+    o desenfocado no pasa por las reglas: no actualiza su calibración ni el
+    suavizado, conserva las últimas emociones mostradas y no suma tiempo
+    a las emociones de la sesión.
+    """
+    
+    def __init__(self, detector, duracion_ventana=10, espejo=True, store=None, sesion=None, suavizado=None,
+                 landmark_store=None, planificador=None, estadisticas=None, parpadeos=None, filtro=None):
+        self.detector = detector
+        self.parpadeos = parpadeos or DetectorParpadeos()
+        self.filtro = filtro or obtener_filtro()
+        self.landmark_store = landmark_store
+        self.planificador = planificador
+        self.duracion_ventana = duracion_ventana
+        self.espejo = espejo
+        self.store = store
+        self.sesion = sesion
+        self.inicio_ventana = None
+        self.estadisticas = estadisticas or EstadisticasSesion(sesion)
+        self.frame_count = 0
+        # Suavizado temporal por rostro: ventana de frames, votos mínimos y decaimiento
+        self.rastreador = RastreadorRostros(suavizado=suavizado or {'longitud': 5, 'umbral_votos': 2})
+    
+    def calibrado(self, estado):
+        return estado.calibration_frames >= self.detector.max_calibration_frames
+    
+    def procesar(self, frame, timestamp):
+        if self.espejo:
+            frame = cv2.flip(frame, 1)  # Espejo para mejor UX
+        with metrics.span('mesh', ruta='video'):
+            puntos, modo, segundos_mesh, fraccion = self._inferir(frame)
+        
+        self.frame_count += 1
+        if self.inicio_ventana is None:
+            self.inicio_ventana = timestamp
+        
+        ih, iw, _ = frame.shape
+        rostros = []
+        emociones_crudas = []
+        
+        if len(puntos):
+            # Una sola pasada vectorizada para las medidas de todos los rostros del frame
+            with metrics.span('caracteristicas', ruta='video'):
+                lista_caracteristicas = caracteristicas_por_rostro(puntos, (ih, iw))
+                ear = razon_aspecto_ojos(puntos, (ih, iw))
+            metrics.ROSTROS.incrementar(len(puntos), ruta='video')
+            centros = puntos[:, :, :2].mean(axis=1) * np.array([iw, ih], dtype=np.float32)
+            estados = self.rastreador.actualizar(centros, [c['ancho_rostro'] for c in lista_caracteristicas])
+            # Un frame saltado repite los landmarks anteriores: no es una observación nueva de los ojos
+            if modo != 'salto':
+                parpadeos = self.parpadeos.actualizar([estado.parpadeo for estado in estados], ear, timestamp)
+                for estado, parpadeo in zip(estados, parpadeos):
+                    estado.parpadeos += parpadeo
+            if self.landmark_store is not None and modo != 'salto':
+                with metrics.span('landmarks', ruta='video'):
+                    self.landmark_store.agregar(puntos, [
+                        {'sesion': self.sesion, 'origen': 'entrevista', 'frame': self.frame_count,
+                         'tiempo': round(timestamp, 3), 'rostro': estado.id, 'alto': ih, 'ancho': iw}
+                        for estado in estados])
+            # Un frame saltado conserva la calidad evaluada con el último frame analizado
+            if self.filtro is not None and modo != 'salto':
+                with metrics.span('calidad', ruta='video'):
+                    calidades = self.filtro.evaluar(puntos, (ih, iw), [c['ancho_rostro'] for c in lista_caracteristicas],
+                                                    frame)
+                for estado, calidad in zip(estados, calidades):
+                    estado.calidad = calidad
+                    metrics.registrar_descarte(calidad['motivos'], ruta='video')
+            # Un frame saltado repite los landmarks anteriores: no calibra ni vota en el suavizado
+            aptos = [] if modo == 'salto' else [
+                i for i, estado in enumerate(estados) if estado.calidad is None or estado.calidad['apto']]
+            
+            # Detectar emociones de todos los rostros aptos del frame en una sola evaluación de reglas
+            lista_emociones = [None] * len(estados)
+            if aptos:
+                with metrics.span('reglas', ruta='video'):
+                    for i, resultado_emociones in zip(aptos, self.detector.detectar_emociones_lote(
+                            [lista_caracteristicas[i] for i in aptos], [estados[i] for i in aptos], (ih, iw))):
+                        lista_emociones[i] = resultado_emociones
+            
+            for estado, resultado_emociones in zip(estados, lista_emociones):
+                if resultado_emociones is None:
+                    # Frame saltado o rostro descartado por calidad: se mantiene lo último que se mostró
+                    emociones_crudas.append(estado.emociones_frecuentes)
+                    rostros.append(self._rostro(estado, estado.emociones_frecuentes, estado.confianza))
+                    continue
                 if len(resultado_emociones) == 2:
                     emociones_detectadas, confianza = resultado_emociones
+                    metrics.registrar_emociones(emociones_detectadas, ruta='video')
                 else:
                     emociones_detectadas = resultado_emociones
                     confianza = {}
+                emociones_crudas.append(emociones_detectadas)
                 
-                # Suavizar detecciones
-                historial_emociones.append(emociones_detectadas)
-                if len(historial_emociones) > max_historial:
-                    historial_emociones.pop(0)
-                
-                # Emociones más frecuentes en el historial
-                todas_emociones = [emo for frame_emos in historial_emociones for emo in frame_emos]
-                emociones_frecuentes = list(set([emo for emo in todas_emociones if todas_emociones.count(emo) >= 2]))
+                # Suavizar detecciones: emociones más frecuentes en la ventana del rostro
+                emociones_frecuentes = estado.suavizador.actualizar(emociones_detectadas, confianza)
+                if estado.suavizador.decaimiento is not None:
+                    confianza = estado.suavizador.confianza()
                 
                 if not emociones_frecuentes:
                     emociones_frecuentes = ["Neutral"]
+                estado.emociones_frecuentes = emociones_frecuentes
+                estado.confianza = confianza
                 
-                # Dibujar landmarks (opcional, comentar para mejor rendimiento)
-                # detector.mp_drawing.draw_landmarks(frame, face_landmarks, detector.mp_face_mesh.FACEMESH_CONTOURS)
-                
-                # Mostrar información en pantalla con mejor diseño
-                y_offset = 40
-                for i, emotion in enumerate(emociones_frecuentes):
-                    conf_text = f" ({confianza.get(emotion, 'N/A')}%)" if emotion in confianza else ""
-                    texto = f"{emotion}{conf_text}"
-                    
-                    # Colores según emoción
-                    color = (0, 255, 0)  # Verde por defecto
-                    if "Tensión" in emotion or "Estrés" in emotion:
-                        color = (0, 0, 255)  # Rojo
-                    elif "Felicidad" in emotion:
-                        color = (0, 255, 255)  # Amarillo
-                    elif "Sorpresa" in emotion:
-                        color = (255, 0, 255)  # Magenta
-                    elif "Enojo" in emotion:
-                        color = (0, 0, 200)  # Rojo oscuro
-                    elif "Tristeza" in emotion:
-                        color = (128, 128, 128)  # Gris
-                    
-                    cv2.putText(frame, texto, (20, y_offset + i * 30), 
-                               cv2.FONT_HERSHEY_DUPLEX, 0.8, color, 2)
-                
-                # Barra de estado
-                status_color = (0, 255, 0) if detector.calibration_frames >= detector.max_calibration_frames else (0, 255, 255)
-                status_text = "✅ Calibrado" if detector.calibration_frames >= detector.max_calibration_frames else f"📊 Calibrando... {detector.calibration_frames}/{detector.max_calibration_frames}"
-                cv2.putText(frame, status_text, (20, ih - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
+                rostros.append(self._rostro(estado, emociones_frecuentes, confianza))
         else:
-            cv2.putText(frame, "❌ No se detecta rostro", (20, 40), cv2.FONT_HERSHEY_DUPLEX, 0.8, (0, 0, 255), 2)
-        
-        # Información general
-        cv2.putText(frame, f"Parpadeos: {parpadeos}", (20, ih - 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        cv2.putText(frame, f"Frame: {frame_count}", (20, ih - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
-        
-        cv2.imshow("Detector de Expresiones Avanzado", frame)
-        
-        # Guardar datos cada 10 segundos
-        if time.time() - tiempo_inicio >= 10 and detector.calibration_frames >= detector.max_calibration_frames:
-            frecuencia_parpadeos = parpadeos / 10
-            texto_emociones = ", ".join(emociones_frecuentes) if emociones_frecuentes else "Neutral"
+            self.rastreador.actualizar([], [])
+        self.estadisticas.registrar_frame(timestamp, [(rostro['id'], rostro['emociones'])
+                                                      for rostro in rostros
+                                                      if rostro['calibrado'] and not rostro['calidad']])
+        
+        if self.planificador is not None:
+            self.planificador.registrar(modo, puntos, emociones_crudas, segundos_mesh, fraccion)
+            if len(puntos) and self.planificador.toca_auditar(modo):
+                self._auditar(frame, puntos, lista_caracteristicas, estados)
+        
+        self._cerrar_ventana(timestamp)
+        
+        return {
+            'frame': frame,
+            'rostros': rostros,
+            'frame_count': self.frame_count
+        }
+    
+    def _rostro(self, estado, emociones, confianza):
+        """Lo que la etapa de salida necesita de un rostro; 'calidad' lista los motivos de descarte"""
+        return {
+            'id': estado.id,
+            'centro': (int(estado.centro[0]), int(estado.centro[1])),
+            'emociones': emociones,
+            'confianza': confianza,
+            'parpadeos': estado.parpadeos,
+            'calibrado': self.calibrado(estado),
+            'calibration_frames': estado.calibration_frames,
+            'calidad': estado.calidad['motivos'] if estado.calidad is not None else []
+        }
+    
+    def _inferir(self, frame):
+        """
+        Landmarks del frame según el planificador
+        
+        Returns:
+            tuple: (landmarks (F, N, 3) normalizados al frame, modo, segundos de FaceMesh,
+                fracción de píxeles procesados)
+        """
+        planificador = self.planificador
+        if planificador is None:
+            return self.detector.landmarks(frame), 'completo', 0.0, 1.0
+        
+        modo = planificador.decidir()
+        if modo == 'salto':
+            return planificador.puntos, modo, 0.0, 0.0
+        
+        inicio = time.perf_counter()
+        roi = planificador.roi(frame.shape) if modo == 'roi' else None
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            puntos = self.detector.landmarks(frame[y0:y1, x0:x1], recorte=True)
+            if len(puntos) >= len(planificador.puntos):
+                fraccion = (x1 - x0) * (y1 - y0) / (frame.shape[0] * frame.shape[1])
+                return planificador.a_frame(puntos, roi, frame.shape), 'roi', time.perf_counter() - inicio, fraccion
+            # Algún rostro salió del recorte: el mismo frame se analiza completo
+            planificador.registrar_fallo(time.perf_counter() - inicio)
+            inicio = time.perf_counter()
+        puntos = self.detector.landmarks(frame)
+        return puntos, 'completo', time.perf_counter() - inicio, 1.0
+    
+    def _auditar(self, frame, puntos, lista_caracteristicas, estados):
+        """Repite el frame completo y compara landmarks y emociones con los del modo planificado"""
+        inicio = time.perf_counter()
+        puntos_completo = self.detector.landmarks(frame)
+        segundos = time.perf_counter() - inicio
+        emociones = self.detector.emociones_sin_calibrar(lista_caracteristicas, estados)
+        emociones_completo = []
+        if len(puntos_completo):
+            # Cada rostro del frame completo se evalúa con la calibración del rostro planificado más cercano
+            cercanos = PlanificadorInferencia.emparejar(puntos_completo, puntos)
+            emociones_completo = self.detector.emociones_sin_calibrar(
+                caracteristicas_por_rostro(puntos_completo, frame.shape[:2]), [estados[i] for i in cercanos])
+        self.planificador.auditar(puntos, emociones, puntos_completo, emociones_completo, segundos)
+    
+    def _cerrar_ventana(self, timestamp):
+        """
+        Guarda un registro por rostro calibrado cada duracion_ventana segundos
+        
+        Al cerrarse la ventana, los parpadeos de todos los rostros seguidos
+        vuelven a cero, también los de los que aún calibran: si no, al
+        calibrarse dividirían los de varias ventanas por la duración de una.
+        """
+        if timestamp - self.inicio_ventana < self.duracion_ventana:
+            return
+        calibrados = [estado for estado in self.rastreador.rostros.values() if self.calibrado(estado)]
+        if not calibrados:
+            self._reiniciar_ventana(timestamp)
+            return
+        
+        hora = datetime.now().strftime('%H:%M:%S')
+        segundos = timestamp - self.inicio_ventana
+        filas = []
+        for rostro in calibrados:
+            # Duración real de la ventana: el último frame puede llegar después de los 10 segundos
+            frecuencia_parpadeos = rostro.parpadeos / segundos
+            texto_emociones = ", ".join(rostro.emociones_frecuentes) if rostro.emociones_frecuentes else "Neutral"
             
             # Evaluación más sofisticada
             estado = "Tranquilo"
-            if frecuencia_parpadeos > 2.5:
+            if frecuencia_parpadeos > FRECUENCIA_NERVIOSA:
                 estado = "Nervioso"
             elif "Tensión" in texto_emociones or "Estrés" in texto_emociones:
                 estado = "Estresado"
@@ -328,39 +413,271 @@ def main():
                 estado = "Agitado"
             
             resultado = [
-                datetime.now().strftime('%H:%M:%S'),
-                parpadeos,
+                hora,
+                rostro.parpadeos,
                 round(frecuencia_parpadeos, 2),
                 texto_emociones,
                 estado
             ]
-            resultados.append(resultado)
-            
-            print(f"📊 [{resultado[0]}] {parpadeos} parpadeos (freq: {frecuencia_parpadeos:.1f}/s) - {texto_emociones} - Estado: {estado}")
+            self.estadisticas.registrar_ventana(rostro.id, rostro.parpadeos, segundos, estado)
+            filas.append(fila_sesion(*resultado, sesion=self.sesion, rostro=rostro.id))
             
-            parpadeos = 0
-            tiempo_inicio = time.time()
+            prefijo = f"Rostro {rostro.id}: " if len(calibrados) > 1 else ""
+            print(f"📊 [{hora}] {prefijo}{rostro.parpadeos} parpadeos (freq: {frecuencia_parpadeos:.1f}/s) - {texto_emociones} - Estado: {estado}")
+        
+        # Cada ventana se escribe al cerrarse, así una sesión interrumpida no pierde datos
+        with metrics.span('escritura', ruta='video'):
+            if self.store is not None:
+                self.store.agregar(filas)
+            self.estadisticas.guardar()
         
-        if cv2.waitKey(1) & 0xFF == 27:  # ESC para salir
-            break
+        self._reiniciar_ventana(timestamp)
     
-    cap.release()
-    cv2.destroyAllWindows()
+    def _reiniciar_ventana(self, timestamp):
+        for rostro in self.rastreador.rostros.values():
+            rostro.parpadeos = 0
+        self.inicio_ventana = timestamp
+
+def dibujar_resultados(salida, detector, metricas=None):
+    """Etapa de salida: dibuja emociones, estado y métricas sobre el frame"""
+    frame = salida['frame']
+    ih = frame.shape[0]
+    varios = len(salida['rostros']) > 1
     
-    # Guardar resultados
-    if resultados:
-        df = pd.DataFrame(resultados, columns=["Hora", "Parpadeos", "Frecuencia", "Emociones", "Evaluación"])
-        
-        # Crear directorio si no existe
-        import os
-        os.makedirs("data", exist_ok=True)
-        
-        filename = f"data/emociones_entrevista_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        df.to_csv(filename, index=False)
-        print(f"\n✅ Datos guardados en: {filename}")
-        print(f"📈 Total de registros: {len(resultados)}")
+    for rostro in salida['rostros']:
+        emociones_frecuentes = rostro['emociones']
+        confianza = rostro['confianza']
+        
+        # Con varios rostros cada bloque de texto se dibuja sobre su rostro
+        x_texto = max(rostro['centro'][0] - 80, 0) if varios else 20
+        y_offset = 40
+        if varios:
+            cv2.putText(frame, f"#{rostro['id']}", (x_texto, y_offset - 30),
+                       cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 2)
+        for i, emotion in enumerate(emociones_frecuentes):
+            conf_text = f" ({confianza.get(emotion, 'N/A')}%)" if emotion in confianza else ""
+            texto = f"{emotion}{conf_text}"
+            
+            # Colores según emoción
+            color = (0, 255, 0)  # Verde por defecto
+            if "Tensión" in emotion or "Estrés" in emotion:
+                color = (0, 0, 255)  # Rojo
+            elif "Felicidad" in emotion:
+                color = (0, 255, 255)  # Amarillo
+            elif "Sorpresa" in emotion:
+                color = (255, 0, 255)  # Magenta
+            elif "Enojo" in emotion:
+                color = (0, 0, 200)  # Rojo oscuro
+            elif "Tristeza" in emotion:
+                color = (128, 128, 128)  # Gris
+            
+            cv2.putText(frame, texto, (x_texto, y_offset + i * 30), 
+                       cv2.FONT_HERSHEY_DUPLEX, 0.8, color, 2)
+        if rostro.get('calidad'):
+            # Emociones congeladas: el rostro no pasó el filtro de calidad en este frame
+            cv2.putText(frame, f"Calidad: {', '.join(rostro['calidad'])}",
+                       (x_texto, y_offset + len(emociones_frecuentes) * 30),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (128, 128, 128), 2)
+    
+    if salida['rostros']:
+        # Barra de estado
+        calibrado = all(rostro['calibrado'] for rostro in salida['rostros'])
+        frames_calibracion = min(rostro['calibration_frames'] for rostro in salida['rostros'])
+        status_color = (0, 255, 0) if calibrado else (0, 255, 255)
+        status_text = "✅ Calibrado" if calibrado else f"📊 Calibrando... {frames_calibracion}/{detector.max_calibration_frames}"
+        cv2.putText(frame, status_text, (20, ih - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
     else:
+        cv2.putText(frame, "❌ No se detecta rostro", (20, 40), cv2.FONT_HERSHEY_DUPLEX, 0.8, (0, 0, 255), 2)
+    
+    # Información general
+    parpadeos = " | ".join(str(rostro['parpadeos']) for rostro in salida['rostros']) or "0"
+    cv2.putText(frame, f"Parpadeos: {parpadeos}", (20, ih - 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    cv2.putText(frame, f"Frame: {salida['frame_count']}", (20, ih - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+    if metricas:
+        texto_fps = f"FPS: {metricas['fps_efectivos']:.1f} | inferencia: {metricas['inferencia']['latencia_media_ms']:.0f} ms"
+        cv2.putText(frame, texto_fps, (200, ih - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+    
+    return frame
+
+def imprimir_metricas(metricas):
+    print("\n⏱️  Rendimiento por etapa:")
+    for etapa in ('captura', 'inferencia', 'salida'):
+        m = metricas[etapa]
+        print(f"   {etapa}: {m['frames']} frames, {m['latencia_media_ms']} ms promedio, "
+              f"{m['latencia_max_ms']} ms máx, {m['fps']} fps")
+    print(f"   FPS efectivos: {metricas['fps_efectivos']} (frames descartados: {metricas['descartados']})")
+
+def imprimir_planificador(resumen):
+    modos = ", ".join(f"{modo}: {cantidad}" for modo, cantidad in resumen['modos'].items())
+    print(f"\n🧭 Inferencia adaptativa: {modos} (recortes fallidos: {resumen['roi_fallidos']})")
+    print(f"   ms por modo: {resumen['ms_por_modo']}, píxeles procesados: {resumen['pixeles_procesados_pct']}%")
+    if resumen['tiempo_ahorrado_pct'] is not None:
+        print(f"   Tiempo de FaceMesh ahorrado frente al frame completo: {resumen['tiempo_ahorrado_pct']}%")
+    if resumen['auditorias']:
+        print(f"   {resumen['auditorias']} auditorías: emociones distintas en {resumen['discrepancia_emociones_pct']}% "
+              f"de los rostros, error medio de landmarks {resumen['error_landmarks_pct']}% del ancho del rostro")
+
+def crear_store_sesion(sesion, destino=None):
+    """Por defecto un CSV por sesión; SESSION_STORE=sqlite:<ruta> los concentra en una base"""
+    destino = destino or os.environ.get('SESSION_STORE', f"csv:data/emociones_entrevista_{sesion}.csv")
+    return destino, crear_store(destino, COLUMNAS_SESION)
+
+def resumen_sesion(estadisticas, destino):
+    if not estadisticas.registros:
         print("\n⚠️  No se guardaron datos (sesión muy corta)")
+        return
+    estadisticas.guardar()
+    print(f"\n✅ Datos guardados en: {destino}")
+    print(f"📈 Total de registros: {estadisticas.registros}")
+    if estadisticas.ruta:
+        print(f"🧾 Resumen de la sesión en: {estadisticas.ruta}")
+    resumen = estadisticas.resumen()
+    for id_rostro, rostro in resumen['rostros'].items():
+        if not rostro['ventanas']:
+            continue
+        prefijo = f"Rostro {id_rostro}: " if len(resumen['rostros']) > 1 else ""
+        frecuencia = rostro['frecuencia_por_ventana']
+        emociones = ", ".join(f"{emocion} {datos['pct']}%" for emocion, datos in list(rostro['emociones'].items())[:3])
+        estados = ", ".join(f"{estado} {segundos:.0f} s" for estado, segundos in rostro['estados'].items())
+        print(f"   {prefijo}{rostro['parpadeos_por_minuto']} parpadeos/min "
+              f"(p50 {frecuencia['p50']}/s, p90 {frecuencia['p90']}/s) - {emociones or 'Neutral'} - {estados}")
+
+def abrir_fuente(fuente):
+    """
+    Abre la cámara (índice), un archivo de video o una URL de stream
+
+    Returns:
+        tuple: (captura, marca_tiempo, es_archivo)
+    """
+    if fuente.isdigit():
+        return cv2.VideoCapture(int(fuente)), None, False
+    captura = cv2.VideoCapture(fuente)
+    if os.path.exists(fuente):
+        # En archivos el tiempo sale de la posición del video, no del reloj
+        return captura, lambda cap: cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, True
+    return captura, None, False
+
+def ejecutar_ventana(pipeline, detector):
+    """Modo interactivo: dibuja cada frame en una ventana hasta que se presione ESC"""
+    cv2.namedWindow("Detector de Expresiones Avanzado", cv2.WINDOW_NORMAL)
+    cv2.resizeWindow("Detector de Expresiones Avanzado", 1000, 700)
+    try:
+        for salida in pipeline.resultados():
+            with pipeline.etapa_salida():
+                frame = dibujar_resultados(salida, detector, pipeline.metricas())
+                cv2.imshow("Detector de Expresiones Avanzado", frame)
+                tecla = cv2.waitKey(1) & 0xFF
+            if tecla == 27:  # ESC para salir
+                break
+    finally:
+        cv2.destroyAllWindows()
+
+def ejecutar_headless(pipeline, intervalo_reporte=5.0):
+    """Modo sin pantalla: consume los frames tan rápido como se decodifican"""
+    inicio = time.perf_counter()
+    ultimo_reporte = inicio
+    frames = 0
+    for _ in pipeline.resultados():
+        with pipeline.etapa_salida():
+            frames += 1
+        ahora = time.perf_counter()
+        if ahora - ultimo_reporte >= intervalo_reporte:
+            print(f"⏩ {frames} frames procesados ({frames / (ahora - inicio):.1f} fps)")
+            ultimo_reporte = ahora
+    segundos = time.perf_counter() - inicio
+    frames_video = frames * pipeline.salto
+    print(f"\n🎞️  {frames} frames analizados ({frames_video} frames de video) en {segundos:.1f} s: "
+          f"{frames / segundos if segundos else 0:.1f} fps analizados, "
+          f"{frames_video / segundos if segundos else 0:.1f} fps de video")
+
+def main():
+    parser = argparse.ArgumentParser(description="Detector de expresiones en vivo o sobre video")
+    parser.add_argument('--fuente', default='0', help="Índice de cámara, archivo de video o URL de stream")
+    parser.add_argument('--headless', action='store_true', help="Sin ventana ni dibujo (servidores sin pantalla)")
+    parser.add_argument('--salto', type=int, default=1, help="Analizar 1 de cada N frames")
+    parser.add_argument('--store', default=None, help="Destino de resultados: csv:<ruta> o sqlite:<ruta>")
+    parser.add_argument('--max-rostros', type=int, default=1, help="Rostros a seguir a la vez (entrevistas grupales)")
+    parser.add_argument('--suavizado', type=int, default=5, help="Frames en la ventana de suavizado")
+    parser.add_argument('--votos', type=int, default=2, help="Frames mínimos para mostrar una emoción")
+    parser.add_argument('--decaimiento', type=float, default=None,
+                        help="Decaimiento exponencial de la confianza (0-1), desactivado por defecto")
+    parser.add_argument('--resumen', default=None, metavar='RUTA',
+                        help="Resumen JSON de la sesión (por defecto data/resumen_entrevista_<sesion>.json)")
+    parser.add_argument('--landmarks', default=None, metavar='CARPETA',
+                        help="Guardar los landmarks de cada frame en este archivo (p. ej. data/landmarks)")
+    parser.add_argument('--adaptativo', action='store_true',
+                        help="FaceMesh sobre un recorte alrededor de los rostros y saltos con expresión estable")
+    parser.add_argument('--margen-roi', type=float, default=0.3, help="Margen del recorte, en tamaños de rostro")
+    parser.add_argument('--max-saltos', type=int, default=2, help="Frames seguidos que se pueden saltar")
+    parser.add_argument('--auditoria', type=int, default=30,
+                        help="Comparar con el frame completo cada N frames planificados (0 desactiva)")
+    parser.add_argument('--presupuesto', type=float, default=0.05,
+                        help="Discrepancia de emociones tolerada antes de dejar de saltar frames")
+    parser.add_argument('--max-hueco', type=float, default=0.5,
+                        help="Segundos sin ver un rostro que descartan un cierre de ojos en curso "
+                             "(se amplía a 4 veces el intervalo entre frames analizados)")
+    parser.add_argument('--metricas-puerto', type=int, default=None,
+                        help="Exponer /metrics (formato Prometheus) en este puerto")
+    args = parser.parse_args()
+    
+    captura, marca_tiempo, es_archivo = abrir_fuente(args.fuente)
+    if not captura.isOpened():
+        print(f"❌ No se pudo abrir la fuente: {args.fuente}")
+        return
+    
+    sesion_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    destino, store = crear_store_sesion(sesion_id, args.store)
+    estadisticas = EstadisticasSesion(sesion_id, args.resumen or f"data/resumen_entrevista_{sesion_id}.json")
+    landmark_store = LandmarkStore(args.landmarks) if args.landmarks else None
+    planificador = None
+    if args.adaptativo:
+        planificador = PlanificadorInferencia(margen=args.margen_roi, max_saltos=args.max_saltos,
+                                              auditoria=args.auditoria, presupuesto=args.presupuesto)
+    detector = EmotionDetector(max_num_faces=args.max_rostros)
+    # El espejo solo tiene sentido para la cámara frente al usuario
+    sesion = SesionEmociones(detector, espejo=not args.headless and args.fuente.isdigit(),
+                             store=store, sesion=sesion_id, landmark_store=landmark_store,
+                             planificador=planificador, estadisticas=estadisticas,
+                             parpadeos=DetectorParpadeos(max_hueco=args.max_hueco),
+                             suavizado={'longitud': args.suavizado, 'umbral_votos': args.votos,
+                                        'decaimiento': args.decaimiento})
+    
+    print("🎯 Detector de Expresiones Avanzado iniciado")
+    if not args.headless:
+        print("📍 Mantén tu rostro centrado para calibrar...")
+        print("🔧 Presiona ESC para salir")
+    
+    # Captura e inferencia en hilos propios; la salida se consume en este hilo.
+    # Con archivos no se descartan frames: se procesan todos a la velocidad de decodificación
+    pipeline = PipelineVideo(captura, sesion.procesar, marca_tiempo=marca_tiempo,
+                             descartar=not es_archivo, salto=args.salto)
+    if args.metricas_puerto:
+        metrics.REGISTRO.medidor('trackeo_pipeline_fps', "FPS efectivos del pipeline",
+                                 lambda: pipeline.metricas()['fps_efectivos'])
+        metrics.REGISTRO.medidor('trackeo_pipeline_descartados', "Frames descartados por el pipeline",
+                                 lambda: pipeline.metricas()['descartados'])
+        if planificador is not None:
+            metrics.REGISTRO.medidor('trackeo_planificador_frames', "Frames por modo de inferencia",
+                                     lambda: dict(planificador.frames), 'modo')
+        metrics.servir(args.metricas_puerto)
+        print(f"📡 Métricas en http://localhost:{args.metricas_puerto}/metrics")
+    pipeline.iniciar()
+    try:
+        if args.headless:
+            ejecutar_headless(pipeline)
+        else:
+            ejecutar_ventana(pipeline, detector)
+    finally:
+        pipeline.detener()
+        captura.release()
+        store.cerrar()
+        if landmark_store is not None:
+            landmark_store.cerrar()
+    
+    imprimir_metricas(pipeline.metricas())
+    if planificador is not None:
+        imprimir_planificador(planificador.resumen())
+    resumen_sesion(estadisticas, destino)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FaceMeshPool:
+    """Pool de instancias FaceMesh compartido por todo el proceso.
+
+    Cada instancia se crea una sola vez (static_image_mode=True para
+    imágenes subidas) y se presta de forma exclusiva a una petición a la
+    vez, así la latencia por imagen solo incluye la inferencia.
+    """
+
+    def __init__(self, tamano=None, max_num_faces=1, refine_landmarks=True,
+                 min_detection_confidence=0.5):
+        if tamano is None:
+            tamano = int(os.environ.get('FACEMESH_POOL_SIZE', os.cpu_count() or 1))
+        self.tamano = max(1, tamano)
+        self.config = {
+            'static_image_mode': True,
+            'max_num_faces': max_num_faces,
+            'refine_landmarks': refine_landmarks,
+            'min_detection_confidence': min_detection_confidence
+        }
+
+        self._disponibles = queue.LifoQueue()
+        self._instancias = []
+        self._lock = threading.Lock()
+        self._cerrado = False
+
+        # Métricas de ocupación
+        self._en_uso = 0
+        self._max_en_uso = 0
+        self._prestamos = 0
+        self._esperas = 0
+        self._tiempo_espera_total = 0.0
+
+        # MediaPipe tarda en importarse: solo lo pagan los procesos que crean un pool
+        import mediapipe as mp
+        for _ in range(self.tamano):
+            face_mesh = mp.solutions.face_mesh.FaceMesh(**self.config)
+            self._instancias.append(face_mesh)
+            self._disponibles.put(face_mesh)
+
+    @contextmanager
+    def instancia(self, timeout=None):
+        """Presta una instancia FaceMesh de uso exclusivo durante el bloque with"""
+        if self._cerrado:
+            raise RuntimeError("El pool de FaceMesh está cerrado")
+
+        inicio = time.perf_counter()
+        try:
+            face_mesh = self._disponibles.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._esperas += 1
+            try:
+                face_mesh = self._disponibles.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("No hay instancias de FaceMesh disponibles")
+        if face_mesh is None:
+            # Marca de cierre: se devuelve para despertar a las demás peticiones que esperan
+            self._disponibles.put(None)
+            raise RuntimeError("El pool de FaceMesh está cerrado")
+        espera = time.perf_counter() - inicio
+
+        with self._lock:
+            self._en_uso += 1
+            self._max_en_uso = max(self._max_en_uso, self._en_uso)
+            self._prestamos += 1
+            self._tiempo_espera_total += espera
+
+        try:
+            yield face_mesh
+        finally:
+            with self._lock:
+                self._en_uso -= 1
+                cerrado = self._cerrado
+                if not cerrado:
+                    self._disponibles.put(face_mesh)
+            # El pool se cerró mientras la instancia estaba prestada: se cierra al devolverla
+            if cerrado:
+                face_mesh.close()
+
+    def procesar(self, imagen_rgb, timeout=None):
+        """Ejecuta FaceMesh sobre una imagen RGB usando una instancia del pool"""
+        with self.instancia(timeout=timeout) as face_mesh:
+            return face_mesh.process(imagen_rgb)
+
+    def calentar(self):
+        """Ejecuta una inferencia sobre cada instancia para cargar el grafo al arrancar"""
+        imagen_vacia = np.zeros((192, 192, 3), dtype=np.uint8)
+        prestadas = []
+        try:
+            for _ in range(self.tamano):
+                face_mesh = self._disponibles.get()
+                prestadas.append(face_mesh)
+                face_mesh.process(imagen_vacia)
+        finally:
+            for face_mesh in prestadas:
+                self._disponibles.put(face_mesh)
+
+    def cerrar(self):
+        """
+        Libera las instancias; se llama al apagar el proceso
+
+        Solo se cierran las libres: las prestadas a una petición en curso se
+        cierran cuando esta las devuelve.
+        """
+        with self._lock:
+            if self._cerrado:
+                return
+            self._cerrado = True
+            libres = []
+            while True:
+                try:
+                    libres.append(self._disponibles.get_nowait())
+                except queue.Empty:
+                    break
+            # Las peticiones que esperan una instancia reciben la marca de cierre
+            self._disponibles.put(None)
+        for face_mesh in libres:
+            face_mesh.close()
+        self._instancias = []
+
+    def metricas(self):
+        """Devuelve la ocupación actual del pool"""
+        with self._lock:
+            promedio_espera = (self._tiempo_espera_total / self._prestamos) if self._prestamos else 0.0
+            return {
+                'tamano': self.tamano,
+                'en_uso': self._en_uso,
+                'disponibles': self.tamano - self._en_uso,
+                'max_en_uso': self._max_en_uso,
+                'prestamos': self._prestamos,
+                'esperas': self._esperas,
+                'espera_promedio_ms': round(promedio_espera * 1000, 3)
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool(**kwargs):
+    """Devuelve el pool del proceso, creándolo la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = FaceMeshPool(**kwargs)
+    return _pool
+
+
+def cerrar_pool():
+    """Cierra el pool del proceso si existe"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.cerrar()
+            _pool = None
@@ -0,0 +1,137 @@
+import numpy as np
+
+# Índices de MediaPipe Face Mesh usados por ambos detectores
+BOCA_SUP, BOCA_INF = 13, 14
+BOCA_IZQ, BOCA_DER = 78, 308
+COMISURA_IZQ, COMISURA_DER = 61, 291
+LABIO_SUP_CENTRO, LABIO_INF_CENTRO = 12, 15
+LABIO_SUP_IZQ = 37
+OJO_IZQ_SUP, OJO_IZQ_INF = 159, 145
+OJO_DER_SUP, OJO_DER_INF = 386, 374
+OJO_IZQ_EXTERIOR, OJO_IZQ_INTERIOR = 33, 133
+OJO_DER_INTERIOR, OJO_DER_EXTERIOR = 362, 263
+CEJA_IZQ_INTERIOR, CEJA_DER_INTERIOR = 70, 300
+CEJA_IZQ_SUP, CEJA_DER_SUP = 55, 285
+NARIZ_PUNTA = 1
+MEJILLA_IZQ, MEJILLA_DER = 116, 345
+
+# Diferencias verticales |y2 - y1| en píxeles
+_PARES_VERTICALES = (
+    ('apertura_boca', BOCA_SUP, BOCA_INF),
+    ('elevacion_cejas', CEJA_IZQ_INTERIOR, OJO_IZQ_INTERIOR),
+    ('distancia_ceja_der', CEJA_DER_INTERIOR, OJO_DER_INTERIOR),
+    ('apertura_ojo', OJO_IZQ_SUP, OJO_IZQ_INF),
+    ('grosor_labios', LABIO_SUP_CENTRO, LABIO_INF_CENTRO),
+    ('elevacion_labio_sup', NARIZ_PUNTA, LABIO_SUP_IZQ),
+)
+
+# Diferencias horizontales |x2 - x1| en píxeles
+_PARES_HORIZONTALES = (
+    ('anchura_boca', BOCA_IZQ, BOCA_DER),
+)
+
+# Distancias euclidianas en píxeles
+_PARES_EUCLIDIANOS = (
+    ('apertura_boca_euclid', BOCA_SUP, BOCA_INF),
+    ('ancho_sonrisa', BOCA_IZQ, BOCA_DER),
+    ('elevacion_ceja_izq', CEJA_IZQ_SUP, OJO_IZQ_SUP),
+    ('elevacion_ceja_der', CEJA_DER_SUP, OJO_DER_SUP),
+    ('altura_ojo_izq', OJO_IZQ_SUP, OJO_IZQ_INF),
+    ('altura_ojo_der', OJO_DER_SUP, OJO_DER_INF),
+    ('distancia_cejas', CEJA_IZQ_INTERIOR, CEJA_DER_INTERIOR),
+    ('mejilla_izq_nariz', MEJILLA_IZQ, NARIZ_PUNTA),
+    ('mejilla_der_nariz', MEJILLA_DER, NARIZ_PUNTA),
+    ('ancho_rostro', OJO_IZQ_EXTERIOR, OJO_DER_EXTERIOR),
+)
+
+_DERIVADAS = (
+    'elevacion_cejas_promedio',
+    'curvatura_boca',
+    'curvatura_labio_sup',
+    'elevacion_cejas_euclid',
+    'asimetria',
+)
+
+NOMBRES_CARACTERISTICAS = tuple(
+    [nombre for nombre, _, _ in _PARES_VERTICALES] +
+    [nombre for nombre, _, _ in _PARES_HORIZONTALES] +
+    [nombre for nombre, _, _ in _PARES_EUCLIDIANOS] +
+    list(_DERIVADAS)
+)
+INDICE_CARACTERISTICA = {nombre: i for i, nombre in enumerate(NOMBRES_CARACTERISTICAS)}
+
+_IDX_V = np.array([[a, b] for _, a, b in _PARES_VERTICALES], dtype=np.intp)
+_IDX_H = np.array([[a, b] for _, a, b in _PARES_HORIZONTALES], dtype=np.intp)
+_IDX_E = np.array([[a, b] for _, a, b in _PARES_EUCLIDIANOS], dtype=np.intp)
+
+
+def landmarks_a_array(landmarks):
+    """Convierte los landmarks de MediaPipe (o un array ya convertido) a un array (N, 3) float32"""
+    if isinstance(landmarks, np.ndarray):
+        return landmarks.astype(np.float32, copy=False)
+    if hasattr(landmarks, 'landmark'):
+        landmarks = landmarks.landmark
+    return np.array([(p.x, p.y, p.z) for p in landmarks], dtype=np.float32)
+
+
+def matriz_caracteristicas(puntos, shape):
+    """
+    Calcula todas las medidas faciales en una sola pasada vectorizada
+
+    Args:
+        puntos: Array (N, 3) o lote (B, N, 3) de landmarks normalizados
+        shape: Tupla (altura, ancho) de la imagen, o array (B, 2) con una por rostro
+            (rostros de imágenes distintas)
+
+    Returns:
+        np.ndarray: Matriz (B, F) float32 con columnas en NOMBRES_CARACTERISTICAS
+    """
+    puntos = np.asarray(puntos, dtype=np.float32)
+    if puntos.ndim == 2:
+        puntos = puntos[np.newaxis]
+    shape = np.asarray(shape, dtype=np.float32)
+
+    # (alto, ancho) -> (ancho, alto) para multiplicar (x, y)
+    escala = shape[::-1] if shape.ndim == 1 else shape[:, np.newaxis, ::-1]
+    pix = puntos[..., :2] * escala
+
+    verticales = np.abs(pix[:, _IDX_V[:, 1], 1] - pix[:, _IDX_V[:, 0], 1])
+    horizontales = np.abs(pix[:, _IDX_H[:, 1], 0] - pix[:, _IDX_H[:, 0], 0])
+    euclidianas = np.linalg.norm(pix[:, _IDX_E[:, 1]] - pix[:, _IDX_E[:, 0]], axis=-1)
+
+    y = pix[..., 1]
+    v = dict(zip((n for n, _, _ in _PARES_VERTICALES), verticales.T))
+    e = dict(zip((n for n, _, _ in _PARES_EUCLIDIANOS), euclidianas.T))
+    derivadas = np.stack([
+        (v['elevacion_cejas'] + v['distancia_ceja_der']) / 2,
+        (y[:, BOCA_SUP] + y[:, BOCA_INF]) / 2 - (y[:, COMISURA_IZQ] + y[:, COMISURA_DER]) / 2,
+        y[:, LABIO_SUP_CENTRO] - (y[:, BOCA_IZQ] + y[:, BOCA_DER]) / 2,
+        (e['elevacion_ceja_izq'] + e['elevacion_ceja_der']) / 2,
+        np.abs(e['mejilla_izq_nariz'] - e['mejilla_der_nariz']),
+    ], axis=1)
+
+    return np.concatenate([verticales, horizontales, euclidianas, derivadas], axis=1)
+
+
+def extraer_caracteristicas(landmarks, shape):
+    """
+    Extrae las medidas faciales de uno o varios rostros
+
+    Args:
+        landmarks: face_landmarks.landmark, array (N, 3) o lote (B, N, 3)
+        shape: Tupla (altura, ancho) de la imagen
+
+    Returns:
+        dict: nombre -> float para un rostro, o nombre -> np.ndarray (B,) para un lote
+    """
+    puntos = landmarks_a_array(landmarks)
+    matriz = matriz_caracteristicas(puntos, shape)
+    if puntos.ndim == 2:
+        return {nombre: float(valor) for nombre, valor in zip(NOMBRES_CARACTERISTICAS, matriz[0])}
+    return {nombre: matriz[:, i] for i, nombre in enumerate(NOMBRES_CARACTERISTICAS)}
+
+
+def caracteristicas_por_rostro(puntos, shape):
+    """Calcula las medidas de un lote (F, N, 3) en una pasada y las devuelve como lista de dicts"""
+    matriz = matriz_caracteristicas(puntos, shape)
+    return [dict(zip(NOMBRES_CARACTERISTICAS, fila)) for fila in matriz.tolist()]
@@ -0,0 +1,328 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from itertools import islice
+
+from scripts.batch import analizar_imagen, filas_resultados, guardar_landmarks, EXTENSIONES_IMAGEN
+from scripts.face_mesh_pool import obtener_pool
+from scripts.landmark_store import LandmarkStore, DIRECTORIO_LANDMARKS
+from scripts.result_cache import hash_imagen
+from scripts.results_store import crear_store, ARCHIVO_HISTORIAL
+
+DIRECTORIO_INGESTAS = "data/ingestas"
+
+
+def iterar_fuente(fuente):
+    """
+    Genera (nombre, ruta) de las imágenes de una carpeta o de un manifiesto
+
+    En una carpeta el nombre es la ruta relativa a ella, porque los archivos
+    de entrevistas repiten nombres entre subcarpetas. Un manifiesto es un
+    archivo de texto con una ruta por línea (relativa al manifiesto si no es
+    absoluta); se ignoran las líneas vacías y las que empiezan con #.
+    """
+    if os.path.isdir(fuente):
+        for raiz, carpetas, archivos in os.walk(fuente):
+            carpetas.sort()
+            for archivo in sorted(archivos):
+                if archivo.lower().endswith(EXTENSIONES_IMAGEN):
+                    ruta = os.path.join(raiz, archivo)
+                    yield os.path.relpath(ruta, fuente), ruta
+        return
+    base = os.path.dirname(os.path.abspath(fuente))
+    with open(fuente, encoding='utf-8') as f:
+        for linea in f:
+            linea = linea.strip()
+            if linea and not linea.startswith('#'):
+                yield linea, linea if os.path.isabs(linea) else os.path.join(base, linea)
+
+
+def ruta_checkpoint(fuente):
+    """Checkpoint por defecto de una fuente: la misma carpeta o manifiesto reanuda la misma ingesta"""
+    absoluta = os.path.abspath(fuente)
+    huella = hashlib.sha1(absoluta.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(DIRECTORIO_INGESTAS, f"{os.path.basename(os.path.normpath(absoluta))}-{huella}.db")
+
+
+def estado_resultado(resultado):
+    if resultado.get('duplicada'):
+        return 'duplicada'
+    if 'error' in resultado:
+        return 'error'
+    return 'rostro' if resultado['rostro'] else 'sin_rostro'
+
+
+class Checkpoint:
+    """
+    Progreso de una ingesta en SQLite (modo WAL, los workers lo leen en paralelo)
+
+        procesadas  Una fila por ruta terminada, con su hash y su estado
+                    ('rostro', 'sin_rostro', 'duplicada' o 'error')
+        hashes      Contenidos ya guardados: una imagen repetida no se vuelve
+                    a analizar ni a escribir en el store
+
+    Cada tanda se marca después de escribir sus filas: si el proceso muere
+    entre ambas escrituras, al reanudar se repite a lo sumo esa tanda. Las
+    imágenes con error se vuelven a intentar al reanudar.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(ruta)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("CREATE TABLE IF NOT EXISTS procesadas (ruta TEXT PRIMARY KEY, hash TEXT, "
+                               "estado TEXT, hora TEXT) WITHOUT ROWID")
+        self._conexion.execute("CREATE TABLE IF NOT EXISTS hashes (hash TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conexion.commit()
+
+    def pendientes(self, items):
+        """Los (nombre, ruta) de items que todavía no se procesaron (o fallaron)"""
+        if not items:
+            return []
+        marcadores = ", ".join("?" * len(items))
+        hechas = {fila[0] for fila in self._conexion.execute(
+            f"SELECT ruta FROM procesadas WHERE ruta IN ({marcadores}) AND estado != 'error'",
+            [ruta for _, ruta in items])}
+        return [item for item in items if item[1] not in hechas]
+
+    def deduplicar(self, resultados):
+        """Marca como duplicadas las imágenes cuyo contenido ya se guardó (antes o en esta misma tanda)"""
+        vistos = set()
+        for resultado in resultados:
+            digest = resultado.get('hash')
+            if not digest or resultado.get('duplicada') or 'error' in resultado:
+                continue
+            if digest in vistos or self._conexion.execute(
+                    "SELECT 1 FROM hashes WHERE hash = ?", (digest,)).fetchone():
+                resultado['duplicada'] = True
+                resultado['rostro'] = False
+            vistos.add(digest)
+
+    def marcar(self, resultados, hora):
+        with self._conexion:
+            # Una ruta repetida en el manifiesto no pisa su primer estado; un error sí se reemplaza
+            self._conexion.executemany(
+                "INSERT INTO procesadas VALUES (?, ?, ?, ?) ON CONFLICT (ruta) DO UPDATE SET "
+                "hash = excluded.hash, estado = excluded.estado, hora = excluded.hora "
+                "WHERE procesadas.estado = 'error'",
+                [(r['ruta'], r.get('hash'), estado_resultado(r), hora) for r in resultados])
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO hashes VALUES (?)",
+                [(r['hash'],) for r in resultados if estado_resultado(r) in ('rostro', 'sin_rostro')])
+
+    def conteos(self):
+        """Imágenes procesadas por estado"""
+        return dict(self._conexion.execute("SELECT estado, COUNT(*) FROM procesadas GROUP BY estado").fetchall())
+
+    def cerrar(self):
+        self._conexion.close()
+
+
+_hashes_worker = None
+
+
+def iniciar_worker(ruta):
+    """Crea y calienta el FaceMesh del proceso y abre el checkpoint en solo lectura"""
+    global _hashes_worker
+    obtener_pool(tamano=1, max_num_faces=int(os.environ.get('FACEMESH_MAX_FACES', 4))).calentar()
+    _hashes_worker = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+
+
+def procesar_tanda(items):
+    """
+    Analiza una tanda de (nombre, ruta) en el proceso actual
+
+    Las imágenes cuyo hash ya está en el checkpoint se devuelven como
+    duplicadas sin decodificarlas ni pasar por FaceMesh.
+    """
+    resultados = []
+    for nombre, ruta in items:
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+        except OSError as e:
+            resultados.append({'imagen': nombre, 'ruta': ruta, 'rostro': False, 'error': str(e)})
+            continue
+        digest = hash_imagen(datos)
+        if _hashes_worker is not None and _hashes_worker.execute(
+                "SELECT 1 FROM hashes WHERE hash = ?", (digest,)).fetchone():
+            resultados.append({'imagen': nombre, 'ruta': ruta, 'hash': digest, 'rostro': False, 'duplicada': True})
+            continue
+        try:
+            resultado = analizar_imagen(nombre, datos, digest)
+        except Exception as e:
+            resultado = {'imagen': nombre, 'hash': digest, 'rostro': False, 'error': f"{type(e).__name__}: {e}"}
+        resultado['ruta'] = ruta
+        resultados.append(resultado)
+    return resultados
+
+
+class Progreso:
+    """Imágenes por segundo y tiempo restante estimado de la ingesta"""
+
+    def __init__(self, total, previas, intervalo=5.0, salida=print):
+        self.total = total
+        self.previas = previas
+        self.intervalo = intervalo
+        self.salida = salida
+        self.procesadas = 0
+        self.estados = {}
+        self.inicio = time.perf_counter()
+        self._ultimo_reporte = self.inicio
+
+    def avanzar(self, resultados):
+        self.procesadas += len(resultados)
+        for resultado in resultados:
+            estado = estado_resultado(resultado)
+            self.estados[estado] = self.estados.get(estado, 0) + 1
+        ahora = time.perf_counter()
+        if self.intervalo and ahora - self._ultimo_reporte >= self.intervalo:
+            self._ultimo_reporte = ahora
+            self.salida(self.linea())
+
+    def imagenes_por_segundo(self):
+        segundos = time.perf_counter() - self.inicio
+        return self.procesadas / segundos if segundos > 0 else 0.0
+
+    def linea(self):
+        hechas = self.previas + self.procesadas
+        velocidad = self.imagenes_por_segundo()
+        restantes = max(self.total - hechas, 0)
+        eta = str(timedelta(seconds=int(restantes / velocidad))) if velocidad > 0 else "?"
+        porcentaje = hechas / self.total * 100 if self.total else 100.0
+        return (f"⏩ {hechas}/{self.total} imágenes ({porcentaje:.1f}%), {velocidad:.1f} img/s, "
+                f"ETA {eta} - {self.estados.get('duplicada', 0)} duplicadas, {self.estados.get('error', 0)} errores")
+
+
+def _tandas(items, tamano):
+    iterador = iter(items)
+    while True:
+        tanda = list(islice(iterador, tamano))
+        if not tanda:
+            return
+        yield tanda
+
+
+def ingerir(fuente, store, checkpoint, landmark_store=None, procesos=None, tamano_tanda=64, intervalo_reporte=5.0):
+    """
+    Analiza todas las imágenes de una carpeta o manifiesto que falten en el checkpoint
+
+    La lista se reparte en tandas de `tamano_tanda` imágenes entre los
+    procesos (cada uno con su FaceMesh); hay a lo sumo dos tandas en vuelo
+    por proceso, así que la memoria no depende del tamaño del archivo. Este
+    proceso es el único que escribe: por cada tanda terminada agrega sus
+    filas al store en una sola escritura, sus landmarks al archivo y marca
+    el checkpoint.
+
+    Returns:
+        dict: Resumen de la ingesta
+    """
+    procesos = procesos or os.cpu_count() or 1
+    total = sum(1 for _ in iterar_fuente(fuente))
+    previas = sum(cantidad for estado, cantidad in checkpoint.conteos().items() if estado != 'error')
+    progreso = Progreso(total, previas, intervalo_reporte)
+    if previas:
+        print(f"↩️  Reanudando: {previas} de {total} imágenes ya procesadas")
+
+    def pendientes():
+        for tanda in _tandas(iterar_fuente(fuente), tamano_tanda):
+            tanda = checkpoint.pendientes(tanda)
+            if tanda:
+                yield tanda
+
+    filas_guardadas = 0
+
+    def guardar(resultados):
+        nonlocal filas_guardadas
+        checkpoint.deduplicar(resultados)
+        hora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        filas = filas_resultados(resultados, hora)
+        if filas:
+            filas_guardadas += store.agregar(filas)
+        if landmark_store is not None:
+            guardar_landmarks(landmark_store, resultados, hora)
+        checkpoint.marcar(resultados, hora)
+        progreso.avanzar(resultados)
+
+    if procesos == 1:
+        iniciar_worker(checkpoint.ruta)
+        for tanda in pendientes():
+            guardar(procesar_tanda(tanda))
+    else:
+        # spawn, como en el análisis por lotes: MediaPipe no sobrevive a un fork
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=iniciar_worker, initargs=(checkpoint.ruta,)) as executor:
+            en_vuelo = set()
+            for tanda in pendientes():
+                en_vuelo.add(executor.submit(procesar_tanda, tanda))
+                if len(en_vuelo) >= procesos * 2:
+                    listos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for futuro in listos:
+                        guardar(futuro.result())
+            for futuro in wait(en_vuelo).done:
+                guardar(futuro.result())
+
+    segundos = time.perf_counter() - progreso.inicio
+    return {
+        'total': total,
+        'previas': previas,
+        'procesadas': progreso.procesadas,
+        'estados': dict(progreso.estados),
+        'filas': filas_guardadas,
+        'segundos': round(segundos, 1),
+        'imagenes_por_segundo': round(progreso.imagenes_por_segundo(), 2),
+        'checkpoint': checkpoint.conteos()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingesta reanudable de archivos grandes de imágenes en varios procesos")
+    parser.add_argument('fuente', help="Carpeta de imágenes o manifiesto (una ruta por línea)")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto, CPUs)")
+    parser.add_argument('--store', default=os.environ.get('RESULTS_STORE', f"csv:{ARCHIVO_HISTORIAL}"),
+                        help="Destino de resultados: csv:<ruta> o sqlite:<ruta>")
+    parser.add_argument('--landmarks', default=DIRECTORIO_LANDMARKS,
+                        help="Archivo de landmarks crudos ('' para no guardarlos)")
+    parser.add_argument('--checkpoint', default=None,
+                        help="Base SQLite del progreso (por defecto data/ingestas/<fuente>-<huella>.db)")
+    parser.add_argument('--reiniciar', action='store_true', help="Descartar el checkpoint y empezar de cero")
+    parser.add_argument('--tanda', type=int, default=64, help="Imágenes por tarea de un proceso")
+    parser.add_argument('--intervalo', type=float, default=5.0, help="Segundos entre reportes de progreso")
+    args = parser.parse_args()
+
+    ruta = args.checkpoint or ruta_checkpoint(args.fuente)
+    if args.reiniciar:
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+    checkpoint = Checkpoint(ruta)
+    store = crear_store(args.store)
+    landmark_store = LandmarkStore(args.landmarks) if args.landmarks else None
+    try:
+        resumen = ingerir(args.fuente, store, checkpoint, landmark_store, args.procesos, args.tanda, args.intervalo)
+    finally:
+        store.cerrar()
+        if landmark_store is not None:
+            landmark_store.cerrar()
+        checkpoint.cerrar()
+
+    estados = resumen['estados']
+    print(f"\n✅ {resumen['procesadas']} imágenes en {resumen['segundos']} s "
+          f"({resumen['imagenes_por_segundo']} img/s): {estados.get('rostro', 0)} con rostro, "
+          f"{estados.get('sin_rostro', 0)} sin rostro, {estados.get('duplicada', 0)} duplicadas, "
+          f"{estados.get('error', 0)} errores")
+    print(f"📝 {resumen['filas']} filas agregadas a {args.store}")
+    print(f"📌 Checkpoint: {ruta} ({sum(resumen['checkpoint'].values())} de {resumen['total']} imágenes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ColaLlena(Exception):
+    """Se rechaza un trabajo porque la cola alcanzó su límite"""
+
+
+class Trabajo:
+    """Estado de un análisis asíncrono"""
+
+    __slots__ = ('id', 'estado', 'creado', 'iniciado', 'terminado', 'resultado', 'error', '_listo')
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.estado = 'en_cola'
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self.resultado = None
+        self.error = None
+        self._listo = threading.Event()
+
+    def esperar(self, timeout):
+        return self._listo.wait(timeout)
+
+    def a_dict(self):
+        datos = {'id': self.id, 'estado': self.estado, 'creado': self.creado}
+        if self.iniciado is not None:
+            datos['espera_ms'] = round((self.iniciado - self.creado) * 1000, 2)
+        if self.terminado is not None:
+            datos['proceso_ms'] = round((self.terminado - self.iniciado) * 1000, 2)
+        if self.resultado is not None:
+            datos['resultado'] = self.resultado
+        if self.error is not None:
+            datos['error'] = self.error
+        return datos
+
+
+class ColaTrabajos:
+    """
+    Ejecuta análisis en un pool acotado de hilos fuera del ciclo de la petición
+
+    Args:
+        hilos: Tamaño del pool de trabajadores
+        max_pendientes: Trabajos en cola o en proceso antes de rechazar (backpressure)
+        max_guardados: Trabajos terminados que se conservan para consulta
+    """
+
+    def __init__(self, hilos=2, max_pendientes=32, max_guardados=1000):
+        self.max_pendientes = max_pendientes
+        self.max_guardados = max_guardados
+        self._executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="trabajo")
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._en_proceso = 0
+        self._contadores = {'enviados': 0, 'completados': 0, 'fallidos': 0, 'rechazados': 0}
+        self._espera_total = 0.0
+        self._proceso_total = 0.0
+
+    def enviar(self, funcion, *args):
+        """
+        Encola funcion(*args) y devuelve su Trabajo
+
+        El resultado de la función debe ser serializable a JSON. Lanza
+        ColaLlena si ya hay max_pendientes trabajos en cola o en proceso.
+        """
+        trabajo = Trabajo()
+        with self._lock:
+            if self._pendientes >= self.max_pendientes:
+                self._contadores['rechazados'] += 1
+                raise ColaLlena(f"Hay {self._pendientes} trabajos pendientes")
+            self._pendientes += 1
+            self._contadores['enviados'] += 1
+            self._trabajos[trabajo.id] = trabajo
+            while len(self._trabajos) > self.max_guardados:
+                self._trabajos.popitem(last=False)
+        self._executor.submit(self._ejecutar, trabajo, funcion, args)
+        return trabajo
+
+    def _ejecutar(self, trabajo, funcion, args):
+        trabajo.iniciado = time.time()
+        trabajo.estado = 'procesando'
+        with self._lock:
+            self._en_proceso += 1
+        try:
+            trabajo.resultado = funcion(*args)
+            trabajo.estado = 'terminado'
+        except Exception as e:
+            trabajo.error = str(e)
+            trabajo.estado = 'error'
+        finally:
+            trabajo.terminado = time.time()
+            with self._lock:
+                self._pendientes -= 1
+                self._en_proceso -= 1
+                self._contadores['completados' if trabajo.error is None else 'fallidos'] += 1
+                self._espera_total += trabajo.iniciado - trabajo.creado
+                self._proceso_total += trabajo.terminado - trabajo.iniciado
+            trabajo._listo.set()
+
+    def obtener(self, id_trabajo):
+        with self._lock:
+            return self._trabajos.get(id_trabajo)
+
+    def metricas(self):
+        with self._lock:
+            terminados = self._contadores['completados'] + self._contadores['fallidos']
+            return {
+                **self._contadores,
+                'en_cola': self._pendientes - self._en_proceso,
+                'en_proceso': self._en_proceso,
+                'max_pendientes': self.max_pendientes,
+                'espera_promedio_ms': round(self._espera_total / terminados * 1000, 2) if terminados else 0.0,
+                'proceso_promedio_ms': round(self._proceso_total / terminados * 1000, 2) if terminados else 0.0
+            }
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola():
+    """Cola del proceso; JOBS_WORKERS y JOBS_MAX_PENDING ajustan hilos y límite"""
+    global _cola
+    if _cola is None:
+        with _cola_lock:
+            if _cola is None:
+                _cola = ColaTrabajos(
+                    hilos=int(os.environ.get('JOBS_WORKERS', 2)),
+                    max_pendientes=int(os.environ.get('JOBS_MAX_PENDING', 32))
+                )
+    return _cola
+
+
+def cerrar_cola():
+    global _cola
+    with _cola_lock:
+        if _cola is not None:
+            _cola.cerrar()
+            _cola = None
@@ -0,0 +1,226 @@
+import argparse
+import glob
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+# Cada registro es un rostro (imagen) o un rostro en un frame (entrevista)
+PUNTOS = 478
+FORMATO = {'version': 1, 'dtype': 'float32', 'forma_registro': [PUNTOS, 3]}
+BYTES_REGISTRO = PUNTOS * 3 * 4
+
+DIRECTORIO_LANDMARKS = "data/landmarks"
+
+
+def metadatos_imagen(nombre, shape, cantidad, hora=None, digest=None):
+    """Metadatos de los rostros de una imagen, en el mismo orden que sus filas de historial"""
+    hora = hora or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [{'hora': hora, 'imagen': nombre, 'rostro': i, 'hash': digest, 'origen': 'imagen',
+             'alto': int(shape[0]) if shape else None, 'ancho': int(shape[1]) if shape else None}
+            for i in range(1, cantidad + 1)]
+
+
+class LandmarkStore:
+    """
+    Archivo de landmarks crudos: shards binarios de solo-agregar leídos con memmap
+
+    Cada shard es un par de archivos:
+        <shard>.f32    Registros float32 (478, 3) uno detrás de otro
+        <shard>.jsonl  Una línea de metadatos por registro (hora, imagen, rostro, ...)
+
+    Cada proceso escribe en sus propios shards, así que no hace falta
+    coordinar escritores. Un registro solo cuenta cuando su línea de
+    metadatos está completa: un corte a mitad de escritura pierde como mucho
+    el último registro. Recalcular emociones sobre todo el archivo es
+    recorrer los shards con memmap, sin decodificar ninguna imagen.
+    """
+
+    def __init__(self, directorio=DIRECTORIO_LANDMARKS, registros_por_shard=16384):
+        self.directorio = directorio
+        self.registros_por_shard = registros_por_shard
+        os.makedirs(directorio, exist_ok=True)
+        ruta_formato = os.path.join(directorio, 'formato.json')
+        if os.path.exists(ruta_formato):
+            with open(ruta_formato, encoding='utf-8') as f:
+                formato = json.load(f)
+            if formato != FORMATO:
+                raise ValueError(f"Formato de landmarks incompatible en {directorio}: {formato}")
+        else:
+            with open(ruta_formato, 'w', encoding='utf-8') as f:
+                json.dump(FORMATO, f)
+
+        self._lock = threading.Lock()
+        self._shard = None
+        self._datos = None
+        self._metadatos = None
+        self._en_shard = 0
+        self._secuencia = 0
+        self._contadores = {'registros': 0, 'shards': 0}
+
+    def _abrir_shard(self):
+        self._cerrar_shard()
+        self._secuencia += 1
+        self._shard = f"{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}-{self._secuencia:04d}"
+        base = os.path.join(self.directorio, self._shard)
+        self._datos = open(f"{base}.f32", 'ab')
+        self._metadatos = open(f"{base}.jsonl", 'a', encoding='utf-8')
+        self._en_shard = 0
+        self._contadores['shards'] += 1
+
+    def _cerrar_shard(self):
+        if self._datos is not None:
+            self._datos.close()
+            self._metadatos.close()
+            self._datos = self._metadatos = None
+
+    def agregar(self, landmarks, metadatos):
+        """
+        Agrega los landmarks de varios rostros
+
+        Args:
+            landmarks: Array (F, N, 3) de landmarks normalizados (N = 468 se completa con NaN)
+            metadatos: Lista de F diccionarios serializables a JSON
+
+        Returns:
+            int: Registros agregados
+        """
+        landmarks = np.asarray(landmarks, dtype=np.float32)
+        if len(landmarks) == 0:
+            return 0
+        if len(landmarks) != len(metadatos):
+            raise ValueError("Se necesita un diccionario de metadatos por rostro")
+        if landmarks.shape[1] < PUNTOS:
+            # FaceMesh sin refine_landmarks no devuelve los puntos del iris
+            relleno = np.full((len(landmarks), PUNTOS - landmarks.shape[1], 3), np.nan, dtype=np.float32)
+            landmarks = np.concatenate([landmarks, relleno], axis=1)
+        bloque = np.ascontiguousarray(landmarks[:, :PUNTOS, :3]).tobytes()
+        lineas = "".join(json.dumps(m, ensure_ascii=False) + "\n" for m in metadatos)
+
+        with self._lock:
+            if self._datos is None or self._en_shard + len(landmarks) > self.registros_por_shard:
+                self._abrir_shard()
+            # Primero los datos y después los metadatos que los hacen visibles
+            self._datos.write(bloque)
+            self._datos.flush()
+            self._metadatos.write(lineas)
+            self._metadatos.flush()
+            self._en_shard += len(landmarks)
+            self._contadores['registros'] += len(landmarks)
+        return len(landmarks)
+
+    def shards(self):
+        """Nombres de los shards en orden de creación"""
+        return sorted(os.path.basename(ruta)[:-len('.jsonl')]
+                      for ruta in glob.glob(os.path.join(self.directorio, '*.jsonl')))
+
+    def leer_shard(self, shard):
+        """
+        Devuelve (metadatos, landmarks) de un shard
+
+        landmarks es un memmap (R, 478, 3) de solo lectura: no se carga en memoria
+        hasta que se usa.
+        """
+        base = os.path.join(self.directorio, shard)
+        with open(f"{base}.jsonl", encoding='utf-8') as f:
+            metadatos = []
+            for linea in f:
+                if not linea.endswith("\n"):
+                    break  # Línea a medio escribir
+                metadatos.append(json.loads(linea))
+        registros = min(len(metadatos), os.path.getsize(f"{base}.f32") // BYTES_REGISTRO)
+        if registros == 0:
+            return [], np.empty((0, PUNTOS, 3), dtype=np.float32)
+        datos = np.memmap(f"{base}.f32", dtype=np.float32, mode='r', shape=(registros, PUNTOS, 3))
+        return metadatos[:registros], datos
+
+    def iterar_lotes(self, tamano=4096, shards=None):
+        """Genera (metadatos, landmarks) de a lo sumo 'tamano' registros, shard por shard"""
+        for shard in (self.shards() if shards is None else shards):
+            metadatos, datos = self.leer_shard(shard)
+            for inicio in range(0, len(metadatos), tamano):
+                yield metadatos[inicio:inicio + tamano], datos[inicio:inicio + tamano]
+
+    def total(self):
+        """Registros completos en todo el archivo"""
+        return sum(len(self.leer_shard(shard)[0]) for shard in self.shards())
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, 'shard_actual': self._shard}
+
+    def cerrar(self):
+        with self._lock:
+            self._cerrar_shard()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def obtener_landmark_store():
+    """Archivo de landmarks del proceso, o None si LANDMARKS_PERSIST=0 lo desactiva"""
+    global _store
+    if os.environ.get('LANDMARKS_PERSIST', '1') == '0':
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LandmarkStore(os.environ.get('LANDMARKS_DIR', DIRECTORIO_LANDMARKS))
+    return _store
+
+
+def cerrar_landmark_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.cerrar()
+            _store = None
+
+
+def importar_cache(store, directorio_cache):
+    """Agrega al archivo los landmarks guardados en las entradas del cache de resultados"""
+    agregados = 0
+    for ruta in sorted(glob.glob(os.path.join(directorio_cache, '*.npz'))):
+        digest = os.path.basename(ruta).split('-')[0]
+        try:
+            with np.load(ruta, allow_pickle=False) as archivo:
+                landmarks = archivo['landmarks']
+                shape = tuple(archivo['shape']) if 'shape' in archivo else None
+        except (OSError, KeyError, ValueError):
+            continue
+        if landmarks.ndim != 3 or len(landmarks) == 0:
+            continue
+        hora = datetime.fromtimestamp(os.path.getmtime(ruta)).strftime('%Y-%m-%d %H:%M:%S')
+        agregados += store.agregar(landmarks, metadatos_imagen(None, shape, len(landmarks), hora, digest))
+    return agregados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumen e importación del archivo de landmarks")
+    parser.add_argument('directorio', nargs='?', default=DIRECTORIO_LANDMARKS, help="Carpeta del archivo")
+    parser.add_argument('--importar-cache', default=None, metavar='CARPETA',
+                        help="Agregar los landmarks del cache de resultados (p. ej. data/cache)")
+    args = parser.parse_args()
+
+    store = LandmarkStore(args.directorio)
+    if args.importar_cache:
+        agregados = importar_cache(store, args.importar_cache)
+        store.cerrar()
+        print(f"✅ {agregados} rostros importados desde {args.importar_cache}")
+
+    shards = store.shards()
+    total = store.total()
+    origenes = {}
+    for metadatos, _ in store.iterar_lotes():
+        for m in metadatos:
+            origenes[m.get('origen')] = origenes.get(m.get('origen'), 0) + 1
+    print(f"📦 {total} registros en {len(shards)} shards ({total * BYTES_REGISTRO / 1024 / 1024:.1f} MB)")
+    for origen, cantidad in sorted(origenes.items(), key=lambda par: str(par[0])):
+        print(f"   {origen}: {cantidad}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import bisect
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (segundos) de los histogramas de latencia
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Etiquetas que se agregan a todas las muestras del proceso (p. ej. el worker de scripts.serve)
+_constantes = []
+
+
+def etiquetar_proceso(**etiquetas):
+    """Fija etiquetas comunes a todas las métricas del proceso, como worker="2" en cada worker prefork"""
+    _constantes[:] = [(nombre, str(valor)) for nombre, valor in etiquetas.items()]
+
+
+def _etiquetas_texto(nombres, valores, extra=None):
+    pares = _constantes + list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares) + "}"
+
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def muestras(self):
+        with self._lock:
+            valores = dict(self._valores)
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {valor}"
+                for clave, valor in sorted(valores.items())]
+
+
+class Histograma:
+    """Histograma acumulativo con buckets fijos, como los de Prometheus"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def muestras(self):
+        with self._lock:
+            series = {clave: (list(conteos), suma, total) for clave, (conteos, suma, total) in self._series.items()}
+        lineas = []
+        for clave, (conteos, suma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, clave, ('le', limite))} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, clave, ('le', '+Inf'))} {total}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, clave)} {suma:.6f}")
+            lineas.append(f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, clave)} {total}")
+        return lineas
+
+
+class Medidor:
+    """
+    Gauge cuyos valores se leen al exportar: funcion() -> {etiqueta: valor} o un número
+
+    `incluir` y `excluir` filtran las claves del diccionario que exporta.
+    """
+
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, funcion, etiqueta=None, incluir=None, excluir=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.etiqueta = etiqueta
+        self.incluir = set(incluir) if incluir is not None else None
+        self.excluir = set(excluir)
+
+    def muestras(self):
+        try:
+            valores = self.funcion()
+        except Exception:
+            return []
+        if valores is None:
+            return []
+        if self.etiqueta is None:
+            return [f"{self.nombre}{_etiquetas_texto((), ())} {valores}"]
+        return [f"{self.nombre}{_etiquetas_texto((self.etiqueta,), (clave,))} {valor}"
+                for clave, valor in sorted(valores.items())
+                if isinstance(valor, (int, float)) and clave not in self.excluir
+                and (self.incluir is None or clave in self.incluir)]
+
+
+class ContadorLeido(Medidor):
+    """Como Medidor, pero para valores monótonos: se exporta como counter para que rate() funcione"""
+
+    tipo = 'counter'
+
+
+class Registro:
+    """Conjunto de métricas del proceso y su exportación en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            # Registrar dos veces el mismo nombre devuelve la métrica existente
+            return self._metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def medidor(self, nombre, ayuda, funcion, etiqueta=None, monotonos=()):
+        """
+        Registra un gauge leído al exportar
+
+        Las claves en `monotonos` (aciertos, préstamos, trabajos enviados...) no van en el
+        gauge sino en un counter aparte, `<nombre>_total`, con la misma etiqueta.
+        """
+        with self._lock:
+            # Los medidores se reemplazan: apuntan al objeto vivo más reciente
+            self._metricas[nombre] = Medidor(nombre, ayuda, funcion, etiqueta, excluir=monotonos)
+            if monotonos:
+                self._metricas[f"{nombre}_total"] = ContadorLeido(
+                    f"{nombre}_total", f"{ayuda} (valores acumulados)", funcion, etiqueta, incluir=monotonos)
+            return self._metricas[nombre]
+
+    def exponer(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        lineas = []
+        for metrica in metricas:
+            muestras = metrica.muestras()
+            if not muestras:
+                continue
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(muestras)
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+DURACION_ETAPAS = REGISTRO.histograma(
+    'trackeo_etapa_segundos', "Duración de cada etapa del análisis", ('ruta', 'etapa'))
+IMAGENES = REGISTRO.contador(
+    'trackeo_imagenes_total', "Imágenes analizadas por resultado", ('resultado',))
+ROSTROS = REGISTRO.contador(
+    'trackeo_rostros_detectados_total', "Rostros detectados", ('ruta',))
+EMOCIONES = REGISTRO.contador(
+    'trackeo_emociones_total', "Emociones emitidas", ('ruta', 'emocion'))
+DESCARTADOS = REGISTRO.contador(
+    'trackeo_rostros_descartados_total', "Rostros descartados por el filtro de calidad", ('ruta', 'motivo'))
+
+_trazas = threading.local()
+
+
+@contextmanager
+def span(etapa, ruta='imagen'):
+    """Mide un bloque y lo suma al histograma de etapas (y a la traza del hilo, si hay una activa)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        DURACION_ETAPAS.observar(duracion, ruta=ruta, etapa=etapa)
+        traza = getattr(_trazas, 'actual', None)
+        if traza is not None:
+            traza.append((etapa, duracion))
+
+
+def registrar_emociones(emociones, ruta='imagen'):
+    for emocion in emociones:
+        EMOCIONES.incrementar(ruta=ruta, emocion=emocion)
+
+
+def registrar_descarte(motivos, ruta='imagen'):
+    for motivo in motivos:
+        DESCARTADOS.incrementar(ruta=ruta, motivo=motivo)
+
+
+def iniciar_traza():
+    """Empieza a acumular los spans del hilo actual (una petición)"""
+    _trazas.actual = []
+
+
+def terminar_traza():
+    """Devuelve [(etapa, segundos)] acumulados desde iniciar_traza y la desactiva"""
+    traza = getattr(_trazas, 'actual', None) or []
+    _trazas.actual = None
+    return traza
+
+
+def server_timing(traza):
+    """Cabecera Server-Timing con la duración de cada etapa en milisegundos"""
+    return ", ".join(f"{etapa};dur={segundos * 1000:.2f}" for etapa, segundos in traza)
+
+
+class Perfilador:
+    """
+    cProfile bajo demanda para una petición
+
+    Solo un perfil puede estar activo a la vez en el proceso; si ya hay uno,
+    iniciar() devuelve False y la petición sigue sin perfilar.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self._perfil = None
+
+    def iniciar(self):
+        if not Perfilador._lock.acquire(blocking=False):
+            return False
+        self._perfil = cProfile.Profile()
+        try:
+            self._perfil.enable()
+        except ValueError:
+            self._perfil = None
+            Perfilador._lock.release()
+            return False
+        return True
+
+    def terminar(self, limite=30):
+        """Detiene el perfil y devuelve las funciones más costosas como texto"""
+        if self._perfil is None:
+            return ""
+        try:
+            self._perfil.disable()
+        finally:
+            Perfilador._lock.release()
+        salida = io.StringIO()
+        pstats.Stats(self._perfil, stream=salida).sort_stats('cumulative').print_stats(limite)
+        self._perfil = None
+        return salida.getvalue()
+
+
+def servir(puerto, direccion="0.0.0.0"):
+    """Expone /metrics en un hilo propio (para procesos sin Flask, como el detector en vivo)"""
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = REGISTRO.exponer().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', TIPO_CONTENIDO)
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((direccion, puerto), Manejador)
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    return servidor
@@ -0,0 +1,478 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from scripts.features import NOMBRES_CARACTERISTICAS, INDICE_CARACTERISTICA, matriz_caracteristicas
+from scripts.landmark_store import LandmarkStore, DIRECTORIO_LANDMARKS
+from scripts.results_store import ARCHIVO_HISTORIAL
+
+logger = logging.getLogger('trackeo.nerviosismo')
+
+# Cambiar si cambia el formato del archivo o las medidas de entrada
+VERSION_MODELO = 1
+
+RUTA_MODELO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'models', 'modelo_nerviosismo.npz')
+
+# Medidas relativas al ancho del rostro: no dependen de la distancia a la cámara
+CARACTERISTICAS_MODELO = tuple(n for n in NOMBRES_CARACTERISTICAS if n != 'ancho_rostro')
+_IDX_MODELO = np.array([INDICE_CARACTERISTICA[n] for n in CARACTERISTICAS_MODELO], dtype=np.intp)
+_IDX_ANCHO = INDICE_CARACTERISTICA['ancho_rostro']
+
+
+def caracteristicas_modelo(matriz):
+    """Matriz (B, F) de matriz_caracteristicas -> (B, F-1) medidas divididas por el ancho del rostro"""
+    matriz = np.atleast_2d(np.asarray(matriz, dtype=np.float64))
+    ancho = np.maximum(matriz[:, _IDX_ANCHO:_IDX_ANCHO + 1], 1e-6)
+    return matriz[:, _IDX_MODELO] / ancho
+
+
+def _sigmoide(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class ModeloNerviosismo:
+    """
+    Regresión logística sobre medidas faciales normalizadas
+
+    Se guarda como .npz (solo arrays, sin pickle): cargarlo es leer unos pocos
+    cientos de bytes, y predecir un lote es un producto matriz-vector.
+    """
+
+    def __init__(self, media, escala, pesos, sesgo, metadatos=None):
+        self.media = np.asarray(media, dtype=np.float64)
+        self.escala = np.asarray(escala, dtype=np.float64)
+        self.pesos = np.asarray(pesos, dtype=np.float64)
+        self.sesgo = float(sesgo)
+        self.metadatos = dict(metadatos or {})
+        # Pesos ya divididos por la escala: predecir no necesita estandarizar
+        self._pesos_crudos = self.pesos / self.escala
+        self._sesgo_crudo = self.sesgo - float(self.media @ self._pesos_crudos)
+
+    @property
+    def huella(self):
+        """Identificador corto del modelo, parte de la huella del detector"""
+        contenido = np.concatenate([self.media, self.escala, self.pesos, [self.sesgo]]).tobytes()
+        return f"m{VERSION_MODELO}.{hashlib.sha1(contenido).hexdigest()[:8]}"
+
+    def probabilidad(self, matriz):
+        """
+        Probabilidad de nerviosismo por rostro
+
+        Args:
+            matriz: Matriz (B, F) de matriz_caracteristicas, o una fila (F,)
+
+        Returns:
+            np.ndarray: (B,) probabilidades entre 0 y 1
+        """
+        return _sigmoide(caracteristicas_modelo(matriz) @ self._pesos_crudos + self._sesgo_crudo)
+
+    def guardar(self, ruta=RUTA_MODELO):
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'wb') as f:
+            np.savez(f, version=np.array(VERSION_MODELO),
+                     nombres=np.array(CARACTERISTICAS_MODELO),
+                     media=self.media, escala=self.escala, pesos=self.pesos, sesgo=np.array(self.sesgo),
+                     metadatos=np.array(json.dumps(self.metadatos, ensure_ascii=False)))
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta=RUTA_MODELO):
+        """Carga un modelo; lanza ValueError si es de otra versión o de otras medidas"""
+        with np.load(ruta, allow_pickle=False) as archivo:
+            version = int(archivo['version'])
+            if version != VERSION_MODELO:
+                raise ValueError(f"Modelo versión {version}, se esperaba {VERSION_MODELO}")
+            if tuple(archivo['nombres'].tolist()) != CARACTERISTICAS_MODELO:
+                raise ValueError("El modelo se entrenó con otras medidas faciales")
+            return cls(archivo['media'], archivo['escala'], archivo['pesos'], archivo['sesgo'],
+                       json.loads(str(archivo['metadatos'])))
+
+
+def entrenar(X, y, l2=1.0, iteraciones=50, tolerancia=1e-8):
+    """
+    Ajusta la regresión logística con Newton-Raphson (IRLS) y clases balanceadas
+
+    Args:
+        X: Matriz (B, F) de matriz_caracteristicas
+        y: (B,) etiquetas 0/1
+
+    Returns:
+        ModeloNerviosismo
+    """
+    Z = caracteristicas_modelo(X)
+    y = np.asarray(y, dtype=np.float64)
+    media = Z.mean(axis=0)
+    escala = Z.std(axis=0)
+    escala[escala < 1e-9] = 1.0
+    Z = np.hstack([(Z - media) / escala, np.ones((len(Z), 1))])
+
+    # Cada clase pesa lo mismo aunque una sea mucho más frecuente
+    positivos = max(y.sum(), 1.0)
+    negativos = max(len(y) - y.sum(), 1.0)
+    peso_muestra = np.where(y > 0.5, len(y) / (2 * positivos), len(y) / (2 * negativos))
+
+    regularizacion = np.full(Z.shape[1], l2)
+    regularizacion[-1] = 0.0  # El sesgo no se regulariza
+    w = np.zeros(Z.shape[1])
+    for _ in range(iteraciones):
+        p = _sigmoide(Z @ w)
+        gradiente = Z.T @ (peso_muestra * (p - y)) + regularizacion * w
+        hessiana = (Z * (peso_muestra * p * (1 - p))[:, None]).T @ Z + np.diag(regularizacion) + 1e-9 * np.eye(len(w))
+        paso = np.linalg.solve(hessiana, gradiente)
+        w -= paso
+        if np.max(np.abs(paso)) < tolerancia:
+            break
+    return ModeloNerviosismo(media, escala, w[:-1], w[-1])
+
+
+def evaluar(modelo, X, y, umbral=0.5):
+    """Exactitud, AUC y log-loss del modelo sobre (X, y)"""
+    y = np.asarray(y, dtype=np.float64)
+    p = modelo.probabilidad(X)
+    positivos = y > 0.5
+    # AUC por rangos (Mann-Whitney)
+    rangos = np.argsort(np.argsort(p)) + 1
+    n_pos, n_neg = positivos.sum(), (~positivos).sum()
+    auc = ((rangos[positivos].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)) if n_pos and n_neg else None
+    p = np.clip(p, 1e-9, 1 - 1e-9)
+    return {
+        'muestras': int(len(y)),
+        'positivos': int(n_pos),
+        'exactitud': round(float(np.mean((p >= umbral) == positivos)), 4),
+        'auc': round(float(auc), 4) if auc is not None else None,
+        'log_loss': round(float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))), 4)
+    }
+
+
+def medir_latencia(modelo, tamano_lote=32, repeticiones=500):
+    """p50/p95 en milisegundos de predecir un rostro y un lote"""
+    rng = np.random.default_rng(0)
+    lote = np.abs(rng.normal(50, 20, size=(tamano_lote, len(NOMBRES_CARACTERISTICAS))))
+    latencias = {}
+    for nombre, entrada in (('rostro', lote[:1]), ('lote', lote)):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            modelo.probabilidad(entrada)
+            tiempos.append(time.perf_counter() - inicio)
+        tiempos = np.array(tiempos) * 1000
+        latencias[nombre] = {'p50_ms': round(float(np.percentile(tiempos, 50)), 4),
+                             'p95_ms': round(float(np.percentile(tiempos, 95)), 4)}
+    latencias['tamano_lote'] = tamano_lote
+    return latencias
+
+
+def _clave_etiqueta(fila, sesion=None):
+    """
+    Clave de una fila etiquetada: ('hash', imagen_hash, rostro), ('imagen', hora, imagen, rostro)
+    o ('sesion', sesion, rostro); rostro es None si la etiqueta vale para todos los rostros
+    """
+    rostro = fila.get('rostro') or None
+    rostro = int(float(rostro)) if rostro else None
+    sesion = fila.get('sesion') or sesion
+    if fila.get('imagen_hash') or fila.get('hash'):
+        return ('hash', fila.get('imagen_hash') or fila.get('hash'), rostro)
+    if fila.get('imagen'):
+        return ('imagen', fila.get('hora'), fila['imagen'], rostro)
+    if sesion:
+        return ('sesion', str(sesion), rostro)
+    return None
+
+
+def _filas_csv(ruta):
+    """Filas de un CSV con los nombres de columna en minúsculas"""
+    with open(ruta, newline='', encoding='utf-8') as f:
+        for fila in csv.DictReader(f):
+            yield {(columna or '').strip().lower(): (valor or '').strip() for columna, valor in fila.items()}
+
+
+def cargar_etiquetas(ruta):
+    """
+    Etiquetas manuales desde un CSV con la columna nervioso (0/1) y una de estas claves:
+    imagen_hash; hora e imagen (como en el historial); o sesion (todos los frames de una
+    entrevista). La columna rostro es opcional.
+
+    Returns:
+        dict: clave de _clave_etiqueta -> 0/1
+    """
+    etiquetas = {}
+    for fila in _filas_csv(ruta):
+        clave = _clave_etiqueta(fila)
+        if clave is not None and fila.get('nervioso', '') != '':
+            etiquetas[clave] = int(float(fila['nervioso']))
+    return etiquetas
+
+
+def rutas_historial():
+    """Historiales guardados: el de imágenes y los de cada entrevista"""
+    directorio = os.path.dirname(ARCHIVO_HISTORIAL)
+    return [ARCHIVO_HISTORIAL] + sorted(glob.glob(os.path.join(directorio, 'emociones_entrevista_*.csv')))
+
+
+def cargar_historial(rutas):
+    """
+    Etiquetas anotadas en los historiales: una columna Nervioso (0/1) agregada a sus filas
+
+    Las filas de imágenes se unen con los landmarks por (hora, imagen, rostro), como en
+    scripts.rescore. Las de entrevistas son ventanas de 10 segundos y los frames no
+    guardan a qué ventana pertenecen, así que la etiqueta vale para todo el rostro de la
+    sesión (tomada del nombre del archivo) y se descarta si sus ventanas no coinciden.
+
+    Returns:
+        tuple: (dict clave -> 0/1, resumen con filas leídas, anotadas y descartadas por conflicto)
+    """
+    etiquetas, sesiones = {}, {}
+    resumen = {'filas_historial': 0, 'anotadas': 0, 'conflictos': 0}
+    for ruta in rutas:
+        if not os.path.exists(ruta):
+            continue
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        sesion = nombre[len('emociones_entrevista_'):] if nombre.startswith('emociones_entrevista_') else None
+        for fila in _filas_csv(ruta):
+            resumen['filas_historial'] += 1
+            if fila.get('nervioso', '') == '':
+                continue
+            clave = _clave_etiqueta(fila, sesion)
+            if clave is None:
+                continue
+            resumen['anotadas'] += 1
+            valor = int(float(fila['nervioso']))
+            if clave[0] == 'sesion':
+                sesiones.setdefault(clave, set()).add(valor)
+            else:
+                etiquetas[clave] = valor
+    for clave, valores in sesiones.items():
+        if len(valores) == 1:
+            etiquetas[clave] = valores.pop()
+        else:
+            resumen['conflictos'] += 1
+    return etiquetas, resumen
+
+
+def _buscar_etiqueta(etiquetas, meta):
+    """Etiqueta real de un rostro según sus metadatos, o None"""
+    rostro = meta.get('rostro')
+    if meta.get('origen') == 'entrevista':
+        claves = [('sesion', str(meta.get('sesion')), rostro), ('sesion', str(meta.get('sesion')), None)]
+    else:
+        claves = [('hash', meta.get('hash'), rostro), ('hash', meta.get('hash'), None)]
+        # Una etiqueta sin hora vale para todas las veces que se analizó esa imagen
+        for hora in (meta.get('hora'), None):
+            claves += [('imagen', hora, meta.get('imagen'), rostro), ('imagen', hora, meta.get('imagen'), None)]
+    for clave in claves:
+        if clave in etiquetas:
+            return etiquetas[clave]
+    return None
+
+
+def iterar_volcados(rutas, shape_defecto=(1, 1)):
+    """
+    Genera (metadatos por rostro, landmarks (F, N, 3), resultados o None, shapes (F, 2))
+
+    Acepta el archivo de landmarks (carpeta con formato.json; sus metadatos traen
+    hora, imagen, sesión y rostro), entradas del cache de resultados (.npz con
+    landmarks, resultados y shape) y archivos .npy con landmarks; las rutas
+    pueden ser carpetas.
+    """
+    for ruta in rutas:
+        if os.path.isdir(ruta) and os.path.exists(os.path.join(ruta, 'formato.json')):
+            for metadatos, landmarks in LandmarkStore(ruta).iterar_lotes():
+                shapes = np.array([(m.get('alto') or shape_defecto[0], m.get('ancho') or shape_defecto[1])
+                                   for m in metadatos], dtype=np.float32)
+                yield metadatos, np.asarray(landmarks), None, shapes
+            continue
+        archivos = [ruta] if os.path.isfile(ruta) else sorted(glob.glob(os.path.join(ruta, '*.np[yz]')))
+        for archivo in archivos:
+            imagen_hash = os.path.basename(archivo).split('-')[0].split('.')[0]
+            try:
+                if archivo.endswith('.npz'):
+                    with np.load(archivo, allow_pickle=False) as datos:
+                        if 'landmarks' not in datos:
+                            continue
+                        landmarks = datos['landmarks']
+                        resultados = json.loads(str(datos['resultados'])) if 'resultados' in datos else None
+                        shape = tuple(int(v) for v in datos['shape']) if 'shape' in datos else None
+                else:
+                    landmarks, resultados, shape = np.load(archivo, allow_pickle=False), None, None
+            except (OSError, ValueError) as e:
+                logger.warning("Se omite %s: %s", archivo, e)
+                continue
+            if landmarks.ndim == 2:
+                landmarks = landmarks[np.newaxis]
+            if landmarks.size and landmarks.shape[1] >= 468:
+                metadatos = [{'hash': imagen_hash, 'rostro': i, 'origen': 'imagen'}
+                             for i in range(1, len(landmarks) + 1)]
+                yield metadatos, landmarks, resultados, np.tile(np.asarray(shape or shape_defecto, dtype=np.float32),
+                                                                (len(landmarks), 1))
+
+
+def construir_dataset(rutas, etiquetas=None, usar_reglas=False, shape_defecto=(1, 1)):
+    """
+    Arma la matriz de entrenamiento a partir de los volcados de landmarks
+
+    La etiqueta de cada rostro sale de las etiquetas reales (archivo de etiquetas o
+    columna Nervioso de los historiales). Solo con usar_reglas, los rostros sin
+    etiqueta real toman la de las reglas guardada en el cache (indicadores_nervios >= 2):
+    un modelo así solo imita la regla. Los rostros sin etiqueta se omiten, y un
+    rostro que aparece en el cache y en el archivo de landmarks se cuenta una vez.
+
+    Returns:
+        tuple: (X (B, F), y (B,), grupos (B,) imagen o sesión de cada rostro, resumen)
+    """
+    etiquetas = etiquetas or {}
+    filas, objetivos, grupos = [], [], []
+    vistos = set()
+    resumen = {'volcados': 0, 'rostros': 0, 'repetidos': 0, 'etiquetas_manuales': 0, 'etiquetas_reglas': 0,
+               'sin_etiqueta': 0}
+    for metadatos, landmarks, resultados, shapes in iterar_volcados(rutas, shape_defecto):
+        resumen['volcados'] += 1
+        matriz = matriz_caracteristicas(landmarks, shapes)
+        for i, (meta, fila) in enumerate(zip(metadatos, matriz)):
+            if meta.get('origen') != 'entrevista' and meta.get('hash'):
+                clave = (meta['hash'], meta.get('rostro'))
+                if clave in vistos:
+                    resumen['repetidos'] += 1
+                    continue
+                vistos.add(clave)
+            resumen['rostros'] += 1
+            etiqueta = _buscar_etiqueta(etiquetas, meta)
+            if etiqueta is not None:
+                resumen['etiquetas_manuales'] += 1
+            elif usar_reglas and resultados and i < len(resultados) and \
+                    'indicadores_nervios' in resultados[i].get('valores', {}):
+                etiqueta = int(resultados[i]['valores']['indicadores_nervios'] >= 2)
+                resumen['etiquetas_reglas'] += 1
+            else:
+                resumen['sin_etiqueta'] += 1
+                continue
+            filas.append(fila)
+            objetivos.append(etiqueta)
+            grupos.append(f"sesion:{meta.get('sesion')}" if meta.get('origen') == 'entrevista'
+                          else meta.get('hash') or meta.get('imagen') or f"rostro:{len(grupos)}")
+    X = np.array(filas, dtype=np.float64).reshape(-1, len(NOMBRES_CARACTERISTICAS))
+    return X, np.array(objetivos, dtype=np.float64), np.array(grupos, dtype=object), resumen
+
+
+_modelo = None
+_modelo_cargado = False
+_modelo_lock = threading.Lock()
+
+
+def obtener_modelo():
+    """
+    Modelo del proceso, cargado una sola vez; None si no hay modelo entrenado
+
+    MODELO_NERVIOSISMO cambia la ruta del archivo.
+    """
+    global _modelo, _modelo_cargado
+    if not _modelo_cargado:
+        with _modelo_lock:
+            if not _modelo_cargado:
+                ruta = os.environ.get('MODELO_NERVIOSISMO', RUTA_MODELO)
+                if os.path.exists(ruta):
+                    try:
+                        _modelo = ModeloNerviosismo.cargar(ruta)
+                        if _modelo.metadatos.get('etiquetas') == 'reglas':
+                            logger.warning("El modelo de nerviosismo %s se entrenó con la salida de las reglas, "
+                                           "no con etiquetas reales", ruta)
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning("No se cargó el modelo de nerviosismo %s: %s", ruta, e)
+                _modelo_cargado = True
+    return _modelo
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Entrena el modelo de nerviosismo con los landmarks guardados y los historiales etiquetados")
+    parser.add_argument('volcados', nargs='*', default=[DIRECTORIO_LANDMARKS, 'data/cache'],
+                        help="Archivo de landmarks, carpetas del cache o archivos .npz/.npy")
+    parser.add_argument('--etiquetas', default=None,
+                        help="CSV con nervioso (0/1) e imagen_hash, hora e imagen, o sesion; rostro opcional")
+    parser.add_argument('--historial', nargs='*', default=None,
+                        help="Historiales CSV con una columna Nervioso anotada "
+                             "(por defecto, el de imágenes y los de cada entrevista en data/)")
+    parser.add_argument('--etiquetas-reglas', action='store_true',
+                        help="Sin etiquetas reales, usar la salida de las reglas (el modelo solo imitará la regla)")
+    parser.add_argument('--salida', default=RUTA_MODELO, help="Archivo .npz del modelo")
+    parser.add_argument('--l2', type=float, default=1.0, help="Regularización L2")
+    parser.add_argument('--validacion', type=float, default=0.2, help="Fracción reservada para validar")
+    parser.add_argument('--presupuesto-ms', type=float, default=0.5,
+                        help="p95 máximo para predecir un lote de 32 rostros; si se excede no se guarda")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    etiquetas, resumen_historial = cargar_historial(rutas_historial() if args.historial is None else args.historial)
+    print(f"🗂️  {resumen_historial['filas_historial']} filas de historial, {resumen_historial['anotadas']} con Nervioso"
+          + (f" ({resumen_historial['conflictos']} rostros de entrevista con ventanas contradictorias)"
+             if resumen_historial['conflictos'] else ""))
+    if args.etiquetas:
+        etiquetas.update(cargar_etiquetas(args.etiquetas))
+
+    if not etiquetas:
+        if not args.etiquetas_reglas:
+            print("❌ No hay etiquetas reales: se necesita una columna Nervioso en los historiales o --etiquetas. "
+                  "Entrenar con la salida de las reglas solo copia la regla; para hacerlo igual, --etiquetas-reglas")
+            sys.exit(1)
+        logger.warning("Entrenando sin etiquetas reales: el modelo imita la regla de indicadores_nervios")
+        print("⚠️  ATENCIÓN: sin etiquetas reales se entrena con la salida de las reglas (indicadores_nervios >= 2).\n"
+              "⚠️  El modelo solo aprende a imitar la regla: no mide nerviosismo real y no debería usarse en producción.")
+
+    X, y, grupos, resumen = construir_dataset(args.volcados, etiquetas, usar_reglas=args.etiquetas_reglas)
+    print(f"📦 {resumen['volcados']} volcados, {resumen['rostros']} rostros "
+          f"({resumen['etiquetas_manuales']} etiquetas reales, {resumen['etiquetas_reglas']} de reglas, "
+          f"{resumen['sin_etiqueta']} sin etiqueta, {resumen['repetidos']} repetidos)")
+    if len(y) < 10 or y.min() == y.max():
+        print("❌ Se necesitan al menos 10 rostros etiquetados y de ambas clases")
+        sys.exit(1)
+
+    # La validación se separa por imagen o sesión: los frames de una entrevista se parecen
+    # demasiado entre sí como para repartirlos entre entrenamiento y validación
+    rng = np.random.default_rng(args.semilla)
+    unicos = rng.permutation(np.unique(grupos))
+    reservados = set(unicos[max(1, int(len(unicos) * (1 - args.validacion))):])
+    en_validacion = np.array([grupo in reservados for grupo in grupos], dtype=bool)
+    entrenamiento, validacion = np.flatnonzero(~en_validacion), np.flatnonzero(en_validacion)
+    modelo_parcial = entrenar(X[entrenamiento], y[entrenamiento], args.l2)
+    metricas = {'entrenamiento': evaluar(modelo_parcial, X[entrenamiento], y[entrenamiento])}
+    if len(validacion):
+        metricas['validacion'] = evaluar(modelo_parcial, X[validacion], y[validacion])
+
+    # El modelo final usa todos los datos
+    modelo = entrenar(X, y, args.l2)
+    latencia = medir_latencia(modelo)
+    modelo.metadatos = {
+        'entrenado': datetime.now().isoformat(timespec='seconds'),
+        'version': VERSION_MODELO,
+        'datos': resumen,
+        'etiquetas': 'reglas' if resumen['etiquetas_reglas'] else 'reales',
+        'metricas': metricas,
+        'latencia': latencia,
+        'l2': args.l2
+    }
+
+    for nombre, valores in metricas.items():
+        print(f"📈 {nombre}: exactitud {valores['exactitud']}, AUC {valores['auc']}, log-loss {valores['log_loss']}")
+    print(f"⏱️  Predicción: {latencia['rostro']['p95_ms']} ms por rostro, "
+          f"{latencia['lote']['p95_ms']} ms por lote de {latencia['tamano_lote']} (p95)")
+
+    if latencia['lote']['p95_ms'] > args.presupuesto_ms:
+        print(f"❌ Se excede el presupuesto de {args.presupuesto_ms} ms por lote; el modelo no se guarda")
+        sys.exit(1)
+
+    modelo.guardar(args.salida)
+    print(f"✅ Modelo {modelo.huella} guardado en {args.salida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class ColaDescarte:
+    """
+    Cola acotada entre etapas del pipeline
+
+    Con descartar=True, al llenarse se tira el elemento más antiguo (cámara en
+    vivo: siempre se procesa el frame más reciente). Con descartar=False el
+    productor espera (archivos de video: no se pierde ningún frame).
+    """
+
+    def __init__(self, capacidad=2, descartar=True):
+        self._items = deque()
+        self.capacidad = capacidad
+        self.descartar = descartar
+        self._cond = threading.Condition()
+        self._cerrada = False
+        self.descartados = 0
+
+    def poner(self, item):
+        with self._cond:
+            if len(self._items) >= self.capacidad:
+                if self.descartar:
+                    self._items.popleft()
+                    self.descartados += 1
+                else:
+                    self._cond.wait_for(lambda: len(self._items) < self.capacidad or self._cerrada)
+            if self._cerrada:
+                return
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def tomar(self, timeout=None):
+        """Devuelve el siguiente elemento, o None si se agotó el tiempo o la cola terminó"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._cerrada, timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def cerrar(self):
+        with self._cond:
+            self._cerrada = True
+            self._cond.notify_all()
+
+    @property
+    def terminada(self):
+        with self._cond:
+            return self._cerrada and not self._items
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class EstadisticasEtapa:
+    """Latencia por frame y FPS efectivos de una etapa"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.frames = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.ultima = 0.0
+        self._primero = None
+        self._ultimo = None
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos):
+        ahora = time.perf_counter()
+        with self._lock:
+            if self._primero is None:
+                self._primero = ahora
+            self._ultimo = ahora
+            self.frames += 1
+            self.total += segundos
+            self.ultima = segundos
+            self.maximo = max(self.maximo, segundos)
+
+    def fps(self):
+        with self._lock:
+            if self.frames < 2 or self._ultimo == self._primero:
+                return 0.0
+            return (self.frames - 1) / (self._ultimo - self._primero)
+
+    def resumen(self):
+        fps = self.fps()
+        with self._lock:
+            media = self.total / self.frames if self.frames else 0.0
+            return {
+                'frames': self.frames,
+                'latencia_media_ms': round(media * 1000, 2),
+                'latencia_max_ms': round(self.maximo * 1000, 2),
+                'fps': round(fps, 2)
+            }
+
+
+class PipelineVideo:
+    """
+    Pipeline captura -> inferencia -> salida
+
+    La captura y la inferencia corren en hilos propios; la salida (imshow,
+    escritura de resultados) se consume desde el hilo que itera resultados(),
+    porque OpenCV solo permite dibujar ventanas desde el hilo principal.
+
+    Args:
+        captura: Objeto con read() -> (ret, frame), p. ej. cv2.VideoCapture
+        procesar: Función (frame, timestamp) -> salida de la etapa de inferencia
+        marca_tiempo: Función (captura) -> segundos del frame recién leído
+        descartar: True para fuentes en vivo (se descartan frames viejos)
+        salto: Procesar solo 1 de cada `salto` frames; los demás se saltan con grab() sin decodificar
+    """
+
+    def __init__(self, captura, procesar, marca_tiempo=None, descartar=True, capacidad_cola=2, salto=1):
+        self.captura = captura
+        self.salto = max(1, salto)
+        self.procesar = procesar
+        self.marca_tiempo = marca_tiempo or (lambda _: time.time())
+        self.cola_frames = ColaDescarte(capacidad_cola, descartar)
+        self.cola_salida = ColaDescarte(capacidad_cola, descartar)
+        self.etapas = {nombre: EstadisticasEtapa(nombre) for nombre in ('captura', 'inferencia', 'salida')}
+        self._detener = threading.Event()
+        self._error = None
+        self._hilos = [
+            threading.Thread(target=self._capturar, name="captura", daemon=True),
+            threading.Thread(target=self._inferir, name="inferencia", daemon=True)
+        ]
+
+    def iniciar(self):
+        for hilo in self._hilos:
+            hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+        self.cola_frames.cerrar()
+        self.cola_salida.cerrar()
+        for hilo in self._hilos:
+            if hilo.is_alive() and hilo is not threading.current_thread():
+                hilo.join(timeout=2)
+
+    def _capturar(self):
+        indice = 0
+        try:
+            while not self._detener.is_set():
+                inicio = time.perf_counter()
+                for _ in range(self.salto - 1):
+                    if not self.captura.grab():
+                        break
+                ret, frame = self.captura.read()
+                if not ret:
+                    break
+                timestamp = self.marca_tiempo(self.captura)
+                self.etapas['captura'].registrar(time.perf_counter() - inicio)
+                self.cola_frames.poner((indice, timestamp, frame))
+                indice += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            self.cola_frames.cerrar()
+
+    def _inferir(self):
+        try:
+            while not self._detener.is_set():
+                item = self.cola_frames.tomar(timeout=0.1)
+                if item is None:
+                    if self.cola_frames.terminada:
+                        break
+                    continue
+                _, timestamp, frame = item
+                inicio = time.perf_counter()
+                salida = self.procesar(frame, timestamp)
+                self.etapas['inferencia'].registrar(time.perf_counter() - inicio)
+                self.cola_salida.poner(salida)
+        except Exception as e:
+            self._error = e
+        finally:
+            self.cola_salida.cerrar()
+
+    def resultados(self):
+        """Genera las salidas de la inferencia en orden hasta que se agote la fuente"""
+        while not self._detener.is_set():
+            salida = self.cola_salida.tomar(timeout=0.1)
+            if salida is None:
+                if self.cola_salida.terminada:
+                    break
+                continue
+            yield salida
+        if self._error is not None:
+            raise self._error
+
+    @contextmanager
+    def etapa_salida(self):
+        """Mide el tiempo de la etapa de salida (dibujo, imshow, escritura)"""
+        inicio = time.perf_counter()
+        yield
+        self.etapas['salida'].registrar(time.perf_counter() - inicio)
+
+    def metricas(self):
+        metricas = {nombre: etapa.resumen() for nombre, etapa in self.etapas.items()}
+        metricas['descartados'] = self.cola_frames.descartados + self.cola_salida.descartados
+        metricas['fps_efectivos'] = metricas['salida']['fps']
+        return metricas
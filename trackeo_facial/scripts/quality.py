@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from scripts.features import OJO_IZQ_EXTERIOR, OJO_DER_EXTERIOR
+
+# Bordes laterales, frente y mentón de MediaPipe Face Mesh para estimar la pose
+BORDE_IZQ, BORDE_DER = 234, 454
+FRENTE, MENTON = 10, 152
+
+# La nitidez se mide sobre el rostro reescalado a este ancho, así no depende de la resolución
+ANCHO_NITIDEZ = 96
+
+EMOCION_DESCARTE = "Calidad insuficiente"
+
+
+def _escala(shape):
+    """(ancho, alto) de una imagen (2,) o de una por rostro (B, 1, 2)"""
+    shape = np.asarray(shape, dtype=np.float32)
+    return shape[::-1] if shape.ndim == 1 else shape[:, np.newaxis, ::-1]
+
+
+def pose_cabeza(puntos, shape):
+    """
+    Ángulos de la cabeza en grados a partir de los landmarks, sin resolver PnP
+
+    MediaPipe da z en la misma escala que x (relativa al ancho de la imagen),
+    así que los vectores entre bordes del rostro (giro), frente y mentón
+    (inclinación) y las esquinas externas de los ojos (ladeo) se llevan a
+    píxeles y se miden sus ángulos.
+
+    Args:
+        puntos: Array (F, N, 3) de landmarks normalizados
+        shape: Tupla (altura, ancho) de la imagen, o array (F, 2) con una por rostro
+
+    Returns:
+        np.ndarray: (F, 3) con giro (yaw), inclinación (pitch) y ladeo (roll)
+    """
+    puntos = np.asarray(puntos, dtype=np.float32)
+    escala = _escala(shape)
+    pix = np.concatenate([puntos[..., :2] * escala, puntos[..., 2:3] * escala[..., :1]], axis=-1)
+    lateral = pix[:, BORDE_DER] - pix[:, BORDE_IZQ]
+    vertical = pix[:, MENTON] - pix[:, FRENTE]
+    ojos = pix[:, OJO_DER_EXTERIOR] - pix[:, OJO_IZQ_EXTERIOR]
+    giro = np.arctan2(lateral[:, 2], np.abs(lateral[:, 0]))
+    inclinacion = np.arctan2(vertical[:, 2], np.abs(vertical[:, 1]))
+    ladeo = np.arctan2(ojos[:, 1], np.abs(ojos[:, 0]))
+    return np.degrees(np.stack([giro, inclinacion, ladeo], axis=1))
+
+
+def nitidez(imagen, puntos):
+    """
+    Varianza del laplaciano sobre el recorte de cada rostro (mayor = más nítido)
+
+    El recorte es el rectángulo de los landmarks, reescalado a ANCHO_NITIDEZ
+    píxeles de ancho y pasado a grises (solo el recorte, no la imagen entera).
+
+    Args:
+        imagen: Imagen BGR (o en grises) donde se detectaron los rostros
+        puntos: Array (F, N, 3) de landmarks normalizados a esa imagen
+
+    Returns:
+        np.ndarray: (F,) float32; NaN si el recorte queda vacío
+    """
+    import cv2
+
+    alto, ancho = imagen.shape[:2]
+    xy = np.asarray(puntos, dtype=np.float32)[..., :2] * (ancho, alto)
+    minimos, maximos = xy.min(axis=1), xy.max(axis=1)
+    valores = np.full(len(xy), np.nan, dtype=np.float32)
+    for i, ((x0, y0), (x1, y1)) in enumerate(zip(minimos.tolist(), maximos.tolist())):
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1) + 1, ancho), min(int(y1) + 1, alto)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            continue
+        alto_normalizado = max(int(round(ANCHO_NITIDEZ * (y1 - y0) / (x1 - x0))), 2)
+        recorte = cv2.resize(imagen[y0:y1, x0:x1], (ANCHO_NITIDEZ, alto_normalizado), interpolation=cv2.INTER_AREA)
+        if recorte.ndim == 3:
+            recorte = cv2.cvtColor(recorte, cv2.COLOR_BGR2GRAY)
+        valores[i] = cv2.Laplacian(recorte, cv2.CV_32F).var()
+    return valores
+
+
+class FiltroCalidad:
+    """
+    Etapa previa a las reglas: descarta rostros girados, pequeños o desenfocados
+
+    Las reglas comparan medidas en píxeles con umbrales fijos; con la cabeza
+    girada o un rostro de pocos píxeles esas medidas no significan nada y
+    producen etiquetas basura. La pose y el tamaño salen de los landmarks y
+    de las medidas ya calculadas; la nitidez necesita la imagen y se omite
+    si no se pasa (p. ej. al reevaluar el archivo de landmarks).
+
+    Args:
+        max_giro, max_inclinacion, max_ladeo: Ángulos máximos en grados
+        min_ancho: Distancia mínima entre las esquinas externas de los ojos, en píxeles
+        min_nitidez: Varianza mínima del laplaciano del rostro a ANCHO_NITIDEZ píxeles
+    """
+
+    def __init__(self, max_giro=35.0, max_inclinacion=30.0, max_ladeo=25.0, min_ancho=40.0, min_nitidez=15.0):
+        self.max_giro = max_giro
+        self.max_inclinacion = max_inclinacion
+        self.max_ladeo = max_ladeo
+        self.min_ancho = min_ancho
+        self.min_nitidez = min_nitidez
+        configuracion = json.dumps(vars(self), sort_keys=True)
+        self.huella = f"q{hashlib.sha1(configuracion.encode('utf-8')).hexdigest()[:6]}"
+
+    def evaluar(self, puntos, shape, anchos, imagen=None):
+        """
+        Evalúa la calidad de cada rostro
+
+        Args:
+            puntos: Array (F, N, 3) de landmarks normalizados
+            shape: Tupla (altura, ancho) con la que se calcularon las medidas, o array (F, 2)
+            anchos: Secuencia (F,) con 'ancho_rostro' de cada rostro
+            imagen: Imagen donde se detectaron los rostros (opcional, para la nitidez)
+
+        Returns:
+            list: Por rostro, dict con 'apto', 'motivos' (pose, tamano, desenfoque) y las medidas
+        """
+        puntos = np.asarray(puntos, dtype=np.float32)
+        if len(puntos) == 0:
+            return []
+        angulos = pose_cabeza(puntos, shape)
+        anchos = np.asarray(anchos, dtype=np.float32)
+        valores_nitidez = nitidez(imagen, puntos) if imagen is not None else None
+
+        calidades = []
+        for i, (giro, inclinacion, ladeo) in enumerate(angulos.tolist()):
+            motivos = []
+            if abs(giro) > self.max_giro or abs(inclinacion) > self.max_inclinacion or abs(ladeo) > self.max_ladeo:
+                motivos.append('pose')
+            if anchos[i] < self.min_ancho:
+                motivos.append('tamano')
+            calidad = {'giro': round(giro, 1), 'inclinacion': round(inclinacion, 1), 'ladeo': round(ladeo, 1),
+                       'ancho': round(float(anchos[i]), 1)}
+            if valores_nitidez is not None:
+                valor = float(valores_nitidez[i])
+                calidad['nitidez'] = round(valor, 1) if np.isfinite(valor) else None
+                if not np.isfinite(valor) or valor < self.min_nitidez:
+                    motivos.append('desenfoque')
+            calidad['apto'] = not motivos
+            calidad['motivos'] = motivos
+            calidades.append(calidad)
+        return calidades
+
+
+_filtro = None
+_filtro_lock = threading.Lock()
+
+
+def obtener_filtro():
+    """
+    Filtro de calidad del proceso, o None si FILTRO_CALIDAD=0 lo desactiva
+
+    Los umbrales se pueden ajustar con CALIDAD_MAX_GIRO, CALIDAD_MAX_INCLINACION,
+    CALIDAD_MAX_LADEO, CALIDAD_MIN_ANCHO y CALIDAD_MIN_NITIDEZ.
+    """
+    global _filtro
+    if os.environ.get('FILTRO_CALIDAD', '1') == '0':
+        return None
+    if _filtro is None:
+        with _filtro_lock:
+            if _filtro is None:
+                configuracion = {}
+                for parametro, variable in (('max_giro', 'CALIDAD_MAX_GIRO'),
+                                            ('max_inclinacion', 'CALIDAD_MAX_INCLINACION'),
+                                            ('max_ladeo', 'CALIDAD_MAX_LADEO'),
+                                            ('min_ancho', 'CALIDAD_MIN_ANCHO'),
+                                            ('min_nitidez', 'CALIDAD_MIN_NITIDEZ')):
+                    if os.environ.get(variable):
+                        configuracion[parametro] = float(os.environ[variable])
+                _filtro = FiltroCalidad(**configuracion)
+    return _filtro
@@ -0,0 +1,265 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from scripts.features import matriz_caracteristicas, INDICE_CARACTERISTICA
+from scripts.helpers import huella_detector
+from scripts.landmark_store import LandmarkStore, DIRECTORIO_LANDMARKS
+from scripts.nervousness import obtener_modelo
+from scripts.quality import obtener_filtro, EMOCION_DESCARTE
+from scripts.results_store import crear_store, ARCHIVO_HISTORIAL
+from scripts.rules import obtener_motor
+
+DIRECTORIO_REEVALUACIONES = "data/reevaluaciones"
+
+# resultados.csv se puede abrir como store (csv:<ruta>) y servir de base de la siguiente reevaluación
+COLUMNAS_RESULTADOS = ['Hora', 'Imagen', 'Emociones', 'Apertura_Boca', 'Anchura_Boca', 'Elevacion_Cejas',
+                       'Origen', 'Rostro', 'Hash']
+COLUMNAS_CAMBIOS = ['Hora', 'Imagen', 'Rostro', 'Anteriores', 'Nuevas']
+
+_COLUMNAS_VALORES = [INDICE_CARACTERISTICA[n] for n in ('apertura_boca', 'anchura_boca', 'elevacion_cejas')]
+
+
+def indexar_base(store, ruta_indice):
+    """
+    Copia las etiquetas de imágenes del historial a un índice SQLite en disco
+
+    Las filas se leen en streaming, así que la memoria no depende del tamaño
+    del historial; los workers consultan el índice por (hora, imagen, rostro).
+
+    Returns:
+        int: Filas indexadas
+    """
+    conexion = sqlite3.connect(ruta_indice)
+    conexion.execute("CREATE TABLE base (hora TEXT, imagen TEXT, rostro INTEGER, emociones TEXT, "
+                     "PRIMARY KEY (hora, imagen, rostro)) WITHOUT ROWID")
+    total = 0
+    lote = []
+    anterior, orden = None, 0
+    for fila in store.iterar():
+        if fila.get('Origen') not in (None, '', 'imagen'):
+            continue
+        clave = (fila.get('Hora'), fila.get('Imagen'))
+        orden = orden + 1 if clave == anterior else 1
+        anterior = clave
+        rostro = fila.get('Rostro')
+        # Sin Rostro (historiales anteriores a esa columna), los rostros de una imagen son filas consecutivas
+        lote.append((*clave, int(rostro) if rostro not in (None, '') else orden, fila.get('Emociones')))
+        if len(lote) >= 10000:
+            conexion.executemany("INSERT OR IGNORE INTO base VALUES (?, ?, ?, ?)", lote)
+            total += len(lote)
+            lote = []
+    conexion.executemany("INSERT OR IGNORE INTO base VALUES (?, ?, ?, ?)", lote)
+    total += len(lote)
+    conexion.commit()
+    conexion.close()
+    return total
+
+
+def _resumen_vacio():
+    return {'registros': 0, 'omitidos': 0, 'sin_base': 0, 'iguales': 0, 'cambiados': 0,
+            'agregadas': Counter(), 'quitadas': Counter(), 'transiciones': Counter()}
+
+
+def reevaluar_shard(directorio, shard, ruta_indice, ruta_resultados, ruta_cambios, tamano_lote=4096):
+    """
+    Recalcula las emociones de un shard del archivo de landmarks con las reglas y el modelo actuales
+
+    Escribe los resultados y los cambios respecto de la base en CSV sin
+    encabezado (el proceso principal los concatena). Solo se reevalúan
+    registros de imágenes: los del detector en vivo dependen de la
+    calibración de su sesión. El filtro de calidad se aplica con pose y
+    tamaño; la nitidez no, porque el archivo no guarda las imágenes.
+
+    Returns:
+        dict: Conteos y diferencias de etiquetas del shard
+    """
+    store = LandmarkStore(directorio)
+    conjunto = obtener_motor().conjunto('imagen')
+    modelo = obtener_modelo()
+    filtro = obtener_filtro()
+    indice = sqlite3.connect(f"file:{ruta_indice}?mode=ro", uri=True) if ruta_indice else None
+    resumen = _resumen_vacio()
+
+    with open(ruta_resultados, 'w', newline='', encoding='utf-8') as f_resultados, \
+            open(ruta_cambios, 'w', newline='', encoding='utf-8') as f_cambios:
+        resultados = csv.writer(f_resultados)
+        cambios = csv.writer(f_cambios)
+        for metadatos, landmarks in store.iterar_lotes(tamano_lote, shards=[shard]):
+            seleccion = [i for i, m in enumerate(metadatos) if m.get('origen') == 'imagen' and m.get('alto')]
+            resumen['omitidos'] += len(metadatos) - len(seleccion)
+            if not seleccion:
+                continue
+            shapes = np.array([(metadatos[i]['alto'], metadatos[i]['ancho']) for i in seleccion])
+            matriz = matriz_caracteristicas(landmarks[seleccion], shapes)
+            aptos = np.ones(len(seleccion), dtype=bool)
+            if filtro is not None:
+                calidades = filtro.evaluar(landmarks[seleccion], shapes, matriz[:, INDICE_CARACTERISTICA['ancho_rostro']])
+                aptos = np.array([calidad['apto'] for calidad in calidades], dtype=bool)
+            # Reglas y modelo solo sobre los rostros que pasan el filtro
+            matriz_aptos = matriz[aptos]
+            if not len(matriz_aptos):
+                evaluaciones = []
+            elif modelo is not None:
+                evaluaciones = conjunto.evaluar_lote(matriz_aptos, prob_nerviosismo=modelo.probabilidad(matriz_aptos))
+            else:
+                evaluaciones = conjunto.evaluar_lote(matriz_aptos)
+            evaluaciones = iter(evaluaciones)
+
+            for i, valores, apto in zip(seleccion, matriz[:, _COLUMNAS_VALORES].tolist(), aptos.tolist()):
+                m = metadatos[i]
+                if apto:
+                    emociones = next(evaluaciones).emociones
+                    nuevas = ", ".join(emociones) if emociones else "Neutral"
+                else:
+                    nuevas = EMOCION_DESCARTE
+                resultados.writerow([m.get('hora'), m.get('imagen'), nuevas, *valores,
+                                     'imagen', m.get('rostro'), m.get('hash')])
+                resumen['registros'] += 1
+                if indice is None:
+                    continue
+                anterior = indice.execute("SELECT emociones FROM base WHERE hora = ? AND imagen = ? AND rostro = ?",
+                                          (m.get('hora'), m.get('imagen'), m.get('rostro'))).fetchone()
+                if anterior is None:
+                    resumen['sin_base'] += 1
+                elif anterior[0] == nuevas:
+                    resumen['iguales'] += 1
+                else:
+                    resumen['cambiados'] += 1
+                    cambios.writerow([m.get('hora'), m.get('imagen'), m.get('rostro'), anterior[0], nuevas])
+                    etiquetas_antes = set((anterior[0] or "").split(", "))
+                    etiquetas_ahora = set(nuevas.split(", "))
+                    resumen['agregadas'].update(etiquetas_ahora - etiquetas_antes)
+                    resumen['quitadas'].update(etiquetas_antes - etiquetas_ahora)
+                    resumen['transiciones'][(anterior[0], nuevas)] += 1
+    if indice is not None:
+        indice.close()
+    store.cerrar()
+    return resumen
+
+
+def _reevaluar_item(item):
+    return reevaluar_shard(*item)
+
+
+def _concatenar(partes, destino, columnas):
+    with open(destino, 'w', newline='', encoding='utf-8') as salida:
+        csv.writer(salida).writerow(columnas)
+        for parte in partes:
+            with open(parte, newline='', encoding='utf-8') as entrada:
+                shutil.copyfileobj(entrada, salida)
+
+
+def reevaluar(directorio=DIRECTORIO_LANDMARKS, base=None, salida=DIRECTORIO_REEVALUACIONES, procesos=None,
+              tamano_lote=4096):
+    """
+    Reevalúa todo el archivo de landmarks y escribe un conjunto de resultados versionado
+
+    Args:
+        directorio: Carpeta del archivo de landmarks
+        base: Store con las etiquetas anteriores ('csv:<ruta>' o 'sqlite:<ruta>'); None para no comparar
+        salida: Carpeta donde se crea <fecha>-<huella del detector>/
+        procesos: Procesos en paralelo (1 evalúa en este proceso)
+        tamano_lote: Registros por pasada vectorizada
+
+    Returns:
+        tuple: (carpeta de la versión, reporte)
+    """
+    inicio = time.perf_counter()
+    huella = huella_detector()
+    version = f"{datetime.now():%Y%m%d_%H%M%S}-{huella}"
+    carpeta = os.path.join(salida, version)
+    carpeta_partes = os.path.join(carpeta, 'partes')
+    os.makedirs(carpeta_partes, exist_ok=True)
+
+    ruta_indice = None
+    filas_base = 0
+    if base:
+        ruta_indice = os.path.join(carpeta_partes, 'base.db')
+        store_base = crear_store(base)
+        filas_base = indexar_base(store_base, ruta_indice)
+        store_base.cerrar()
+
+    shards = LandmarkStore(directorio).shards()
+    items = [(directorio, shard, ruta_indice,
+              os.path.join(carpeta_partes, f"{shard}.resultados.csv"),
+              os.path.join(carpeta_partes, f"{shard}.cambios.csv"), tamano_lote) for shard in shards]
+    if procesos == 1 or len(items) <= 1:
+        resumenes = [_reevaluar_item(item) for item in items]
+    else:
+        # spawn, como en el análisis por lotes: cada proceso carga sus propias reglas y modelo
+        with ProcessPoolExecutor(max_workers=procesos or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            resumenes = list(executor.map(_reevaluar_item, items))
+
+    _concatenar([item[3] for item in items], os.path.join(carpeta, 'resultados.csv'), COLUMNAS_RESULTADOS)
+    _concatenar([item[4] for item in items], os.path.join(carpeta, 'cambios.csv'), COLUMNAS_CAMBIOS)
+    shutil.rmtree(carpeta_partes)
+
+    total = _resumen_vacio()
+    for resumen in resumenes:
+        for clave, valor in resumen.items():
+            total[clave] += valor
+    segundos = time.perf_counter() - inicio
+    reporte = {
+        'version': version,
+        'huella_detector': huella,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'landmarks': directorio,
+        'base': base,
+        'filas_base': filas_base,
+        'shards': len(shards),
+        'registros': total['registros'],
+        'omitidos': total['omitidos'],
+        'sin_base': total['sin_base'],
+        'iguales': total['iguales'],
+        'cambiados': total['cambiados'],
+        'emociones_agregadas': dict(total['agregadas'].most_common()),
+        'emociones_quitadas': dict(total['quitadas'].most_common()),
+        'transiciones': [{'anteriores': anteriores, 'nuevas': nuevas, 'cantidad': cantidad}
+                         for (anteriores, nuevas), cantidad in total['transiciones'].most_common(50)],
+        'segundos': round(segundos, 3),
+        'registros_por_segundo': round(total['registros'] / segundos, 1) if segundos > 0 else 0.0
+    }
+    with open(os.path.join(carpeta, 'reporte.json'), 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    return carpeta, reporte
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recalcula las emociones del archivo de landmarks con las reglas y el modelo actuales")
+    parser.add_argument('--landmarks', default=DIRECTORIO_LANDMARKS, help="Carpeta del archivo de landmarks")
+    parser.add_argument('--base', default=os.environ.get('RESULTS_STORE', f"csv:{ARCHIVO_HISTORIAL}"),
+                        help="Historial con las etiquetas anteriores (csv:<ruta> o sqlite:<ruta>; '' para no comparar)")
+    parser.add_argument('--salida', default=DIRECTORIO_REEVALUACIONES, help="Carpeta de las versiones de resultados")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo")
+    parser.add_argument('--lote', type=int, default=4096, help="Registros por pasada vectorizada")
+    args = parser.parse_args()
+
+    carpeta, reporte = reevaluar(args.landmarks, args.base or None, args.salida, args.procesos, args.lote)
+    print(f"✅ {reporte['registros']} rostros reevaluados en {reporte['segundos']} s "
+          f"({reporte['registros_por_segundo']} rostros/s) -> {carpeta}")
+    if reporte['omitidos']:
+        print(f"⏭️  {reporte['omitidos']} registros del detector en vivo omitidos")
+    if args.base:
+        print(f"🔁 {reporte['cambiados']} cambiaron, {reporte['iguales']} iguales, "
+              f"{reporte['sin_base']} sin fila en el historial")
+        for emocion, cantidad in reporte['emociones_agregadas'].items():
+            print(f"   + {emocion}: {cantidad}")
+        for emocion, cantidad in reporte['emociones_quitadas'].items():
+            print(f"   - {emocion}: {cantidad}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from scripts.helpers import huella_detector
+
+
+def hash_imagen(datos):
+    """Hash del contenido de la imagen codificada"""
+    return hashlib.sha256(datos).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache de resultados por contenido: LRU en memoria + directorio en disco
+
+    La clave combina el hash de la imagen con la huella del detector (versión y
+    umbrales) y el lado máximo al que se reduce antes de FaceMesh
+    (UPLOAD_MAX_SIDE), así que cambiar las reglas o la reducción invalida las
+    entradas anteriores.
+    Cada entrada guarda los resultados por rostro, los landmarks (F, N, 3) y el
+    tamaño de la imagen, así sirve también como volcado para entrenar modelos.
+    """
+
+    def __init__(self, directorio="data/cache", max_memoria=256, max_bytes_disco=256 * 1024 * 1024):
+        self.directorio = directorio
+        self.max_memoria = max_memoria
+        self.max_bytes_disco = max_bytes_disco
+        os.makedirs(directorio, exist_ok=True)
+
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._contadores = {'aciertos_memoria': 0, 'aciertos_disco': 0, 'fallos': 0, 'desalojos_disco': 0}
+        self._bytes_disco = sum(os.path.getsize(ruta) for ruta in self._archivos_disco())
+
+    def clave(self, datos, digest=None):
+        """Clave de la imagen; digest evita recalcular un hash_imagen ya conocido"""
+        # Import local: scripts.uploads importa este módulo
+        from scripts.uploads import max_lado_configurado
+        return f"{digest or hash_imagen(datos)}-{huella_detector()}-m{max_lado_configurado() or 0}"
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.npz")
+
+    def _archivos_disco(self):
+        return [os.path.join(self.directorio, nombre)
+                for nombre in os.listdir(self.directorio) if nombre.endswith('.npz')]
+
+    def obtener(self, clave):
+        """Devuelve {'resultados': [...], 'landmarks': array, 'shape': (alto, ancho) o None} o None si no está en cache"""
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                self._memoria.move_to_end(clave)
+                self._contadores['aciertos_memoria'] += 1
+                return entrada
+
+        ruta = self._ruta(clave)
+        try:
+            with np.load(ruta) as archivo:
+                entrada = {
+                    'resultados': json.loads(str(archivo['resultados'])),
+                    'landmarks': archivo['landmarks'],
+                    'shape': tuple(int(v) for v in archivo['shape']) if 'shape' in archivo else None
+                }
+            os.utime(ruta)  # Marca de uso reciente para el desalojo en disco
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self._contadores['fallos'] += 1
+            return None
+
+        with self._lock:
+            self._contadores['aciertos_disco'] += 1
+            self._guardar_memoria(clave, entrada)
+        return entrada
+
+    def guardar(self, clave, resultados, landmarks, shape=None):
+        """Guarda los resultados por rostro, sus landmarks y el tamaño de la imagen en ambos niveles"""
+        entrada = {'resultados': resultados, 'landmarks': np.asarray(landmarks, dtype=np.float32),
+                   'shape': tuple(shape) if shape is not None else None}
+        with self._lock:
+            self._guardar_memoria(clave, entrada)
+
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, 'wb') as f:
+            extra = {'shape': np.array(entrada['shape'], dtype=np.int32)} if shape is not None else {}
+            np.savez(f, resultados=np.array(json.dumps(resultados)), landmarks=entrada['landmarks'], **extra)
+        tamano = os.path.getsize(temporal)
+
+        with self._lock:
+            # Reescribir una clave existente reemplaza su archivo: solo cuenta la diferencia de tamaño
+            try:
+                anterior = os.path.getsize(ruta)
+            except OSError:
+                anterior = 0
+            os.replace(temporal, ruta)
+            self._bytes_disco += tamano - anterior
+            if self._bytes_disco > self.max_bytes_disco:
+                self._desalojar_disco()
+
+    def _guardar_memoria(self, clave, entrada):
+        self._memoria[clave] = entrada
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _desalojar_disco(self):
+        """Borra las entradas usadas hace más tiempo hasta bajar al 90% del límite"""
+        archivos = []
+        for ruta in self._archivos_disco():
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+        archivos.sort()
+
+        total = sum(tamano for _, tamano, _ in archivos)
+        objetivo = self.max_bytes_disco * 0.9
+        for _, tamano, ruta in archivos:
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tamano
+            self._contadores['desalojos_disco'] += 1
+        self._bytes_disco = total
+
+    def metricas(self):
+        with self._lock:
+            consultas = sum(v for k, v in self._contadores.items() if k != 'desalojos_disco')
+            aciertos = self._contadores['aciertos_memoria'] + self._contadores['aciertos_disco']
+            return {
+                **self._contadores,
+                'tasa_aciertos': round(aciertos / consultas, 3) if consultas else 0.0,
+                'entradas_memoria': len(self._memoria),
+                'bytes_disco': self._bytes_disco
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache():
+    """Cache del proceso; RESULT_CACHE_DIR cambia el directorio en disco"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(os.environ.get('RESULT_CACHE_DIR', "data/cache"))
+    return _cache
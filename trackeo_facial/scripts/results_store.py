@@ -0,0 +1,349 @@
+import abc
+import csv
+import os
+from collections import deque
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se usa el candado entre hilos
+    fcntl = None
+
+# Esquema común para análisis de imágenes y sesiones de entrevista
+COLUMNAS = ['Hora', 'Imagen', 'Emociones', 'Apertura_Boca', 'Anchura_Boca', 'Elevacion_Cejas',
+            'Parpadeos', 'Frecuencia', 'Evaluación', 'Sesion', 'Origen', 'Rostro']
+COLUMNAS_IMAGEN = ['Hora', 'Imagen', 'Emociones', 'Apertura_Boca', 'Anchura_Boca', 'Elevacion_Cejas',
+                   'Origen', 'Rostro']
+COLUMNAS_SESION = ['Hora', 'Parpadeos', 'Frecuencia', 'Emociones', 'Evaluación', 'Rostro']
+
+ARCHIVO_HISTORIAL = "data/emociones_imagen.csv"
+
+
+def fila_imagen(nombre, emociones, valores, hora=None, rostro=None):
+    """Construye la fila de historial de una imagen analizada (un rostro por fila)"""
+    return {
+        'Hora': hora or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'Imagen': nombre,
+        'Emociones': emociones,
+        'Apertura_Boca': valores.get('apertura_boca', 0),
+        'Anchura_Boca': valores.get('anchura_boca', 0),
+        'Elevacion_Cejas': valores.get('elevacion_cejas', 0),
+        'Origen': 'imagen',
+        'Rostro': rostro
+    }
+
+
+def fila_sesion(hora, parpadeos, frecuencia, emociones, evaluacion, sesion=None, rostro=None):
+    """Construye la fila de una ventana de 10 segundos del detector en vivo"""
+    return {
+        'Hora': hora,
+        'Parpadeos': parpadeos,
+        'Frecuencia': frecuencia,
+        'Emociones': emociones,
+        'Evaluación': evaluacion,
+        'Sesion': sesion,
+        'Origen': 'entrevista',
+        'Rostro': rostro
+    }
+
+
+class ResultsStore(abc.ABC):
+    """Interfaz de almacenamiento de resultados: solo se agregan filas, nunca se reescriben"""
+
+    @abc.abstractmethod
+    def agregar(self, filas):
+        """Agrega una lista de filas (dict con claves de COLUMNAS); devuelve cuántas se escribieron"""
+
+    @abc.abstractmethod
+    def leer(self):
+        """Devuelve todas las filas almacenadas en orden de inserción"""
+
+    def iterar(self):
+        """Genera las filas en orden de inserción sin cargarlas todas en memoria"""
+        return iter(self.leer())
+
+    @abc.abstractmethod
+    def consultar(self, cursor=None, limite=50, desde=None, hasta=None, emocion=None, imagen=None):
+        """
+        Devuelve una página del historial, de la fila más reciente a la más antigua
+
+        Args:
+            cursor: Id de fila; solo se devuelven filas anteriores a él
+            limite: Número máximo de filas de la página
+            desde, hasta: Rango de 'Hora' (texto comparable, p. ej. '2025-07-24')
+            emocion: Texto contenido en 'Emociones' (sin distinguir mayúsculas)
+            imagen: Nombre exacto de la imagen
+
+        Returns:
+            tuple: (lista de filas con su 'id', cursor de la página siguiente o None)
+        """
+
+    @abc.abstractmethod
+    def version(self):
+        """Identificador que cambia cada vez que se agregan filas (para ETag)"""
+
+    def cerrar(self):
+        pass
+
+
+def _coincide(fila, desde, hasta, emocion, imagen):
+    hora = fila.get('Hora') or ''
+    if desde and hora < desde:
+        return False
+    if hasta and hora > hasta:
+        return False
+    if emocion and emocion.lower() not in (fila.get('Emociones') or '').lower():
+        return False
+    if imagen and fila.get('Imagen') != imagen:
+        return False
+    return True
+
+
+class CSVResultsStore(ResultsStore):
+    """
+    Escritor CSV de solo-agregar, con candado y fsync por lote
+
+    Si el encabezado de un archivo existente no tiene alguna de las columnas
+    configuradas (p. ej. 'Rostro' en historiales anteriores), el primer
+    agregar() lo reescribe una vez con las columnas nuevas al final, vacías
+    en las filas viejas.
+    """
+
+    def __init__(self, ruta=ARCHIVO_HISTORIAL, columnas=None):
+        self.ruta = ruta
+        self._columnas = columnas
+        self._lock = threading.Lock()
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    def columnas(self):
+        """Columnas del archivo: las del encabezado existente o las configuradas"""
+        if os.path.exists(self.ruta) and os.path.getsize(self.ruta) > 0:
+            with open(self.ruta, newline='', encoding='utf-8') as f:
+                return next(csv.reader(f))
+        return self._columnas or COLUMNAS_IMAGEN
+
+    def agregar(self, filas):
+        if not filas:
+            return 0
+        esperadas = self._columnas or COLUMNAS_IMAGEN
+        with self._lock:
+            while True:
+                with open(self.ruta, 'a+', newline='', encoding='utf-8') as f:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    try:
+                        # Otro proceso pudo migrar (reemplazar) el archivo mientras se esperaba el candado
+                        if not self._mismo_archivo(f):
+                            continue
+                        f.seek(0, os.SEEK_END)
+                        nuevo = f.tell() == 0
+                        if nuevo:
+                            columnas = esperadas
+                        else:
+                            # Respetar el orden de columnas del encabezado existente
+                            f.seek(0)
+                            columnas = next(csv.reader(f))
+                            faltantes = [columna for columna in esperadas if columna not in columnas]
+                            if faltantes:
+                                self._migrar(f, columnas + faltantes)
+                                continue
+                            f.seek(0, os.SEEK_END)
+                        writer = csv.DictWriter(f, fieldnames=columnas, extrasaction='ignore', restval='')
+                        if nuevo:
+                            writer.writeheader()
+                        writer.writerows(filas)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    finally:
+                        if fcntl is not None:
+                            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                return len(filas)
+
+    def _mismo_archivo(self, f):
+        try:
+            return os.fstat(f.fileno()).st_ino == os.stat(self.ruta).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _migrar(self, f, columnas):
+        """Reescribe el archivo (con el candado tomado) con el encabezado extendido"""
+        f.seek(0)
+        temporal = f"{self.ruta}.migracion"
+        with open(temporal, 'w', newline='', encoding='utf-8') as destino:
+            writer = csv.DictWriter(destino, fieldnames=columnas, extrasaction='ignore', restval='')
+            writer.writeheader()
+            writer.writerows(csv.DictReader(f))
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.replace(temporal, self.ruta)
+
+    def leer(self):
+        return list(self.iterar())
+
+    def iterar(self):
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+
+    def consultar(self, cursor=None, limite=50, desde=None, hasta=None, emocion=None, imagen=None):
+        if not os.path.exists(self.ruta):
+            return [], None
+        # Se recorre el archivo en streaming guardando solo las últimas limite+1 coincidencias
+        pagina = deque(maxlen=limite + 1)
+        with open(self.ruta, newline='', encoding='utf-8') as f:
+            for id_fila, fila in enumerate(csv.DictReader(f), start=1):
+                if cursor is not None and id_fila >= cursor:
+                    break
+                if _coincide(fila, desde, hasta, emocion, imagen):
+                    fila['id'] = id_fila
+                    pagina.append(fila)
+        filas = list(reversed(pagina))
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = filas[-1]['id']
+        return filas, siguiente
+
+    def version(self):
+        if not os.path.exists(self.ruta):
+            return "0"
+        estado = os.stat(self.ruta)
+        return f"{estado.st_size}-{estado.st_mtime_ns}"
+
+
+class SQLiteResultsStore(ResultsStore):
+    """Almacenamiento SQLite en modo WAL con índices por hora, imagen y emoción"""
+
+    _CAMPOS = {
+        'Hora': 'hora TEXT',
+        'Imagen': 'imagen TEXT',
+        'Emociones': 'emociones TEXT',
+        'Apertura_Boca': 'apertura_boca REAL',
+        'Anchura_Boca': 'anchura_boca REAL',
+        'Elevacion_Cejas': 'elevacion_cejas REAL',
+        'Parpadeos': 'parpadeos INTEGER',
+        'Frecuencia': 'frecuencia REAL',
+        'Evaluación': 'evaluacion TEXT',
+        'Sesion': 'sesion TEXT',
+        'Origen': 'origen TEXT',
+        'Rostro': 'rostro INTEGER'
+    }
+
+    def __init__(self, ruta="data/resultados.db"):
+        self.ruta = ruta
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        definicion = ", ".join(self._CAMPOS.values())
+        self._conexion.executescript(f"""
+            CREATE TABLE IF NOT EXISTS resultados (id INTEGER PRIMARY KEY AUTOINCREMENT, {definicion});
+            CREATE INDEX IF NOT EXISTS idx_resultados_hora ON resultados (hora);
+            CREATE INDEX IF NOT EXISTS idx_resultados_imagen ON resultados (imagen);
+            CREATE INDEX IF NOT EXISTS idx_resultados_emociones ON resultados (emociones);
+        """)
+        self._columnas_sql = [d.split()[0] for d in self._CAMPOS.values()]
+
+        # Bases creadas con versiones anteriores del esquema: agregar columnas faltantes
+        existentes = {registro[1] for registro in self._conexion.execute("PRAGMA table_info(resultados)")}
+        for definicion_campo in self._CAMPOS.values():
+            if definicion_campo.split()[0] not in existentes:
+                self._conexion.execute(f"ALTER TABLE resultados ADD COLUMN {definicion_campo}")
+        self._conexion.commit()
+
+    def agregar(self, filas):
+        if not filas:
+            return 0
+        marcadores = ", ".join("?" for _ in self._CAMPOS)
+        valores = [tuple(fila.get(col) for col in self._CAMPOS) for fila in filas]
+        with self._lock, self._conexion:
+            self._conexion.executemany(
+                f"INSERT INTO resultados ({', '.join(self._columnas_sql)}) VALUES ({marcadores})", valores)
+        return len(filas)
+
+    def leer(self):
+        with self._lock:
+            cursor = self._conexion.execute(
+                f"SELECT {', '.join(self._columnas_sql)} FROM resultados ORDER BY id")
+            return [dict(zip(self._CAMPOS, registro)) for registro in cursor]
+
+    def iterar(self):
+        # Páginas por id: el candado no se retiene mientras quien llama procesa las filas
+        ultimo = 0
+        while True:
+            with self._lock:
+                registros = self._conexion.execute(
+                    f"SELECT id, {', '.join(self._columnas_sql)} FROM resultados WHERE id > ? "
+                    f"ORDER BY id LIMIT 1000", (ultimo,)).fetchall()
+            if not registros:
+                return
+            for registro in registros:
+                yield dict(zip(self._CAMPOS, registro[1:]))
+            ultimo = registros[-1][0]
+
+    def consultar(self, cursor=None, limite=50, desde=None, hasta=None, emocion=None, imagen=None):
+        condiciones, parametros = [], []
+        if cursor is not None:
+            condiciones.append("id < ?")
+            parametros.append(cursor)
+        if desde:
+            condiciones.append("hora >= ?")
+            parametros.append(desde)
+        if hasta:
+            condiciones.append("hora <= ?")
+            parametros.append(hasta)
+        if emocion:
+            condiciones.append("emociones LIKE ?")
+            parametros.append(f"%{emocion}%")
+        if imagen:
+            condiciones.append("imagen = ?")
+            parametros.append(imagen)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._lock:
+            registros = self._conexion.execute(
+                f"SELECT id, {', '.join(self._columnas_sql)} FROM resultados {where} "
+                f"ORDER BY id DESC LIMIT ?", parametros + [limite + 1]).fetchall()
+        filas = [dict(zip(['id', *self._CAMPOS], registro)) for registro in registros[:limite]]
+        siguiente = filas[-1]['id'] if len(registros) > limite else None
+        return filas, siguiente
+
+    def version(self):
+        with self._lock:
+            total, ultimo = self._conexion.execute("SELECT COUNT(*), MAX(id) FROM resultados").fetchone()
+        return f"{total}-{ultimo}"
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+def crear_store(url, columnas=None):
+    """Crea un store a partir de 'csv:<ruta>' o 'sqlite:<ruta>'"""
+    tipo, _, ruta = url.partition(':')
+    if tipo == 'csv':
+        return CSVResultsStore(ruta or ARCHIVO_HISTORIAL, columnas)
+    if tipo == 'sqlite':
+        return SQLiteResultsStore(ruta or "data/resultados.db")
+    raise ValueError(f"Tipo de almacenamiento desconocido: {tipo}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def obtener_store():
+    """Store del proceso configurado con RESULTS_STORE (por defecto el CSV de historial)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = crear_store(os.environ.get('RESULTS_STORE', f"csv:{ARCHIVO_HISTORIAL}"))
+    return _store
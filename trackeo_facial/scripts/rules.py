@@ -0,0 +1,340 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from scripts.features import NOMBRES_CARACTERISTICAS
+
+logger = logging.getLogger('trackeo.reglas')
+
+RUTA_REGLAS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'models', 'reglas_emociones.json')
+
+_FUNCIONES = {'min': '_min', 'max': '_max', 'abs': '_abs'}
+_OPERADORES = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+_COMPARADORES = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!='}
+
+# Mismo código generado, dos implementaciones: floats de Python para un rostro
+# (sin el costo fijo de NumPy por operación) y arrays para un lote completo
+_ESCALAR = {
+    '_num': float,
+    '_y': lambda a, b: float(bool(a) and bool(b)),
+    '_o': lambda a, b: float(bool(a) or bool(b)),
+    '_no': lambda a: float(not a),
+    '_min': min,
+    '_max': max,
+    '_abs': abs,
+}
+_VECTORIAL = {
+    '_num': lambda x: np.asarray(x, dtype=np.float64),
+    '_y': lambda a, b: np.logical_and(a, b).astype(np.float64),
+    '_o': lambda a, b: np.logical_or(a, b).astype(np.float64),
+    '_no': lambda a: np.logical_not(a).astype(np.float64),
+    '_min': np.minimum,
+    '_max': np.maximum,
+    '_abs': np.abs,
+}
+
+
+def _traducir(nodo, nombres):
+    """Traduce una expresión de regla (subconjunto de Python) a código con operaciones vectorizables"""
+    if isinstance(nodo, ast.Expression):
+        return _traducir(nodo.body, nombres)
+    if isinstance(nodo, ast.Constant) and isinstance(nodo.value, (bool, int, float)):
+        return repr(float(nodo.value)) if isinstance(nodo.value, bool) else repr(nodo.value)
+    if isinstance(nodo, ast.Name):
+        nombres.append(nodo.id)
+        return nodo.id
+    if isinstance(nodo, ast.UnaryOp) and isinstance(nodo.op, ast.USub):
+        return f"(-{_traducir(nodo.operand, nombres)})"
+    if isinstance(nodo, ast.UnaryOp) and isinstance(nodo.op, ast.Not):
+        return f"_no({_traducir(nodo.operand, nombres)})"
+    if isinstance(nodo, ast.BinOp) and type(nodo.op) in _OPERADORES:
+        return (f"({_traducir(nodo.left, nombres)} {_OPERADORES[type(nodo.op)]} "
+                f"{_traducir(nodo.right, nombres)})")
+    if isinstance(nodo, ast.BoolOp):
+        funcion = '_y' if isinstance(nodo.op, ast.And) else '_o'
+        codigo = _traducir(nodo.values[0], nombres)
+        for valor in nodo.values[1:]:
+            codigo = f"{funcion}({codigo}, {_traducir(valor, nombres)})"
+        return codigo
+    if isinstance(nodo, ast.Compare) and all(type(op) in _COMPARADORES for op in nodo.ops):
+        # a < b < c se evalúa como (a < b) y (b < c)
+        operandos = [_traducir(nodo.left, nombres)] + [_traducir(c, nombres) for c in nodo.comparators]
+        partes = [f"_num({izq} {_COMPARADORES[type(op)]} {der})"
+                  for izq, op, der in zip(operandos, nodo.ops, operandos[1:])]
+        codigo = partes[0]
+        for parte in partes[1:]:
+            codigo = f"_y({codigo}, {parte})"
+        return codigo
+    if (isinstance(nodo, ast.Call) and isinstance(nodo.func, ast.Name)
+            and nodo.func.id in _FUNCIONES and not nodo.keywords):
+        argumentos = ", ".join(_traducir(arg, nombres) for arg in nodo.args)
+        return f"{_FUNCIONES[nodo.func.id]}({argumentos})"
+    raise ValueError(f"Expresión no permitida en reglas: {ast.unparse(nodo)}")
+
+
+def _compilar_expresion(texto, nombres):
+    if isinstance(texto, (int, float)) and not isinstance(texto, bool):
+        return repr(texto)
+    try:
+        arbol = ast.parse(str(texto), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Expresión inválida '{texto}': {e.msg}") from None
+    return _traducir(arbol, nombres)
+
+
+class Regla:
+    """Una regla compilada: emoción, grupo excluyente, condición y confianza"""
+
+    __slots__ = ('emocion', 'grupo', 'si', 'confianza', 'nombres')
+
+    def __init__(self, definicion):
+        self.emocion = definicion['emocion']
+        self.grupo = definicion.get('grupo')
+        nombres = []
+        self.si = _compilar_expresion(definicion.get('si', True), nombres)
+        self.confianza = _compilar_expresion(definicion.get('confianza', 1.0), nombres)
+        # Medidas que explican la regla (para trazas), sin repetir y en orden de aparición
+        self.nombres = tuple(dict.fromkeys(nombres))
+
+
+class ResultadoReglas:
+    """Emociones de un rostro, en el orden de la tabla de reglas"""
+
+    __slots__ = ('emociones', 'confianza', 'variables', 'activadas')
+
+    def __init__(self, emociones, confianza, variables, activadas):
+        self.emociones = emociones
+        self.confianza = confianza
+        self.variables = variables
+        self.activadas = activadas
+
+
+class ConjuntoReglas:
+    """
+    Tabla de reglas de un detector compilada a una función de NumPy
+
+    La definición tiene:
+        entradas: Valores que no son medidas y se pasan al evaluar (p. ej. la escala);
+            lista de nombres, o dict nombre -> valor por defecto
+        variables: nombre -> expresión, calculadas en orden antes de las reglas
+        reglas: Lista de {emocion, si, confianza, grupo}; de cada grupo solo se
+            activa la primera regla que se cumple
+        si_ninguna: Reglas excluyentes que se evalúan cuando ninguna otra se activó
+    """
+
+    def __init__(self, nombre, definicion):
+        self.nombre = nombre
+        entradas = definicion.get('entradas', ())
+        self.entradas = tuple(entradas)
+        self.defectos = dict(entradas) if isinstance(entradas, dict) else {}
+        self.variables = dict(definicion.get('variables', {}))
+        self.reglas = [Regla(r) for r in definicion.get('reglas', [])]
+        self.si_ninguna = [Regla(r) for r in definicion.get('si_ninguna', [])]
+        self._grupos = {}
+        for i, regla in enumerate(self.reglas):
+            if regla.grupo:
+                self._grupos.setdefault(regla.grupo, []).append(i)
+        self._escalar, self._vectorial = self._compilar()
+
+    def _compilar(self):
+        conocidos = set(NOMBRES_CARACTERISTICAS) | set(self.entradas)
+        usados = []
+        lineas = []
+        for nombre, expresion in self.variables.items():
+            if not nombre.isidentifier() or nombre.startswith('_') or nombre in conocidos:
+                raise ValueError(f"[{self.nombre}] Nombre de variable inválido o repetido: {nombre}")
+            nombres = []
+            codigo = _compilar_expresion(expresion, nombres)
+            self._validar(nombres, conocidos)
+            usados.extend(nombres)
+            lineas.append(f"    {nombre} = {codigo}")
+            conocidos.add(nombre)
+
+        salidas = []
+        for regla in self.reglas + self.si_ninguna:
+            self._validar(regla.nombres, conocidos)
+            usados.extend(regla.nombres)
+            salidas.append(f"({regla.si}, {regla.confianza})")
+
+        entradas = [n for n in dict.fromkeys(usados) if n not in self.variables]
+        cuerpo = [f"    {n} = _v['{n}']" for n in entradas] + lineas
+        variables = ", ".join(f"'{n}': {n}" for n in self.variables)
+        fuente = "def _evaluar(_v):\n" + "\n".join(cuerpo + [
+            f"    return ({', '.join(salidas)}{',' if len(salidas) == 1 else ''}), {{{variables}}}"
+        ]) + "\n"
+
+        funciones = []
+        for espacio in (_ESCALAR, _VECTORIAL):
+            contexto = dict(espacio)
+            exec(compile(fuente, f"<reglas {self.nombre}>", 'exec'), contexto)
+            funciones.append(contexto['_evaluar'])
+        return funciones
+
+    def _validar(self, nombres, conocidos):
+        desconocidos = [n for n in nombres if n not in conocidos]
+        if desconocidos:
+            raise ValueError(f"[{self.nombre}] Nombres desconocidos en reglas: {', '.join(desconocidos)}")
+
+    def evaluar(self, caracteristicas, **entradas):
+        """
+        Evalúa las reglas para un rostro
+
+        Args:
+            caracteristicas: dict nombre -> float (ver extraer_caracteristicas)
+            **entradas: Valores declarados en 'entradas' (los omitidos toman su valor por defecto)
+
+        Returns:
+            ResultadoReglas
+        """
+        salidas, variables = self._escalar({**self.defectos, **caracteristicas, **entradas})
+        n = len(self.reglas)
+        emociones = []
+        confianza = {}
+        activadas = []
+        grupos = set()
+        for regla, (si, valor) in zip(self.reglas, salidas[:n]):
+            if not si or (regla.grupo and regla.grupo in grupos):
+                continue
+            if regla.grupo:
+                grupos.add(regla.grupo)
+            emociones.append(regla.emocion)
+            confianza[regla.emocion] = valor
+            activadas.append(regla)
+        if not emociones:
+            for regla, (si, valor) in zip(self.si_ninguna, salidas[n:]):
+                if si:
+                    emociones.append(regla.emocion)
+                    confianza[regla.emocion] = valor
+                    activadas.append(regla)
+                    break
+        return ResultadoReglas(emociones, confianza, variables, activadas)
+
+    def evaluar_lote(self, caracteristicas, **entradas):
+        """
+        Evalúa las reglas para muchos rostros o frames en una sola pasada
+
+        Args:
+            caracteristicas: dict nombre -> array (B,), o matriz (B, F) de matriz_caracteristicas
+            **entradas: Escalares o arrays (B,)
+
+        Returns:
+            list: ResultadoReglas por fila
+        """
+        if isinstance(caracteristicas, np.ndarray):
+            caracteristicas = dict(zip(NOMBRES_CARACTERISTICAS, caracteristicas.T.astype(np.float64)))
+        cantidad = len(next(iter(caracteristicas.values())))
+        if cantidad == 0:
+            return []
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            salidas, variables = self._vectorial({**self.defectos, **caracteristicas, **entradas})
+        forma = (cantidad,)
+        activas = np.stack([np.broadcast_to(np.asarray(si) != 0, forma) for si, _ in salidas], axis=1)
+        valores = np.stack([np.broadcast_to(np.asarray(v, dtype=np.float64), forma) for _, v in salidas], axis=1)
+
+        n = len(self.reglas)
+        reglas = activas[:, :n].copy()
+        for columnas in self._grupos.values():
+            # Solo la primera regla activa de cada grupo
+            bloque = reglas[:, columnas]
+            reglas[:, columnas] = bloque & (np.cumsum(bloque, axis=1) == 1)
+        ninguna = activas[:, n:] & ~reglas.any(axis=1, keepdims=True)
+        ninguna &= np.cumsum(ninguna, axis=1) == 1
+        seleccion = np.concatenate([reglas, ninguna], axis=1)
+
+        todas = self.reglas + self.si_ninguna
+        variables = {nombre: np.broadcast_to(valor, forma) for nombre, valor in variables.items()}
+        resultados = []
+        for fila in range(cantidad):
+            indices = np.flatnonzero(seleccion[fila])
+            resultados.append(ResultadoReglas(
+                [todas[i].emocion for i in indices],
+                {todas[i].emocion: float(valores[fila, i]) for i in indices},
+                {nombre: float(valor[fila]) for nombre, valor in variables.items()},
+                [todas[i] for i in indices]
+            ))
+        return resultados
+
+
+class MotorReglas:
+    """
+    Conjuntos de reglas cargados de un archivo JSON (o YAML si PyYAML está instalado)
+
+    recargar_si_cambio() vuelve a compilar el archivo cuando cambia su fecha de
+    modificación; si la nueva versión tiene errores se conservan las reglas anteriores.
+    """
+
+    def __init__(self, ruta=RUTA_REGLAS, intervalo_revision=1.0):
+        self.ruta = ruta
+        self.intervalo_revision = intervalo_revision
+        self._lock = threading.Lock()
+        self._ultima_revision = 0.0
+        self._mtime = None
+        self._conjuntos = {}
+        self.huella = None
+        self.cargar()
+
+    def _leer(self):
+        with open(self.ruta, encoding='utf-8') as f:
+            texto = f.read()
+        if self.ruta.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(texto)
+        return json.loads(texto)
+
+    def cargar(self):
+        mtime = os.path.getmtime(self.ruta)
+        definicion = self._leer()
+        conjuntos = {nombre: ConjuntoReglas(nombre, valor)
+                     for nombre, valor in definicion.items() if isinstance(valor, dict)}
+        huella = hashlib.sha1(json.dumps(definicion, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            self._conjuntos = conjuntos
+            self.huella = huella
+            self._mtime = mtime
+
+    def recargar_si_cambio(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_revision < self.intervalo_revision:
+            return False
+        self._ultima_revision = ahora
+        try:
+            mtime = os.path.getmtime(self.ruta)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.cargar()
+        except (OSError, ValueError) as e:
+            # Se recuerda la versión con errores para no reintentarla en cada revisión
+            self._mtime = mtime
+            logger.warning("No se recargaron las reglas de %s: %s", self.ruta, e)
+            return False
+        logger.info("Reglas recargadas de %s (%s)", self.ruta, self.huella)
+        return True
+
+    def conjunto(self, nombre):
+        self.recargar_si_cambio()
+        return self._conjuntos[nombre]
+
+
+_motor = None
+_motor_lock = threading.Lock()
+
+
+def obtener_motor():
+    """Motor del proceso; REGLAS_EMOCIONES cambia el archivo de reglas"""
+    global _motor
+    if _motor is None:
+        with _motor_lock:
+            if _motor is None:
+                _motor = MotorReglas(os.environ.get('REGLAS_EMOCIONES', RUTA_REGLAS))
+    return _motor
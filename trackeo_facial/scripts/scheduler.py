@@ -0,0 +1,212 @@
+import numpy as np
+
+MODOS = ('completo', 'roi', 'salto')
+
+
+def _tamano_rostros(puntos):
+    """Ancho de cada rostro (F,) en coordenadas normalizadas"""
+    return np.maximum(np.ptp(puntos[..., 0], axis=1), 1e-6)
+
+
+class PlanificadorInferencia:
+    """
+    Planificador adaptativo de FaceMesh para el detector en vivo
+
+    Para cada frame decide uno de tres modos:
+        completo  FaceMesh sobre el frame entero: al empezar, cuando se pierde
+                  el rastro y cada `refresco` frames para descubrir rostros nuevos
+        roi       FaceMesh sobre un recorte con margen alrededor de los rostros anteriores
+        salto     Se reutilizan los últimos landmarks porque la expresión está
+                  estable: poco movimiento y mismas emociones en las dos últimas
+                  inferencias (a lo sumo `max_saltos` frames seguidos)
+
+    Cada `auditoria` frames resueltos con roi o salto, quien llama ejecuta
+    además el frame completo y lo pasa a auditar(). La discrepancia de
+    emociones (promedio móvil) se compara con `presupuesto`: si lo supera se
+    dejan de saltar frames hasta que baje a la mitad.
+    """
+
+    def __init__(self, margen=0.3, max_saltos=2, umbral_movimiento=0.02, refresco=30,
+                 auditoria=30, presupuesto=0.05, area_max=0.6):
+        self.margen = margen
+        self.max_saltos = max_saltos
+        self.umbral_movimiento = umbral_movimiento
+        self.refresco = refresco
+        self.auditoria = auditoria
+        self.presupuesto = presupuesto
+        self.area_max = area_max
+
+        self.puntos = None  # Últimos landmarks (F, N, 3) normalizados al frame
+        self._emociones = None
+        self._estable = False
+        self._movimiento = np.inf
+        self._saltos_seguidos = 0
+        self._desde_completo = 0
+        self._perdido = True
+        self.saltos_permitidos = True
+        self._hasta_auditoria = auditoria
+        self.discrepancia = 0.0
+
+        self.frames = dict.fromkeys(MODOS, 0)
+        self.segundos = dict.fromkeys(MODOS, 0.0)
+        self.roi_fallidos = 0
+        self._pixeles = 0.0
+        self.auditorias = 0
+        self._segundos_auditoria = 0.0
+        self._discrepancias = 0.0
+        self._error_landmarks = 0.0
+
+    def decidir(self):
+        """Modo del próximo frame: 'completo', 'roi' o 'salto'"""
+        if self.puntos is None or self._perdido or self._desde_completo >= self.refresco:
+            return 'completo'
+        if (self.saltos_permitidos and self._saltos_seguidos < self.max_saltos
+                and self._estable and self._movimiento < self.umbral_movimiento):
+            return 'salto'
+        return 'roi'
+
+    def roi(self, shape):
+        """Recorte (x0, y0, x1, y1) en píxeles alrededor de los últimos rostros, o None si no conviene"""
+        alto, ancho = shape[:2]
+        xy = self.puntos[..., :2].reshape(-1, 2) * (ancho, alto)
+        (x0, y0), (x1, y1) = xy.min(axis=0), xy.max(axis=0)
+        margen = self.margen * max(x1 - x0, y1 - y0)
+        x0, y0 = max(int(x0 - margen), 0), max(int(y0 - margen), 0)
+        x1, y1 = min(int(x1 + margen) + 1, ancho), min(int(y1 + margen) + 1, alto)
+        if x1 - x0 < 32 or y1 - y0 < 32 or (x1 - x0) * (y1 - y0) > self.area_max * ancho * alto:
+            return None
+        return x0, y0, x1, y1
+
+    @staticmethod
+    def a_frame(puntos, roi, shape):
+        """Convierte landmarks normalizados al recorte en landmarks normalizados al frame"""
+        x0, y0, x1, y1 = roi
+        alto, ancho = shape[:2]
+        puntos = np.array(puntos, dtype=np.float32)
+        puntos[..., 0] = (puntos[..., 0] * (x1 - x0) + x0) / ancho
+        puntos[..., 1] = (puntos[..., 1] * (y1 - y0) + y0) / alto
+        # MediaPipe expresa z en la escala del ancho de la imagen
+        puntos[..., 2] *= (x1 - x0) / ancho
+        return puntos
+
+    @staticmethod
+    def emparejar(puntos, otros):
+        """Para cada rostro de puntos, el índice del rostro más cercano de otros (por centro)"""
+        if len(puntos) == 0 or len(otros) == 0:
+            return []
+        centros = puntos[..., :2].mean(axis=1)
+        centros_otros = otros[..., :2].mean(axis=1)
+        return np.argmin(np.linalg.norm(centros[:, None] - centros_otros[None], axis=-1), axis=1).tolist()
+
+    def registrar_fallo(self, segundos):
+        """Un recorte que no encontró todos los rostros (el frame se repite completo)"""
+        self.roi_fallidos += 1
+        self.segundos['roi'] += segundos
+
+    def registrar(self, modo, puntos, emociones, segundos, fraccion_pixeles=1.0):
+        """
+        Actualiza el estado con el resultado de un frame
+
+        Args:
+            modo: Modo con el que se resolvió el frame
+            puntos: Landmarks (F, N, 3) normalizados al frame (vacío si no hubo rostros)
+            emociones: Emociones crudas de cada rostro (antes del suavizado)
+            segundos: Tiempo de FaceMesh del frame
+            fraccion_pixeles: Fracción del frame que procesó FaceMesh
+        """
+        self.frames[modo] += 1
+        self.segundos[modo] += segundos
+        self._pixeles += fraccion_pixeles
+        self._desde_completo = 0 if modo == 'completo' else self._desde_completo + 1
+        if modo == 'salto':
+            self._saltos_seguidos += 1
+            return
+        self._saltos_seguidos = 0
+        if puntos is None or len(puntos) == 0:
+            self.puntos = None
+            self._perdido = True
+            return
+        self._perdido = False
+        if self.puntos is not None and len(self.puntos) == len(puntos):
+            # Desplazamiento medio de los landmarks relativo al ancho de cada rostro
+            desplazamiento = np.linalg.norm(puntos[..., :2] - self.puntos[..., :2], axis=-1).mean(axis=1)
+            self._movimiento = float(np.max(desplazamiento / _tamano_rostros(puntos)))
+        else:
+            self._movimiento = np.inf
+        emociones = [tuple(e) for e in emociones]
+        self._estable = emociones == self._emociones
+        self._emociones = emociones
+        self.puntos = puntos
+
+    def perder_rastro(self):
+        self._perdido = True
+
+    def toca_auditar(self, modo):
+        """True si este frame (resuelto con roi o salto) debe compararse con el frame completo"""
+        if not self.auditoria or modo == 'completo':
+            return False
+        self._hasta_auditoria -= 1
+        if self._hasta_auditoria > 0:
+            return False
+        self._hasta_auditoria = self.auditoria
+        return True
+
+    def auditar(self, puntos, emociones, puntos_completo, emociones_completo, segundos):
+        """
+        Compara el resultado planificado con el del frame completo
+
+        Args:
+            puntos, emociones: Landmarks (F, N, 3) y emociones crudas del modo planificado
+            puntos_completo, emociones_completo: Lo mismo con FaceMesh sobre el frame completo
+            segundos: Tiempo de FaceMesh del frame completo
+        """
+        self.auditorias += 1
+        self._segundos_auditoria += segundos
+        if len(puntos) != len(puntos_completo):
+            discrepancia, error = 1.0, 1.0
+            # Apareció o desapareció un rostro: el próximo frame va completo
+            self.perder_rastro()
+        elif len(puntos) == 0:
+            discrepancia, error = 0.0, 0.0
+        else:
+            indices = self.emparejar(puntos, puntos_completo)
+            completo = puntos_completo[indices]
+            errores = np.linalg.norm(puntos[..., :2] - completo[..., :2], axis=-1).mean(axis=1)
+            error = float(np.mean(errores / _tamano_rostros(completo)))
+            discrepancia = float(np.mean([set(emociones[i]) != set(emociones_completo[j])
+                                          for i, j in enumerate(indices)]))
+        self._discrepancias += discrepancia
+        self._error_landmarks += error
+        self.discrepancia = 0.8 * self.discrepancia + 0.2 * discrepancia
+        if self.discrepancia > self.presupuesto:
+            self.saltos_permitidos = False
+        elif self.discrepancia <= self.presupuesto / 2:
+            self.saltos_permitidos = True
+
+    def resumen(self):
+        """Frames por modo, tiempo de FaceMesh ahorrado y diferencia de exactitud contra el frame completo"""
+        frames = sum(self.frames.values())
+        # Las auditorías también son inferencias de frame completo: sirven para estimar su costo
+        muestras_completo = self.frames['completo'] + self.auditorias
+        ms_completo = ((self.segundos['completo'] + self._segundos_auditoria) / muestras_completo * 1000
+                       if muestras_completo else None)
+        real_ms = (sum(self.segundos.values()) + self._segundos_auditoria) * 1000
+        resumen = {
+            'frames': frames,
+            'modos': dict(self.frames),
+            'roi_fallidos': self.roi_fallidos,
+            'ms_por_modo': {modo: round(self.segundos[modo] / self.frames[modo] * 1000, 2)
+                            for modo in MODOS if self.frames[modo]},
+            'pixeles_procesados_pct': round(self._pixeles / frames * 100, 1) if frames else 0.0,
+            'tiempo_ahorrado_pct': None,
+            'auditorias': self.auditorias,
+            'discrepancia_emociones_pct': None,
+            'error_landmarks_pct': None,
+            'saltos_permitidos': self.saltos_permitidos
+        }
+        if ms_completo and frames:
+            resumen['tiempo_ahorrado_pct'] = round((1 - real_ms / (ms_completo * frames)) * 100, 1)
+        if self.auditorias:
+            resumen['discrepancia_emociones_pct'] = round(self._discrepancias / self.auditorias * 100, 2)
+            resumen['error_landmarks_pct'] = round(self._error_landmarks / self.auditorias * 100, 2)
+        return resumen
@@ -0,0 +1,262 @@
+import argparse
+import gc
+import glob
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import contextmanager
+
+DIRECTORIO_ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+
+class PerfilArranque:
+    """Duración de cada fase del arranque, para el reporte de --perfil-arranque"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.fases = []
+
+    @contextmanager
+    def fase(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases.append((nombre, time.perf_counter() - inicio))
+
+    def reporte(self):
+        total = time.perf_counter() - self.inicio
+        lineas = [f"⏱️  Arranque {self.nombre}: {total * 1000:.0f} ms"]
+        lineas.extend(f"   {nombre:<24} {segundos * 1000:8.1f} ms" for nombre, segundos in self.fases)
+        return "\n".join(lineas)
+
+
+def imagen_calentamiento(ruta=None):
+    """Ruta de la imagen de calentamiento: la indicada o la primera de assets/"""
+    if ruta:
+        return ruta
+    imagenes = sorted(glob.glob(os.path.join(DIRECTORIO_ASSETS, '*.jp*g')) +
+                      glob.glob(os.path.join(DIRECTORIO_ASSETS, '*.png')))
+    return imagenes[0] if imagenes else None
+
+
+def calentar(aplicacion, ruta):
+    """
+    Ejecuta una inferencia completa (FaceMesh, medidas y reglas) sobre una imagen
+
+    No escribe en el historial ni en el cache: solo deja cargados el grafo, las
+    reglas y el modelo antes de la primera petición real.
+
+    Returns:
+        int: Rostros detectados
+    """
+    import cv2
+    import numpy as np
+    from scripts.features import landmarks_a_array
+    from scripts.helpers import detectar_microexpresiones_lote
+
+    imagen = cv2.imread(ruta)
+    if imagen is None:
+        raise ValueError(f"No se pudo leer la imagen de calentamiento {ruta}")
+    results = aplicacion.pool_facemesh.procesar(cv2.cvtColor(imagen, cv2.COLOR_BGR2RGB))
+    if not results.multi_face_landmarks:
+        return 0
+    landmarks = np.stack([landmarks_a_array(f.landmark) for f in results.multi_face_landmarks])
+    detectar_microexpresiones_lote(landmarks, imagen.shape[:2], imagen=imagen)
+    return len(landmarks)
+
+
+def cargar_aplicacion(perfil, perfil_importacion=False):
+    """
+    Importa main sin crear los recursos por proceso y precarga lo que se comparte con los workers
+
+    Returns:
+        module: El módulo main
+    """
+    # main no crea FaceMesh, hilos ni archivos: eso ocurre en cada worker
+    os.environ['TRACKEO_PREFORK'] = '1'
+    for modulo in ('numpy', 'cv2', 'flask', 'mediapipe'):
+        with perfil.fase(f"import {modulo}"):
+            importlib.import_module(modulo)
+
+    perfilador = None
+    if perfil_importacion:
+        from scripts.metrics import Perfilador
+        perfilador = Perfilador()
+        perfilador.iniciar()
+    with perfil.fase("import main"):
+        import main as aplicacion
+    if perfilador is not None:
+        os.makedirs('data/perfiles', exist_ok=True)
+        ruta = os.path.join('data/perfiles', f"{time.strftime('%Y%m%d_%H%M%S')}_arranque.txt")
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(perfilador.terminar())
+        print(f"📄 Perfil de importación en {ruta}")
+
+    from scripts.rules import obtener_motor
+    from scripts.nervousness import obtener_modelo
+    with perfil.fase("reglas y modelo"):
+        obtener_motor().conjunto('imagen')
+        obtener_modelo()
+    return aplicacion
+
+
+def iniciar_worker(aplicacion, args, perfil):
+    """Crea los recursos del proceso y, si se pidió, lo calienta con una imagen"""
+    with perfil.fase("recursos"):
+        aplicacion.iniciar_recursos()
+    if args.warmup is not None:
+        ruta = imagen_calentamiento(args.warmup)
+        if ruta is None:
+            print("⚠️  No hay imágenes en assets/ para el calentamiento")
+        else:
+            with perfil.fase("warmup"):
+                rostros = calentar(aplicacion, ruta)
+            if args.perfil_arranque:
+                print(f"🔥 [{os.getpid()}] Calentamiento con {os.path.basename(ruta)}: {rostros} rostros")
+
+
+def exponer_metricas(args, indice):
+    """
+    Etiqueta las métricas del worker y, con --metricas-puerto, las expone en un puerto propio
+
+    Cada worker guarda sus métricas en memoria: /metrics en el puerto compartido responde
+    con las del worker que atienda esa petición. Para ver todas hay que scrapear cada
+    worker en --metricas-puerto + índice y sumar por la etiqueta `worker`.
+    """
+    from scripts import metrics
+
+    metrics.etiquetar_proceso(worker=indice)
+    if args.metricas_puerto is not None:
+        metrics.servir(args.metricas_puerto + indice, args.host)
+
+
+def servir_worker(aplicacion, args, zocalo, indice):
+    """Proceso hijo: recursos propios y servidor HTTP sobre el socket heredado"""
+    from werkzeug.serving import make_server
+
+    # SIGTERM cierra el worker ordenadamente: lanzar() libera los recursos antes de salir
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, lambda *_: sys.exit(0))
+    perfil = PerfilArranque(f"worker {os.getpid()}")
+    exponer_metricas(args, indice)
+    iniciar_worker(aplicacion, args, perfil)
+    if args.perfil_arranque:
+        print(perfil.reporte(), flush=True)
+    servidor = make_server(args.host, args.puerto, aplicacion.app, threaded=True, fd=zocalo.fileno())
+    servidor.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sirve la aplicación con workers prefork que comparten lo cargado por el proceso padre")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--puerto', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2, help="Procesos que atienden peticiones")
+    parser.add_argument('--warmup', nargs='?', const='', default=None, metavar='IMAGEN',
+                        help="Inferencia de calentamiento en cada worker (por defecto, la primera imagen de assets/)")
+    parser.add_argument('--perfil-arranque', action='store_true',
+                        help="Reporte de tiempos de arranque y perfil cProfile de la importación")
+    parser.add_argument('--metricas-puerto', type=int, default=None,
+                        help="Exponer /metrics de cada worker en este puerto + su índice (0, 1, ...)")
+    args = parser.parse_args()
+
+    perfil = PerfilArranque("proceso principal")
+    aplicacion = cargar_aplicacion(perfil, args.perfil_arranque)
+
+    zocalo = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    zocalo.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    zocalo.bind((args.host, args.puerto))
+    zocalo.listen(128)
+    zocalo.set_inheritable(True)
+
+    if not hasattr(os, 'fork') or args.workers <= 1:
+        # Sin fork (Windows) o con un solo worker, se sirve desde este proceso
+        if args.workers > 1:
+            print("⚠️  Este sistema no permite fork: se usa un solo proceso")
+        exponer_metricas(args, 0)
+        iniciar_worker(aplicacion, args, perfil)
+        if args.perfil_arranque:
+            print(perfil.reporte())
+        from werkzeug.serving import make_server
+        print(f"🚀 Sirviendo en http://{args.host}:{args.puerto}")
+        make_server(args.host, args.puerto, aplicacion.app, threaded=True, fd=zocalo.fileno()).serve_forever()
+        return
+
+    # Lo cargado hasta aquí queda fuera del recolector: los hijos lo comparten sin copiarlo
+    gc.freeze()
+    if args.perfil_arranque:
+        print(perfil.reporte())
+
+    hijos = {}
+    terminando = False
+
+    def lanzar(indice):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                servir_worker(aplicacion, args, zocalo, indice)
+            except SystemExit as e:
+                codigo = e.code or 0
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                codigo = 1
+            finally:
+                # os._exit no corre los atexit (tampoco los heredados del padre)
+                try:
+                    aplicacion.cerrar_recursos()
+                finally:
+                    os._exit(codigo)
+        # El índice se conserva al relanzar: mismo puerto de métricas y misma etiqueta worker
+        hijos[pid] = (time.monotonic(), indice)
+
+    def detener(*_):
+        nonlocal terminando
+        terminando = True
+        # Al terminar los hijos, os.wait() vuelve y el bucle sale
+        for pid in list(hijos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, detener)
+    signal.signal(signal.SIGINT, detener)
+
+    for indice in range(args.workers):
+        lanzar(indice)
+    print(f"🚀 {args.workers} workers sirviendo en http://{args.host}:{args.puerto}")
+
+    while not terminando:
+        try:
+            pid, estado = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        hijo = hijos.pop(pid, None)
+        if hijo is None or terminando:
+            continue
+        inicio, indice = hijo
+        # Un worker que muere al arrancar no se relanza en bucle
+        if time.monotonic() - inicio < 1.0:
+            time.sleep(1.0)
+        print(f"♻️  Worker {pid} terminó (estado {estado}); relanzando")
+        lanzar(indice)
+
+    detener()
+    for pid in list(hijos):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
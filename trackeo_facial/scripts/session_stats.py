@@ -0,0 +1,253 @@
+import json
+import os
+from collections import Counter, deque
+
+
+class CuantilP2:
+    """
+    Estimador P² (Jain y Chlamtac) de un percentil sobre un flujo de valores
+
+    Guarda cinco marcadores sin importar cuántos valores se agreguen; con
+    menos de cinco devuelve el percentil exacto.
+    """
+
+    __slots__ = ('p', '_alturas', '_posiciones', '_deseadas', '_incrementos', 'cantidad')
+
+    def __init__(self, p):
+        self.p = p
+        self._alturas = []
+        self._posiciones = [1, 2, 3, 4, 5]
+        self._deseadas = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._incrementos = [0, p / 2, p, (1 + p) / 2, 1]
+        self.cantidad = 0
+
+    def agregar(self, valor):
+        self.cantidad += 1
+        q = self._alturas
+        if self.cantidad <= 5:
+            q.append(valor)
+            q.sort()
+            return
+
+        if valor < q[0]:
+            q[0] = valor
+            k = 0
+        elif valor >= q[4]:
+            q[4] = valor
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= valor < q[i + 1])
+        n = self._posiciones
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._deseadas[i] += self._incrementos[i]
+
+        # Los marcadores interiores se acercan a su posición deseada de a un paso
+        for i in (1, 2, 3):
+            d = self._deseadas[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolica = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if q[i - 1] < parabolica < q[i + 1]:
+                    q[i] = parabolica
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def valor(self):
+        """Percentil estimado, o None si no hay valores"""
+        if self.cantidad == 0:
+            return None
+        if self.cantidad <= 5:
+            # Interpolación lineal, como numpy.percentile
+            posicion = self.p * (self.cantidad - 1)
+            inferior = int(posicion)
+            superior = min(inferior + 1, self.cantidad - 1)
+            return self._alturas[inferior] + (posicion - inferior) * (
+                self._alturas[superior] - self._alturas[inferior])
+        return self._alturas[2]
+
+
+class Percentiles:
+    """Percentiles 50, 90 y 99 de un flujo, con mínimo, máximo y media"""
+
+    __slots__ = ('_cuantiles', 'cantidad', 'suma', 'minimo', 'maximo')
+
+    def __init__(self, percentiles=(0.5, 0.9, 0.99)):
+        self._cuantiles = [CuantilP2(p) for p in percentiles]
+        self.cantidad = 0
+        self.suma = 0.0
+        self.minimo = None
+        self.maximo = None
+
+    def agregar(self, valor):
+        self.cantidad += 1
+        self.suma += valor
+        self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+        self.maximo = valor if self.maximo is None else max(self.maximo, valor)
+        for cuantil in self._cuantiles:
+            cuantil.agregar(valor)
+
+    def resumen(self, decimales=2):
+        if self.cantidad == 0:
+            return {'cantidad': 0}
+        resumen = {'cantidad': self.cantidad, 'media': round(self.suma / self.cantidad, decimales),
+                   'min': round(self.minimo, decimales), 'max': round(self.maximo, decimales)}
+        for cuantil in self._cuantiles:
+            resumen[f"p{cuantil.p * 100:g}"] = round(cuantil.valor(), decimales)
+        return resumen
+
+
+class EstadisticasRostro:
+    """
+    Agregados de un rostro durante toda la sesión, en memoria constante
+
+    Por frame suma el tiempo de cada emoción mostrada; por ventana cerrada
+    actualiza parpadeos, la frecuencia reciente (últimas `ventanas_recientes`
+    ventanas), el tiempo en cada estado y la duración de los tramos seguidos
+    en un mismo estado.
+    """
+
+    def __init__(self, ventanas_recientes=6):
+        self.ventanas = 0
+        self.parpadeos = 0
+        self.segundos = 0.0
+        self.segundos_emociones = Counter()
+        self.segundos_visible = 0.0
+        self.segundos_estados = Counter()
+        self.frecuencia = Percentiles()
+        self.tramos = {}
+        self._recientes = deque(maxlen=ventanas_recientes)
+        self._parpadeos_recientes = 0
+        self._segundos_recientes = 0.0
+        self._estado = None
+        self._tramo = 0.0
+
+    def registrar_frame(self, emociones, segundos):
+        self.segundos_visible += segundos
+        for emocion in emociones:
+            self.segundos_emociones[emocion] += segundos
+
+    def registrar_ventana(self, parpadeos, segundos, estado):
+        self.ventanas += 1
+        self.parpadeos += parpadeos
+        self.segundos += segundos
+        if segundos > 0:
+            self.frecuencia.agregar(parpadeos / segundos)
+
+        # Suma móvil de las últimas ventanas: se resta la que sale del deque
+        if len(self._recientes) == self._recientes.maxlen:
+            parpadeos_salida, segundos_salida = self._recientes[0]
+            self._parpadeos_recientes -= parpadeos_salida
+            self._segundos_recientes -= segundos_salida
+        self._recientes.append((parpadeos, segundos))
+        self._parpadeos_recientes += parpadeos
+        self._segundos_recientes += segundos
+
+        self.segundos_estados[estado] += segundos
+        if estado != self._estado:
+            self._terminar_tramo()
+            self._estado = estado
+        self._tramo += segundos
+
+    def _terminar_tramo(self):
+        if self._estado is not None and self._tramo > 0:
+            self.tramos.setdefault(self._estado, Percentiles()).agregar(self._tramo)
+        self._tramo = 0.0
+
+    def parpadeos_por_minuto(self):
+        """Frecuencia de parpadeo de las últimas ventanas"""
+        if self._segundos_recientes <= 0:
+            return 0.0
+        return self._parpadeos_recientes / self._segundos_recientes * 60
+
+    def resumen(self):
+        # Percentiles de los tramos terminados; el tramo en curso se informa aparte
+        tramos = {estado: percentiles.resumen() for estado, percentiles in self.tramos.items()}
+        if self._estado is not None and self._tramo > 0:
+            tramos.setdefault(self._estado, {'cantidad': 0})['en_curso'] = round(self._tramo, 1)
+
+        visible = self.segundos_visible or 1.0
+        return {
+            'ventanas': self.ventanas,
+            'segundos': round(self.segundos, 1),
+            'parpadeos': self.parpadeos,
+            'parpadeos_por_minuto': round(self.parpadeos / self.segundos * 60, 2) if self.segundos else 0.0,
+            'parpadeos_por_minuto_reciente': round(self.parpadeos_por_minuto(), 2),
+            'frecuencia_por_ventana': self.frecuencia.resumen(),
+            'segundos_visible': round(self.segundos_visible, 1),
+            'emociones': {emocion: {'segundos': round(segundos, 1), 'pct': round(segundos / visible * 100, 1)}
+                          for emocion, segundos in self.segundos_emociones.most_common()},
+            'estados': {estado: round(segundos, 1) for estado, segundos in self.segundos_estados.most_common()},
+            'tramos_estado': tramos
+        }
+
+
+class EstadisticasSesion:
+    """
+    Resumen incremental de una sesión del detector en vivo
+
+    Reemplaza la lista de registros que crecía con la sesión: cada ventana
+    se escribe en el store al cerrarse y aquí solo quedan agregados de
+    tamaño fijo por rostro. Con `ruta`, el resumen JSON se reescribe de forma
+    atómica en cada ventana, así una sesión interrumpida conserva el último.
+    """
+
+    def __init__(self, sesion=None, ruta=None, ventanas_recientes=6, max_segundos_frame=1.0):
+        self.sesion = sesion
+        self.ruta = ruta
+        self.ventanas_recientes = ventanas_recientes
+        # Un hueco entre frames (pausa, reconexión) no se cuenta como tiempo en una emoción
+        self.max_segundos_frame = max_segundos_frame
+        self.registros = 0
+        self.frames = 0
+        self.rostros = {}
+        self._inicio = None
+        self._ultimo = None
+
+    def _rostro(self, id_rostro):
+        if id_rostro not in self.rostros:
+            self.rostros[id_rostro] = EstadisticasRostro(self.ventanas_recientes)
+        return self.rostros[id_rostro]
+
+    def registrar_frame(self, timestamp, rostros):
+        """
+        Args:
+            timestamp: Tiempo del frame en segundos
+            rostros: Pares (id del rostro, emociones mostradas) de los rostros del frame
+        """
+        self.frames += 1
+        if self._inicio is None:
+            self._inicio = timestamp
+        segundos = 0.0 if self._ultimo is None else min(max(timestamp - self._ultimo, 0.0), self.max_segundos_frame)
+        self._ultimo = timestamp
+        for id_rostro, emociones in rostros:
+            self._rostro(id_rostro).registrar_frame(emociones, segundos)
+
+    def registrar_ventana(self, id_rostro, parpadeos, segundos, estado):
+        self.registros += 1
+        self._rostro(id_rostro).registrar_ventana(parpadeos, segundos, estado)
+
+    def resumen(self):
+        return {
+            'sesion': self.sesion,
+            'segundos': round(self._ultimo - self._inicio, 1) if self._inicio is not None else 0.0,
+            'frames': self.frames,
+            'registros': self.registros,
+            'rostros': {str(id_rostro): estadisticas.resumen() for id_rostro, estadisticas in self.rostros.items()}
+        }
+
+    def guardar(self):
+        """Reescribe el resumen JSON (temporal + os.replace); no hace nada sin ruta"""
+        if not self.ruta:
+            return
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.resumen(), f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self.ruta)
@@ -0,0 +1,66 @@
+from collections import Counter, deque
+
+
+class SuavizadorEmociones:
+    """
+    Ventana deslizante de emociones por frame con conteos incrementales
+
+    Cada frame suma un voto a cada emoción detectada y, al llenarse la ventana,
+    resta los votos del frame que sale: actualizar() cuesta O(emociones del
+    frame), sin recorrer el historial. Opcionalmente mantiene un promedio
+    exponencial de la confianza de cada emoción.
+
+    Args:
+        longitud: Número de frames en la ventana
+        umbral_votos: Frames mínimos en los que debe aparecer una emoción
+        decaimiento: Factor (0-1) del promedio exponencial de confianza; None lo desactiva
+    """
+
+    def __init__(self, longitud=5, umbral_votos=2, decaimiento=None):
+        self.longitud = longitud
+        self.umbral_votos = umbral_votos
+        self.decaimiento = decaimiento
+        self._ventana = deque()
+        self._votos = Counter()
+        self._confianza = {}
+
+    def actualizar(self, emociones, confianza=None):
+        """
+        Agrega las emociones de un frame
+
+        Returns:
+            list: Emociones con al menos umbral_votos votos, de más a menos frecuente
+        """
+        frame = frozenset(emociones)
+        self._ventana.append(frame)
+        self._votos.update(frame)
+        if len(self._ventana) > self.longitud:
+            saliente = self._ventana.popleft()
+            self._votos.subtract(saliente)
+            for emocion in saliente:
+                if self._votos[emocion] <= 0:
+                    del self._votos[emocion]
+
+        if self.decaimiento is not None:
+            confianza = confianza or {}
+            for emocion in set(self._confianza) | frame:
+                valor = confianza.get(emocion, 100.0) if emocion in frame else 0.0
+                previo = self._confianza.get(emocion, valor)
+                self._confianza[emocion] = self.decaimiento * previo + (1 - self.decaimiento) * valor
+            # Se olvidan las emociones que ya no están en la ventana
+            for emocion in [e for e in self._confianza if e not in self._votos]:
+                del self._confianza[emocion]
+
+        return self.frecuentes()
+
+    def frecuentes(self):
+        return [emocion for emocion, votos in self._votos.most_common() if votos >= self.umbral_votos]
+
+    def confianza(self):
+        """Confianza suavizada por emoción (vacía si no hay decaimiento)"""
+        return {emocion: round(valor, 1) for emocion, valor in self._confianza.items()}
+
+    def reiniciar(self):
+        self._ventana.clear()
+        self._votos.clear()
+        self._confianza.clear()
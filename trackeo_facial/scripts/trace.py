@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import random
+
+logger = logging.getLogger('trackeo.traza')
+
+_muestreo = 0.0
+
+
+class TrazaDeteccion:
+    """
+    Registro estructurado de un análisis: medidas usadas y reglas que se activaron
+
+    Reemplaza los print de depuración: solo se construye cuando el trazado
+    está activo, así que en producción no cuesta nada.
+    """
+
+    __slots__ = ('medidas', 'reglas', 'emociones', 'errores')
+
+    def __init__(self):
+        self.medidas = {}
+        self.reglas = []
+        self.emociones = []
+        self.errores = []
+
+    def medida(self, nombre, valor):
+        self.medidas[nombre] = round(float(valor), 3)
+
+    def regla(self, emocion, confianza=None, **valores):
+        """Anota una regla que se activó con los valores que la dispararon"""
+        self.reglas.append({
+            'emocion': emocion,
+            'confianza': confianza,
+            'valores': {clave: round(float(valor), 3) if isinstance(valor, float) else valor
+                        for clave, valor in valores.items()}
+        })
+
+    def error(self, mensaje):
+        self.errores.append(mensaje)
+
+    def a_dict(self):
+        return {'medidas': self.medidas, 'reglas': self.reglas,
+                'emociones': self.emociones, 'errores': self.errores}
+
+    def __repr__(self):
+        return f"TrazaDeteccion({json.dumps(self.a_dict(), ensure_ascii=False)})"
+
+
+def configurar_traza(muestreo):
+    """
+    Fracción (0-1) de análisis que se trazan y se emiten por el logger 'trackeo.traza'
+
+    Con 0 (el valor por defecto) no se crea ninguna traza.
+    """
+    global _muestreo
+    _muestreo = max(0.0, min(1.0, float(muestreo)))
+    if _muestreo > 0 and not logger.handlers:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(manejador)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+
+
+def muestrear_traza():
+    """Devuelve una traza nueva si este análisis entra en la muestra, o None"""
+    if _muestreo <= 0.0:
+        return None
+    if _muestreo < 1.0 and random.random() >= _muestreo:
+        return None
+    return TrazaDeteccion()
+
+
+def emitir_traza(traza, **contexto):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({**contexto, **traza.a_dict()}, ensure_ascii=False))
+
+
+configurar_traza(os.environ.get('TRAZA_MUESTREO', 0))
@@ -0,0 +1,107 @@
+import numpy as np
+
+from scripts.blinks import EstadoParpadeo
+from scripts.smoothing import SuavizadorEmociones
+
+
+class EstadoRostro:
+    """Estado compacto de un rostro rastreado: calibración, suavizado, parpadeos y calidad"""
+
+    __slots__ = ('id', 'centro', 'ancho', 'frames_perdido',
+                 'face_width_baseline', 'calibration_frames',
+                 'suavizador', 'emociones_frecuentes', 'confianza',
+                 'parpadeos', 'parpadeo', 'calidad')
+
+    def __init__(self, id_rostro=0, centro=None, ancho=None, suavizado=None):
+        self.id = id_rostro
+        self.centro = centro
+        self.ancho = ancho
+        self.frames_perdido = 0
+
+        # Calibración para normalizar medidas (ver EmotionDetector.calibrar_rostro)
+        self.face_width_baseline = None
+        self.calibration_frames = 0
+
+        self.suavizador = SuavizadorEmociones(**(suavizado or {}))
+        self.emociones_frecuentes = ["Neutral"]
+        self.confianza = {}
+
+        # Parpadeos de la ventana en curso y estado de la máquina de parpadeos (scripts.blinks)
+        self.parpadeos = 0
+        self.parpadeo = EstadoParpadeo()
+
+        # Última evaluación del filtro de calidad (scripts.quality); None si no hay filtro
+        self.calidad = None
+
+
+class RastreadorRostros:
+    """
+    Rastreador ligero que mantiene IDs estables entre frames
+
+    Asocia cada rostro detectado con el rastro más cercano (distancia entre
+    centros medida en anchos de rostro), de forma voraz de menor a mayor
+    distancia. Los rastros que no aparecen durante max_frames_perdido frames
+    se descartan.
+    """
+
+    def __init__(self, distancia_max=0.6, max_frames_perdido=15, suavizado=None):
+        self.distancia_max = distancia_max
+        self.max_frames_perdido = max_frames_perdido
+        self.suavizado = suavizado
+        self.rostros = {}
+        self._siguiente_id = 1
+
+    def actualizar(self, centros, anchos):
+        """
+        Asocia las detecciones del frame con los rostros rastreados
+
+        Args:
+            centros: Array (F, 2) con el centro de cada rostro en píxeles
+            anchos: Secuencia (F,) con el ancho de cada rostro en píxeles
+
+        Returns:
+            list: EstadoRostro de cada detección, en el mismo orden de entrada
+        """
+        centros = np.asarray(centros, dtype=np.float32).reshape(-1, 2)
+        anchos = np.asarray(anchos, dtype=np.float32).reshape(-1)
+        asignados = [None] * len(centros)
+        libres = set(self.rostros)
+
+        if self.rostros and len(centros):
+            ids = list(self.rostros)
+            previos = np.array([self.rostros[i].centro for i in ids], dtype=np.float32)
+            escala = np.array([max(self.rostros[i].ancho or 1.0, 1.0) for i in ids], dtype=np.float32)
+            # Matriz (rastros, detecciones) de distancias normalizadas por el ancho del rostro
+            costos = np.linalg.norm(previos[:, None, :] - centros[None, :, :], axis=-1) / escala[:, None]
+
+            for plano in np.argsort(costos, axis=None):
+                fila, col = divmod(int(plano), len(centros))
+                if costos[fila, col] > self.distancia_max:
+                    break
+                id_rostro = ids[fila]
+                if asignados[col] is not None or id_rostro not in libres:
+                    continue
+                asignados[col] = self.rostros[id_rostro]
+                libres.discard(id_rostro)
+
+        for col, estado in enumerate(asignados):
+            if estado is None:
+                estado = EstadoRostro(self._siguiente_id, suavizado=self.suavizado)
+                self.rostros[estado.id] = estado
+                self._siguiente_id += 1
+                asignados[col] = estado
+            estado.centro = centros[col]
+            estado.ancho = float(anchos[col])
+            estado.frames_perdido = 0
+
+        for id_rostro in libres:
+            estado = self.rostros[id_rostro]
+            estado.frames_perdido += 1
+            if estado.frames_perdido > self.max_frames_perdido:
+                del self.rostros[id_rostro]
+
+        return asignados
+
+    def activos(self):
+        """Rostros vistos en el último frame"""
+        return [estado for estado in self.rostros.values() if estado.frames_perdido == 0]
@@ -0,0 +1,116 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from scripts.result_cache import hash_imagen
+
+
+def decodificar_imagen(datos, max_lado=None):
+    """
+    Decodifica una imagen desde memoria, sin pasar por disco
+
+    Las características se calculan sobre landmarks normalizados (0-1) y se
+    escalan con el tamaño original, así que reducir la imagen antes de
+    FaceMesh no cambia la escala de las medidas.
+
+    Args:
+        datos: Bytes de la imagen codificada (se leen sin copiar)
+        max_lado: Si el lado mayor lo supera, la imagen se reduce a ese tamaño
+
+    Returns:
+        tuple: (imagen BGR posiblemente reducida, (alto, ancho) original) o (None, None)
+    """
+    import cv2
+
+    imagen = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if imagen is None:
+        return None, None
+
+    alto, ancho = imagen.shape[:2]
+    if max_lado and max(alto, ancho) > max_lado:
+        escala = max_lado / max(alto, ancho)
+        imagen = cv2.resize(imagen, (max(1, round(ancho * escala)), max(1, round(alto * escala))),
+                            interpolation=cv2.INTER_AREA)
+    return imagen, (alto, ancho)
+
+
+def max_lado_configurado():
+    """Lado máximo antes de FaceMesh según UPLOAD_MAX_SIDE (0 desactiva la reducción)"""
+    return int(os.environ.get('UPLOAD_MAX_SIDE', 1280)) or None
+
+
+class AlmacenUploads:
+    """
+    Guarda los originales subidos fuera del camino de la petición
+
+    Cada archivo se nombra por el hash de su contenido, así dos subidas con el
+    mismo nombre no se pisan y una imagen repetida se escribe una sola vez.
+    """
+
+    def __init__(self, directorio="uploads", hilos=1):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="uploads")
+        self._lock = threading.Lock()
+        self._contadores = {'escritos': 0, 'repetidos': 0, 'errores': 0}
+
+    def ruta(self, digest, nombre):
+        extension = os.path.splitext(nombre)[1].lower() or '.jpg'
+        return os.path.join(self.directorio, f"{digest}{extension}")
+
+    def guardar(self, datos, nombre, digest=None):
+        """Programa la escritura del original y devuelve la ruta que tendrá"""
+        ruta = self.ruta(digest or hash_imagen(datos), nombre)
+        self._executor.submit(self._escribir, ruta, datos)
+        return ruta
+
+    def _escribir(self, ruta, datos):
+        if os.path.exists(ruta):
+            self._contar('repetidos')
+            return
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, 'wb') as f:
+                f.write(datos)
+            os.replace(temporal, ruta)
+            self._contar('escritos')
+        except OSError:
+            self._contar('errores')
+
+    def _contar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def metricas(self):
+        with self._lock:
+            return dict(self._contadores)
+
+    def cerrar(self):
+        """Espera a que terminen las escrituras pendientes"""
+        self._executor.shutdown(wait=True)
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen():
+    """Almacén del proceso, o None si UPLOADS_PERSIST=0 desactiva el guardado"""
+    global _almacen
+    if os.environ.get('UPLOADS_PERSIST', '1') == '0':
+        return None
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                _almacen = AlmacenUploads(os.environ.get('UPLOADS_DIR', "uploads"))
+    return _almacen
+
+
+def cerrar_almacen():
+    global _almacen
+    with _almacen_lock:
+        if _almacen is not None:
+            _almacen.cerrar()
+            _almacen = None